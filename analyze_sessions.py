@@ -0,0 +1,167 @@
+"""Per-trial metrics for every recorded session, computed in parallel.
+
+    python analyze_sessions.py results --output summary.csv --jobs 8
+
+Finds every ASC export (edf2asc output, *.asc) under the given folders,
+converts it to session columns if needed (asc_session.py) and computes one
+row per trial:
+
+    session, trial, result     TRIALID and TRIAL_RESULT
+    outcome                    response (key_pressed), timeout (time_out),
+                               skipped, disconnected or terminated
+    rt                         !V TRIAL_VAR RT, and every other TRIAL_VAR
+    fixations, fixation_ms     count and mean duration, one eye (left if
+                               recorded)
+    dwell:<area>               total fixation time in each interest area
+                               declared with !V IAREA, by label (areas
+                               sharing a label add up) or else by id
+
+Each session is analysed by its own worker process. Results are cached in
+<folder>/.analysis/ under the SHA-1 of the export, so a rerun only analyses
+sessions that are new or have changed. The rows of all sessions are merged
+into one CSV table.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from asc_session import Session
+from gaze_frames import EYE_LEFT, EYE_RIGHT
+from interest_areas import InterestAreaIndex, parse_interest_area
+
+# Change when the metrics change, so cached results are recomputed
+ANALYSIS_VERSION = 2
+
+OUTCOMES = {'key_pressed': 'response', 'time_out': 'timeout', 'trial_skipped_by_user': 'skipped',
+            'tracker_disconnected': 'disconnected', 'terminated_by_user': 'terminated'}
+
+
+def find_sessions(folders):
+    paths = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and not d.endswith('.columns')]
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith('.asc'))
+    return sorted(paths)
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyze_trial(session, index):
+    trial = session.trials[index]
+    tables = session.trial(index)
+    row = {'trial': trial['id'], 'result': trial['result'], 'outcome': ''}
+    for name, value in trial['variables'].items():
+        row['rt' if name == 'RT' else name] = value
+
+    areas = []
+    for text in session.message_texts(tables['messages']):
+        if text in OUTCOMES:
+            row['outcome'] = OUTCOMES[text]
+        try:
+            area = parse_interest_area(text)
+        except ValueError:
+            area = None
+        if area is not None:
+            areas.append(area)
+
+    fixations = tables['fixations']
+    eye = fixations['eye']
+    eye = EYE_LEFT if (eye == EYE_LEFT).any() else EYE_RIGHT
+    chosen = np.flatnonzero(fixations['eye'] == eye)
+    duration = fixations['end'][chosen] - fixations['start'][chosen]
+    row['fixations'] = len(chosen)
+    row['fixation_ms'] = round(float(duration.mean()), 1) if len(chosen) else ''
+
+    if areas:
+        hits = InterestAreaIndex(areas).hit_test(fixations['x'][chosen], fixations['y'][chosen])
+        for i, area in enumerate(areas):
+            key = f'dwell:{area.label or area.id}'  # areas sharing a label add up
+            row[key] = row.get(key, 0.0) + float(duration[hits == i].sum())
+    return row
+
+
+def analyze_session(path, cache_folder):
+    """Rows of one session, from the cache if the export has not changed.
+
+    Runs in a worker process. Returns (path, rows, cached).
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = file_hash(path)
+    cache_path = os.path.join(cache_folder, f'{key}.json')
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['version'] == ANALYSIS_VERSION:
+            return path, [{'session': name, **row} for row in cached['rows']], True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    session = Session.open(path)
+    rows = [analyze_trial(session, i) for i in range(len(session.trials))]
+    os.makedirs(cache_folder, exist_ok=True)
+    # a unique temporary name, other workers may be writing the same key
+    temp = f'{cache_path}.{os.getpid()}.part'
+    with open(temp, 'w') as f:
+        json.dump({'version': ANALYSIS_VERSION, 'rows': rows}, f)
+    os.replace(temp, cache_path)
+    return path, [{'session': name, **row} for row in rows], False
+
+
+def write_table(rows, output):
+    columns = []
+    for row in rows:
+        columns.extend(name for name in row if name not in columns)
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folders', nargs='*', default=['results'])
+    parser.add_argument('--output', default='summary.csv')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args()
+
+    paths = find_sessions(args.folders)
+    if not paths:
+        print(f"No ASC exports found under {', '.join(args.folders)}")
+        return
+    start = time.perf_counter()
+    results = {}
+    cached = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        cache_folder = os.path.join(args.folders[0], '.analysis')
+        futures = {pool.submit(analyze_session, path, cache_folder): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                path, rows, hit = future.result()
+            except Exception as e:
+                print(f'Error analysing {futures[future]}: {e}')
+                continue
+            results[path] = rows
+            cached += hit
+
+    rows = [row for path in sorted(results) for row in results[path]]
+    write_table(rows, args.output)
+    print(f'{len(results)} sessions ({cached} cached), {len(rows)} trials in '
+          f'{time.perf_counter() - start:.1f} s -> {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""EDF-to-ASC exports as memory-mapped column files.
+
+    python asc_session.py results/TEST_2024_01_01_10_00/TEST_2024_01_01_10_00.asc
+
+convert() reads an ASC export once, front to back, and writes every table
+column by column into raw binary files next to a session.json manifest:
+
+    samples     SAMPLE_DTYPE rows (see gaze_frames.py), MISSING_DATA gaze
+                while the eye was lost or not recorded
+    fixations   start, end, x, y, pupil, eye
+    saccades    start, end, start_x, start_y, end_x, end_y, amplitude,
+                peak_velocity, eye
+    blinks      start, end, eye
+    messages    time, and the text as an offset and length into one UTF-8
+                text file
+
+Rows are buffered in blocks of BLOCK_LINES lines, so memory stays flat
+whatever the size of the export. The manifest holds one entry per trial
+(from TRIALID to TRIAL_RESULT) with its id, result, !V TRIAL_VAR values and
+the row range it covers in each table.
+
+load() maps the columns back into memory without reading them, so opening
+a converted session is near-instant, and Session.trial() slices one trial
+out of every table without looking at the others. Session.open() converts
+an export only if it has changed since its last conversion.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from gaze_frames import (SAMPLE_DTYPE, MISSING_DATA, EYE_LEFT, EYE_RIGHT,
+                         STATUS_LEFT_MISSING, STATUS_RIGHT_MISSING)
+
+FORMAT_VERSION = 1
+BLOCK_LINES = 100000
+
+FIXATION_DTYPE = np.dtype([
+    ('start', '<f8'), ('end', '<f8'),
+    ('x', '<f4'), ('y', '<f4'), ('pupil', '<f4'),
+    ('eye', 'u1'),
+])
+
+SACCADE_DTYPE = np.dtype([
+    ('start', '<f8'), ('end', '<f8'),
+    ('start_x', '<f4'), ('start_y', '<f4'), ('end_x', '<f4'), ('end_y', '<f4'),
+    ('amplitude', '<f4'), ('peak_velocity', '<f4'),
+    ('eye', 'u1'),
+])
+
+BLINK_DTYPE = np.dtype([('start', '<f8'), ('end', '<f8'), ('eye', 'u1')])
+
+MESSAGE_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8'), ('length', '<u4')])
+
+TABLES = {'samples': SAMPLE_DTYPE, 'fixations': FIXATION_DTYPE, 'saccades': SACCADE_DTYPE,
+          'blinks': BLINK_DTYPE, 'messages': MESSAGE_DTYPE}
+
+_EYES = {'L': EYE_LEFT, 'R': EYE_RIGHT}
+
+
+def _float(token):
+    return np.nan if token == '.' else float(token)
+
+
+class _TableWriter:
+    """Buffers rows of one table and appends them column by column."""
+
+    def __init__(self, folder, name, dtype):
+        self.name = name
+        self.dtype = dtype
+        self.count = 0
+        self.rows = []
+        self._files = {field: open(os.path.join(folder, f'{name}.{field}.bin'), 'wb')
+                       for field in dtype.names}
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BLOCK_LINES:
+            self.flush()
+
+    def write(self, block):
+        for field, f in self._files.items():
+            f.write(np.ascontiguousarray(block[field]).tobytes())
+        self.count += len(block)
+
+    def flush(self):
+        if self.rows:
+            self.write(np.array(self.rows, dtype=self.dtype))
+            self.rows = []
+
+    def pending(self):
+        """Rows written or buffered so far, for the trial index."""
+        return self.count + len(self.rows)
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+
+class _SampleWriter(_TableWriter):
+    """Sample lines are kept as text tokens and converted a block at a time."""
+
+    def __init__(self, folder):
+        super().__init__(folder, 'samples', SAMPLE_DTYPE)
+        self.eyes = EYE_LEFT | EYE_RIGHT
+        self.columns = 7
+
+    def start_block(self, eyes):
+        self.flush()
+        self.eyes = eyes
+        self.columns = 7 if eyes == EYE_LEFT | EYE_RIGHT else 4
+
+    def append(self, tokens):
+        if len(tokens) < self.columns:
+            return  # not a sample line of the current recording
+        self.rows.append(tokens[:self.columns])
+        if len(self.rows) >= BLOCK_LINES:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        text = np.array(self.rows)
+        self.rows = []
+        text[text == '.'] = 'nan'
+        values = text.astype(np.float64)
+        block = np.zeros(len(values), dtype=SAMPLE_DTYPE)
+        block['time'] = values[:, 0]
+        if self.eyes == EYE_LEFT | EYE_RIGHT:
+            left, right = values[:, 1:4], values[:, 4:7]
+        elif self.eyes == EYE_LEFT:
+            left, right = values[:, 1:4], None
+        else:
+            left, right = None, values[:, 1:4]
+        status = np.zeros(len(values), dtype=np.uint8)
+        for prefix, eye, missing_bit in (('left', left, STATUS_LEFT_MISSING),
+                                         ('right', right, STATUS_RIGHT_MISSING)):
+            if eye is None:
+                block[prefix + '_x'] = block[prefix + '_y'] = MISSING_DATA
+                status |= missing_bit
+                continue
+            missing = np.isnan(eye[:, 0]) | np.isnan(eye[:, 1])
+            block[prefix + '_x'] = np.where(missing, MISSING_DATA, eye[:, 0])
+            block[prefix + '_y'] = np.where(missing, MISSING_DATA, eye[:, 1])
+            block[prefix + '_pupil'] = np.nan_to_num(eye[:, 2])
+            status |= missing * np.uint8(missing_bit)
+        block['eyes'] = self.eyes
+        block['status'] = status
+        self.write(block)
+
+
+def _split_message(rest):
+    """Split 'time [offset] text' into (time, text), applying the offset."""
+    time_token, _, text = rest.partition(' ')
+    time = float(time_token)
+    offset, _, remainder = text.partition(' ')
+    if remainder and offset.lstrip('-').isdigit():
+        time -= int(offset)
+        text = remainder
+    return time, text
+
+
+def convert(asc_path, folder=None):
+    """Convert an ASC export into column files. Returns the output folder."""
+    folder = folder or os.path.splitext(asc_path)[0] + '.columns'
+    os.makedirs(folder, exist_ok=True)
+    writers = {'samples': _SampleWriter(folder)}
+    for name, dtype in TABLES.items():
+        if name != 'samples':
+            writers[name] = _TableWriter(folder, name, dtype)
+    samples, messages = writers['samples'], writers['messages']
+    text_file = open(os.path.join(folder, 'messages.text'), 'wb')
+    text_size = 0
+    trials = []
+    trial = None
+
+    def end_trial():
+        if trial is not None:
+            trial['stop'] = {name: writer.pending() for name, writer in writers.items()}
+            trials.append(trial)
+
+    try:
+        with open(asc_path, encoding='utf-8', errors='replace') as asc:
+            for line in asc:
+                first = line[:1]
+                if '0' <= first <= '9':
+                    samples.append(line.split())
+                    continue
+                parts = line.split()
+                if not parts:
+                    continue
+                kind = parts[0]
+                if kind == 'MSG':
+                    time, text = _split_message(line[3:].strip())
+                    encoded = text.encode('utf-8')
+                    messages.append((time, text_size, len(encoded)))
+                    text_file.write(encoded)
+                    text_size += len(encoded)
+                    words = text.split()
+                    if words and words[0] == 'TRIALID':
+                        end_trial()
+                        trial = {'id': ' '.join(words[1:]), 'start_time': time, 'end_time': None,
+                                 'result': None, 'variables': {},
+                                 'start': {name: writer.pending() for name, writer in writers.items()}}
+                        trial['start']['messages'] -= 1  # the TRIALID message itself
+                    elif trial is not None and words[:2] == ['!V', 'TRIAL_VAR'] and len(words) >= 3:
+                        trial['variables'][words[2]] = ' '.join(words[3:])
+                    elif trial is not None and words and words[0] == 'TRIAL_RESULT':
+                        trial['result'] = int(words[1]) if len(words) > 1 else None
+                        trial['end_time'] = time
+                        end_trial()
+                        trial = None
+                elif kind == 'EFIX':
+                    writers['fixations'].append((float(parts[2]), float(parts[3]), _float(parts[5]),
+                                                 _float(parts[6]), _float(parts[7]), _EYES[parts[1]]))
+                elif kind == 'ESACC':
+                    writers['saccades'].append((float(parts[2]), float(parts[3]), _float(parts[5]),
+                                                _float(parts[6]), _float(parts[7]), _float(parts[8]),
+                                                _float(parts[9]), _float(parts[10]), _EYES[parts[1]]))
+                elif kind == 'EBLINK':
+                    writers['blinks'].append((float(parts[2]), float(parts[3]), _EYES[parts[1]]))
+                elif kind == 'START':
+                    eyes = (EYE_LEFT if 'LEFT' in parts else 0) | (EYE_RIGHT if 'RIGHT' in parts else 0)
+                    samples.start_block(eyes)
+        end_trial()
+    finally:
+        text_file.close()
+        for writer in writers.values():
+            writer.close()
+
+    stat = os.stat(asc_path)
+    manifest = {'version': FORMAT_VERSION, 'source': os.path.abspath(asc_path),
+                'source_size': stat.st_size, 'source_mtime': stat.st_mtime,
+                'tables': {name: writer.count for name, writer in writers.items()},
+                'trials': trials}
+    # the manifest is written last: a folder without one is not a session
+    with open(os.path.join(folder, 'session.json.part'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(folder, 'session.json.part'), os.path.join(folder, 'session.json'))
+    return folder
+
+
+class Table:
+    """Columns of one table as (read-only) arrays, usually memory-mapped."""
+
+    def __init__(self, dtype, columns, count):
+        self.dtype = dtype
+        self.columns = columns
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def rows(self, start, stop):
+        """The rows start..stop as a Table of views, nothing is copied."""
+        return Table(self.dtype, {name: column[start:stop] for name, column in self.columns.items()},
+                     max(0, min(stop, self.count) - start))
+
+    def to_array(self):
+        """Copy the rows into one structured array."""
+        block = np.empty(self.count, dtype=self.dtype)
+        for name, column in self.columns.items():
+            block[name] = column
+        return block
+
+
+class Session:
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'session.json')) as f:
+            self.manifest = json.load(f)
+        self.trials = self.manifest['trials']
+        self.tables = {name: self._map(name, dtype) for name, dtype in TABLES.items()}
+        text_path = os.path.join(folder, 'messages.text')
+        self._text = (np.memmap(text_path, dtype=np.uint8, mode='r') if os.path.getsize(text_path)
+                      else np.empty(0, dtype=np.uint8))
+
+    def _map(self, name, dtype):
+        count = self.manifest['tables'][name]
+        columns = {}
+        for field in dtype.names:
+            path = os.path.join(self.folder, f'{name}.{field}.bin')
+            columns[field] = (np.memmap(path, dtype=dtype[field], mode='r', shape=(count,)) if count
+                              else np.empty(0, dtype=dtype[field]))
+        return Table(dtype, columns, count)
+
+    @classmethod
+    def open(cls, asc_path, folder=None):
+        """Load the conversion of asc_path, converting it first if needed."""
+        folder = folder or os.path.splitext(asc_path)[0] + '.columns'
+        try:
+            session = cls(folder)
+            stat = os.stat(asc_path)
+            manifest = session.manifest
+            if (manifest['version'] == FORMAT_VERSION and manifest['source_size'] == stat.st_size
+                    and manifest['source_mtime'] == stat.st_mtime):
+                return session
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls(convert(asc_path, folder))
+
+    def __getattr__(self, name):
+        if name in TABLES:
+            return self.tables[name]
+        raise AttributeError(name)
+
+    def message_texts(self, table=None):
+        """Decode the texts of a messages table (default: all messages)."""
+        table = table if table is not None else self.tables['messages']
+        return [bytes(self._text[offset:offset + length]).decode('utf-8')
+                for offset, length in zip(table['offset'].tolist(), table['length'].tolist())]
+
+    def trial(self, index):
+        """Every table restricted to one trial, as a dict of Tables."""
+        trial = self.trials[index]
+        return {name: table.rows(trial['start'][name], trial['stop'][name])
+                for name, table in self.tables.items()}
+
+
+def load(folder):
+    return Session(folder)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        session = Session.open(path)
+        counts = ', '.join(f'{count} {name}' for name, count in session.manifest['tables'].items())
+        print(f'{path}: {counts}, {len(session.trials)} trials -> {session.folder}')
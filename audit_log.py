@@ -0,0 +1,149 @@
+"""Append-only log of every command the server ran.
+
+    python audit_log.py logs/TEST_20240101_100000.jsonl [--command sendMessage]
+
+AuditLog.record() only puts a dict on a queue, so a request never waits for
+the disk. A background thread takes whatever has queued up, encodes it as
+JSON lines and writes it in one buffered write every flush_interval
+seconds. rotate() starts a new file for a new session (the server rotates
+on openEDF), in order with the records around it.
+
+Each record holds the request as received and these server_clock_ms times:
+
+    received    the request reached the server
+    dispatched  the pylink call started on the tracker worker
+    completed   the response was ready
+
+with the outcome (status, http_status, message), the tracker time of the
+command and, for back-dated messages, the offset. Records are written as
+they complete, so a background job, recorded once it has finished, follows
+the commands that ran after it started. Run as a script, this module prints
+the command timeline of one log file, ordered by received.
+"""
+
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+_ROTATE = object()
+_STOP = object()
+
+
+class AuditLog(threading.Thread):
+    def __init__(self, folder='logs', session='server', flush_interval=0.2):
+        super().__init__(name='audit-log', daemon=True)
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self.path = None
+        self.written = 0
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._sequence = 0
+        self._session = session
+
+    def record(self, **fields):
+        """Queue one record; returns at once."""
+        self._queue.put(fields)
+
+    def rotate(self, session):
+        """Write the following records to a new file for session."""
+        self._queue.put((_ROTATE, session))
+
+    def stop(self):
+        """Write everything queued so far and close the file."""
+        self._queue.put(_STOP)
+        self.join()
+
+    def _open(self, session):
+        os.makedirs(self.folder, exist_ok=True)
+        session = re.sub(r'[^\w.-]', '_', session).lstrip('.') or 'session'  # a file name, not a path
+        name = f"{session}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        self.path = os.path.join(self.folder, name)
+        self._file = open(self.path, 'a', buffering=1 << 16)
+
+    def run(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for item in items:
+                if item is _STOP:
+                    self._write(lines)
+                    if self._file is not None:
+                        self._file.close()
+                    return
+                if isinstance(item, tuple) and item[0] is _ROTATE:
+                    self._write(lines)
+                    lines = []
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                    self._session = item[1]
+                    continue
+                self._sequence += 1
+                lines.append(json.dumps({'seq': self._sequence, **item}, default=str))
+            self._write(lines)
+            time.sleep(self.flush_interval)  # let the next batch build up
+
+    def _write(self, lines):
+        if lines:
+            if self._file is None:
+                self._open(self._session)  # files are created on their first record
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            self.written += len(lines)
+
+
+def read_log(path):
+    """Yield the records of a log file in order."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def describe(request):
+    """A command request as text, e.g. startRecording(1, 1, 1, 1)."""
+    if isinstance(request, dict):
+        args = ', '.join(repr(arg) for arg in request.get('args', []))
+        return f"{request.get('name')}({args})"
+    return str(request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the command timeline of an audit log')
+    parser.add_argument('path')
+    parser.add_argument('--command', help='only commands with this name')
+    parser.add_argument('--errors', action='store_true', help='only failed commands')
+    args = parser.parse_args()
+
+    start = None
+    print(f"{'time (s)':>10} {'queued':>8} {'run':>8}  {'status':<8} command")
+    # jobs are written when they finish; sort() keeps the file order on ties
+    for record in sorted(read_log(args.path), key=lambda record: record['received']):
+        text = describe(record.get('request'))
+        if args.command and not text.startswith(args.command):
+            continue
+        if args.errors and record.get('status') == 'success':
+            continue
+        received, dispatched, completed = record['received'], record.get('dispatched'), record['completed']
+        if start is None:
+            start = received
+        queued = f'{dispatched - received:8.1f}' if dispatched is not None else f"{'':>8}"
+        run = f'{completed - dispatched:8.1f}' if dispatched is not None else f'{completed - received:8.1f}'
+        line = f"{(received - start) / 1000:10.3f} {queued} {run}  {record.get('status', ''):<8} {text}"
+        if record.get('status') != 'success' and record.get('message'):
+            line += f"  ({record['message']})"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
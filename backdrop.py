@@ -0,0 +1,160 @@
+"""Host PC backdrop images, converted once and kept in memory.
+
+bitmapBackdrop() takes the image as rows of (r, g, b) tuples. Building that
+pixel by pixel through PIL is slow at 1920x1080, so here the image is
+resized and cropped by PIL, read into a numpy array in one go, and the rows
+are built from whole columns at a time.
+
+BackdropCache keeps converted images keyed by (file, modification time,
+size, crop), evicting the least recently used ones beyond max_bytes. A
+conversion already in progress is shared rather than repeated, and
+prefetch() converts a whole trial list in the background at session start.
+
+Building the tuples is still most of the cost, about 0.4 s at 1920x1080,
+and as tuples that image takes about 150 MB (ROW_BYTES_PER_PIXEL) against
+6 MB as an array. So only the few images sent most recently, within
+rows_max_bytes, are also kept as rows: sending one of those again, or one
+whose rows were prepared ahead with pixels() (as the PsychoPy example does
+a trial ahead), is immediate, while any other image pays for its rows.
+"""
+
+import collections
+import concurrent.futures
+import gc
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Memory a pixel takes as a (r, g, b) tuple in a row list, on 64-bit CPython
+ROW_BYTES_PER_PIXEL = 72
+
+
+def load_image(path, width=0, height=0, crop=(0, 0, 0, 0)):
+    """Read an image as an (h, w, 3) uint8 array, resized then cropped.
+
+    width, height 0 keep the image size. crop is x, y, width, height on the
+    resized image, a crop width or height of 0 reaching the edge.
+    """
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        if width and height and image.size != (width, height):
+            image = image.resize((width, height))
+        pixels = np.asarray(image)
+    x, y, crop_width, crop_height = crop
+    pixels = pixels[y:y + crop_height if crop_height else None, x:x + crop_width if crop_width else None]
+    pixels = np.ascontiguousarray(pixels)
+    pixels.flags.writeable = False  # shared through the cache
+    return pixels
+
+
+def to_pylink(pixels):
+    """Rows of (r, g, b) tuples, the pixel format bitmapBackdrop() takes."""
+    # millions of new tuples would trigger garbage collections that find
+    # nothing, tuples of ints cannot form cycles
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [list(zip(r.tolist(), g.tolist(), b.tolist())) for r, g, b in (row.T for row in pixels)]
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class BackdropCache:
+    def __init__(self, folder='.', max_bytes=256 << 20, rows_max_bytes=400 << 20):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.rows_max_bytes = rows_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.row_hits = 0
+        self._images = collections.OrderedDict()
+        self._rows = collections.OrderedDict()  # key -> (rows, bytes), the working set as tuples
+        self._row_bytes = 0
+        self._pending = {}  # key -> Future of a conversion in progress
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _key(self, image_file, width, height, crop):
+        path = os.path.normpath(os.path.join(self.folder, image_file))
+        if os.path.isabs(image_file) or os.path.relpath(path, self.folder).split(os.sep)[0] == os.pardir:
+            raise ValueError(f'Backdrop image outside {self.folder}: {image_file!r}')
+        return path, os.path.getmtime(path), width, height, tuple(crop)
+
+    def image(self, image_file, width=0, height=0, crop=(0, 0, 0, 0)):
+        """The converted image as a read-only array, from the cache if possible."""
+        key = self._key(image_file, width, height, crop)
+        with self._lock:
+            pixels = self._images.get(key)
+            if pixels is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return pixels
+            self.misses += 1
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = concurrent.futures.Future()
+        if not owner:
+            return future.result()
+
+        try:
+            pixels = load_image(key[0], width, height, crop)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._images[key] = pixels
+            self._bytes += pixels.nbytes
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        future.set_result(pixels)
+        return pixels
+
+    def pixels(self, image_file, width=0, height=0, crop=(0, 0, 0, 0)):
+        """The image in bitmapBackdrop() format, shared: do not modify it."""
+        key = self._key(image_file, width, height, crop)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None:
+                self._rows.move_to_end(key)
+                self.row_hits += 1
+                return entry[0]
+        image = self.image(image_file, width, height, crop)
+        rows = to_pylink(image)
+        size = image.shape[0] * image.shape[1] * ROW_BYTES_PER_PIXEL
+        if size <= self.rows_max_bytes:
+            with self._lock:
+                if key not in self._rows:
+                    self._rows[key] = (rows, size)
+                    self._row_bytes += size
+                while self._row_bytes > self.rows_max_bytes:
+                    _, (_, evicted) = self._rows.popitem(last=False)
+                    self._row_bytes -= evicted
+        return rows
+
+    def prefetch(self, image_files, width=0, height=0, crop=(0, 0, 0, 0)):
+        """Convert image_files on a background thread. Returns the thread."""
+        def run():
+            for image_file in image_files:
+                try:
+                    self.image(image_file, width, height, crop)
+                except Exception as e:
+                    print(f'Error preparing backdrop {image_file}: {e}')
+
+        thread = threading.Thread(target=run, name='backdrop-prefetch', daemon=True)
+        thread.start()
+        return thread
+
+    def state(self):
+        with self._lock:
+            return {'images': len(self._images), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'row_images': len(self._rows),
+                    'row_bytes': self._row_bytes, 'rows_max_bytes': self.rows_max_bytes,
+                    'row_hits': self.row_hits}
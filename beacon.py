@@ -0,0 +1,87 @@
+"""Fire-and-forget messages in CORS simple requests.
+
+A JSON POST is not a CORS "simple" request, so a browser sends a preflight
+OPTIONS before each one and every marker costs two round trips. POST
+/beacon takes a text/plain body instead (or a form-encoded one with the
+text in the "lines" field), which needs no preflight and is what
+navigator.sendBeacon() sends for a string. The body holds one message per
+line:
+
+    <seq> <client_time> <text>
+
+seq numbers the client's messages from 1 up. client_time is a browser
+timestamp to back-date the message to, as for /send_command, or "-". The
+query string carries the client_id (as used with /sync) and, optionally,
+the station. The response is 204 with no body once every message has been
+sent or held (see message_policy.py). Messages that could not be sent for
+now -- the tracker busy, a timeout, too many messages held -- are reported
+with 503 and their seq numbers, {"failed": [seq, ...]}, and may be sent
+again; a message that can never be sent, e.g. for a malformed client_time,
+is only counted.
+
+A client may send a batch again when it cannot tell whether it arrived; a
+message whose seq was already seen from the same client_id is skipped,
+unless it failed as above. As seq starts from 1 again when a page reloads,
+a page should use a new client_id every time it loads.
+"""
+
+import collections
+import threading
+
+
+class BeaconError(ValueError):
+    pass
+
+
+def parse_lines(body):
+    """Yield (seq, client_time or None, text) for each non-empty line."""
+    for number, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        parts = line.split(' ', 2)
+        if len(parts) < 3:
+            raise BeaconError(f'Line {number}: expected "<seq> <client_time> <text>": {line!r}')
+        seq, client_time, text = parts
+        try:
+            yield int(seq), None if client_time == '-' else float(client_time), text
+        except ValueError:
+            raise BeaconError(f'Line {number}: seq and client_time must be numbers: {line!r}') from None
+
+
+class SequenceFilter:
+    """Remembers the last window seq numbers seen from each client.
+
+    Anything older than that window is taken as seen too.
+    """
+
+    def __init__(self, window=10000, max_clients=1000):
+        self.window = window
+        self.max_clients = max_clients
+        self._clients = collections.OrderedDict()  # client_id -> [highest seq, set of seen seqs]
+        self._lock = threading.Lock()
+
+    def first_time(self, client_id, seq):
+        """True the first time client_id sends seq, False for a duplicate."""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                client = self._clients[client_id] = [0, set()]
+                if len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)  # forget the least recent client
+            self._clients.move_to_end(client_id)
+            highest, seen = client
+            if seq in seen or seq <= highest - self.window:
+                return False
+            seen.add(seq)
+            if seq > highest:
+                client[0] = seq
+                if len(seen) > 2 * self.window:
+                    client[1] = {old for old in seen if old > seq - self.window}
+            return True
+
+    def forget(self, client_id, seq):
+        """Take seq as not seen, so that it is accepted when sent again."""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is not None:
+                client[1].discard(seq)
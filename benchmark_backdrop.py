@@ -0,0 +1,58 @@
+"""Time Host backdrop conversion (backdrop.py) against the per-pixel loop.
+
+    python benchmark_backdrop.py --width 1920 --height 1080
+
+Converts a synthetic image to the bitmapBackdrop() pixel format the way
+example_exp_psychopy.py used to (one PIL pixel access per pixel), with the
+vectorized conversion, from a BackdropCache holding the array (the
+rows still to build) and from one holding the rows too.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from backdrop import BackdropCache, load_image, to_pylink
+
+
+def per_pixel(path, width, height):
+    im = Image.open(path).resize((width, height))
+    img_pixels = im.load()
+    return [[img_pixels[i, j] for i in range(width)] for j in range(height)]
+
+
+def bench(label, fn):
+    start = time.perf_counter()
+    pixels = fn()
+    print(f"{label:<12} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    return pixels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'image.png')
+        rng = np.random.default_rng(0)
+        Image.fromarray(rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8)).save(path)
+
+        reference = bench('per pixel', lambda: per_pixel(path, args.width, args.height))
+        vectorized = bench('vectorized', lambda: to_pylink(load_image(path, args.width, args.height)))
+        cache = BackdropCache(folder, rows_max_bytes=0)
+        cache.image('image.png', args.width, args.height)
+        bench('cached', lambda: cache.pixels('image.png', args.width, args.height))
+        cache = BackdropCache(folder)
+        cache.pixels('image.png', args.width, args.height)
+        bench('cached rows', lambda: cache.pixels('image.png', args.width, args.height))
+        assert vectorized == reference, 'conversions disagree'
+
+
+if __name__ == '__main__':
+    main()
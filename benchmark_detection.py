@@ -0,0 +1,58 @@
+"""Throughput of the online event detectors (event_detection.py).
+
+    python benchmark_detection.py --rate 2000 --seconds 60 --block 8
+
+Generates binocular gaze with the simulated tracker's scanpath model, feeds
+it to each detector in blocks of --block samples, as the acquisition loop
+would, and reports how many times faster than real time each detector runs.
+Anything above 1x keeps up with the tracker.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from event_detection import IVTDetector, IDTDetector
+from gaze_frames import samples_to_array, EVENT_FIXATION, EVENT_SACCADE, EVENT_BLINK, EYE_LEFT, EYE_RIGHT
+from simulated_tracker import GazeModel
+
+
+def make_samples(rate, seconds, seed=0):
+    model = GazeModel(seed=seed)
+    rows = []
+    interval = 1000.0 / rate
+    for i in range(int(rate * seconds)):
+        t = i * interval
+        x, y, pupil, _ = model.step(t)
+        rx = x if x == -32768 else x + 3.0
+        rows.append((t, x, y, pupil, rx, y, pupil, EYE_LEFT | EYE_RIGHT))
+    return samples_to_array(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--block', type=int, default=8, help='samples per block')
+    args = parser.parse_args()
+
+    samples = make_samples(args.rate, args.seconds)
+    for detector in (IVTDetector(), IDTDetector()):
+        events = []
+        start = time.perf_counter()
+        for i in range(0, len(samples), args.block):
+            events.append(detector.process(samples[i:i + args.block]))
+        elapsed = time.perf_counter() - start
+        events = np.concatenate(events)
+        ends = events[~np.isnan(events['end'])]
+        counts = {name: int((ends['type'] == kind).sum())
+                  for name, kind in (('fixations', EVENT_FIXATION), ('saccades', EVENT_SACCADE),
+                                     ('blinks', EVENT_BLINK))}
+        print(f"{type(detector).__name__:<12} {len(samples) / elapsed / 1000:8.1f} k samples/s  "
+              f"{args.seconds / elapsed:7.1f}x real time  "
+              f"{elapsed / (len(samples) / args.block) * 1e6:7.1f} us/block  {counts}")
+
+
+if __name__ == '__main__':
+    main()
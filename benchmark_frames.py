@@ -0,0 +1,53 @@
+"""Compare binary gaze frames (gaze_frames.py) with the JSON fallback.
+
+    python benchmark_frames.py --samples 1000 --repeat 200
+
+Encodes blocks of synthetic binocular samples both ways and reports the
+encoding throughput and the size per sample.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from gaze_frames import encode, encode_json, decode, samples_to_array, EYE_LEFT, EYE_RIGHT
+
+
+def make_block(count, seed=0):
+    rng = np.random.default_rng(seed)
+    time_ms = np.arange(count) * 0.5
+    gaze = rng.normal(500, 100, size=(count, 4))
+    pupil = rng.normal(900, 20, size=count)
+    eyes = [EYE_LEFT | EYE_RIGHT] * count
+    rows = list(zip(time_ms, gaze[:, 0], gaze[:, 1], pupil, gaze[:, 2], gaze[:, 3], pupil, eyes))
+    return samples_to_array(rows)
+
+
+def bench(label, fn, block, repeat):
+    fn(block)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        frame = fn(block)
+    elapsed = time.perf_counter() - start
+    rate = len(block) * repeat / elapsed
+    print(f"{label:<14} {rate / 1e6:8.2f} M samples/s  {elapsed / repeat * 1e6:9.1f} us/block  "
+          f"{len(frame) / len(block):6.1f} bytes/sample")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=1000, help='samples per block')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    block = make_block(args.samples)
+    binary = bench('binary', encode, block, args.repeat)
+    text = bench('json', encode_json, block, args.repeat)
+    bench('round trip', lambda b: decode(encode(b))[0].tobytes(), block, args.repeat)
+    print(f"binary encoding is {binary / text:.1f}x faster than JSON")
+
+
+if __name__ == '__main__':
+    main()
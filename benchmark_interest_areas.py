@@ -0,0 +1,75 @@
+"""Hit-testing gaze against many interest areas (interest_areas.py).
+
+    python benchmark_interest_areas.py --areas 500 --block 8
+
+Lays out word-sized rectangles (plus some ellipses and freehand polygons)
+over a 1920x1080 screen, as in a reading task, and compares the grid index
+with a linear scan over every area, per block of samples and per sample.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from interest_areas import InterestAreaIndex, parse_interest_area
+
+
+def make_areas(count):
+    areas = []
+    columns = 20
+    width, height = 1920 / columns, 1080 / ((count + columns - 1) // columns)
+    for i in range(count):
+        left, top = (i % columns) * width, (i // columns) * height
+        right, bottom = left + width - 4, top + height - 4
+        if i % 10 == 3:
+            text = f'!V IAREA ELLIPSE {i} {left:.0f} {top:.0f} {right:.0f} {bottom:.0f} word{i}'
+        elif i % 10 == 7:
+            points = f'{left:.0f},{top:.0f} {right:.0f},{top:.0f} {left:.0f},{bottom:.0f}'
+            text = f'!V IAREA FREEHAND {i} {points} word{i}'
+        else:
+            text = f'!V IAREA RECTANGLE {i} {left:.0f} {top:.0f} {right:.0f} {bottom:.0f} word{i}'
+        areas.append(parse_interest_area(text))
+    return areas
+
+
+def linear_scan(areas, x, y):
+    """The naive reference: test every area, one at a time."""
+    result = np.full(len(x), -1)
+    for j, area in enumerate(areas):
+        hit = InterestAreaIndex([area]).hit_test(x, y) == 0
+        result[hit & (result < 0)] = j
+    return result
+
+
+def bench(label, fn, blocks, block_size):
+    start = time.perf_counter()
+    results = [fn(x, y) for x, y in blocks]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {elapsed / len(blocks) * 1e6:9.1f} us/block  "
+          f"{elapsed / (len(blocks) * block_size) * 1e6:8.2f} us/sample")
+    return np.concatenate(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--areas', type=int, default=500)
+    parser.add_argument('--block', type=int, default=8, help='samples per block')
+    parser.add_argument('--blocks', type=int, default=200)
+    args = parser.parse_args()
+
+    areas = make_areas(args.areas)
+    start = time.perf_counter()
+    index = InterestAreaIndex(areas)
+    print(f"index of {len(areas)} areas built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(0)
+    blocks = [(rng.uniform(0, 1920, args.block), rng.uniform(0, 1080, args.block))
+              for _ in range(args.blocks)]
+    grid = bench('grid', index.hit_test, blocks, args.block)
+    scan = bench('linear', lambda x, y: linear_scan(areas, x, y), blocks[:20], args.block)
+    assert (grid[:len(scan)] == scan).all(), 'grid and linear scan disagree'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""Load generator and latency benchmark for my_python_server.py.
+
+Run the server in dummy mode (simulated tracker) and then, for example:
+
+    # 8 clients, each sending 200 commands/s for 10 s, mostly messages
+    python benchmark_server.py load --clients 8 --rate 200 --duration 10 \\
+        --mix sendMessage=8,sendCommand=2
+
+    # replay traffic recorded with RECORD_TRAFFIC in my_python_server.py,
+    # keeping the original inter-arrival times
+    python benchmark_server.py replay traffic.jsonl
+
+A recording holds every command, whichever route it came through (a
+/send_commands batch or a /beacon line is recorded command by command),
+and every Host screen update. Replay sends each command on its own, over
+/send_command or /ws, and Host screen updates to /host_screen over HTTP
+whatever the transport. Job ids differ between runs, so cancelling or
+polling jobs is not recorded and not replayed.
+
+Every request is sent at a scheduled time. The report gives throughput,
+latency percentiles (request sent to response received) and drift, the
+delay between the scheduled and the actual send time; drift grows when the
+server cannot keep up. --save writes the summary to a JSON file, and
+--compare checks a run against a saved one and exits with status 1 if a
+latency percentile regressed by more than --tolerance.
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+
+import simple_websocket
+
+from percentiles import percentile
+
+
+def command_for(name, i):
+    if name == 'sendMessage':
+        return f'sendMessage("bench {i}")'
+    if name == 'sendCommand':
+        return 'sendCommand("draw_cross 100 100 15")'
+    return f'{name}()'
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+class Sender:
+    """One connection to the server; send() returns (ok, latency_s)."""
+
+    def __init__(self, host, port, transport):
+        self.transport = transport
+        self.conn = http.client.HTTPConnection(host, port)  # connects on first use
+        if transport == 'ws':
+            self.ws = simple_websocket.Client.connect(f'ws://{host}:{port}/ws')
+            self.next_id = 0
+
+    def send(self, route, data):
+        start = time.perf_counter()
+        if self.transport == 'ws' and route == '/send_command':
+            self.next_id += 1
+            self.ws.send(json.dumps(dict(data, id=self.next_id)))
+            reply = json.loads(self.ws.receive())
+        else:
+            self.conn.request('POST', route, body=json.dumps(data),
+                              headers={'Content-Type': 'application/json'})
+            reply = json.loads(self.conn.getresponse().read())
+        return reply.get('status') == 'success', time.perf_counter() - start
+
+    def close(self):
+        if self.transport == 'ws':
+            self.ws.close()
+        self.conn.close()
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []  # (label, ok, latency_s, drift_s)
+
+    def add(self, label, ok, latency, drift):
+        with self._lock:
+            self.records.append((label, ok, latency, drift))
+
+
+def run_schedule(sender, schedule, results, start):
+    """Send each (offset_s, label, route, data) at start + offset_s."""
+    for offset, label, route, data in schedule:
+        due = start + offset
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        drift = time.perf_counter() - due
+        try:
+            ok, latency = sender.send(route, data)
+        except Exception as e:
+            print(f'Request failed: {e}', file=sys.stderr)
+            ok, latency = False, float('nan')
+        results.add(label, ok, latency, drift)
+
+
+def run_clients(schedules, host, port, transport):
+    results = Results()
+    senders = [Sender(host, port, transport) for _ in schedules]
+    start = time.perf_counter() + 0.2  # let every thread get ready
+    threads = [threading.Thread(target=run_schedule, args=(sender, schedule, results, start))
+               for sender, schedule in zip(senders, schedules)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for sender in senders:
+        sender.close()
+    return results, elapsed
+
+
+def load_schedules(args):
+    names = [name for name, _ in args.mix]
+    weights = [weight for _, weight in args.mix]
+    rng = random.Random(args.seed)
+    count = int(args.rate * args.duration)
+    schedules = []
+    for client in range(args.clients):
+        schedule = []
+        for i in range(count):
+            name = rng.choices(names, weights)[0]
+            schedule.append((i / args.rate, name, '/send_command', {'command': command_for(name, i)}))
+        schedules.append(schedule)
+    return schedules
+
+
+def replay_schedules(args):
+    """Spread recorded requests over clients, keeping their arrival times."""
+    with open(args.traffic) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    # recordings made before commands were recorded one by one may hold
+    # sync frames and whole batches
+    records = [r for r in records if not (r['route'] == '/ws' and 'sync' in r['data'])]
+    for record in records:
+        if record['route'] not in ('/send_command', '/send_commands', '/ws', '/beacon', '/host_screen'):
+            sys.exit(f"Cannot replay requests to {record['route']}")
+    if not records:
+        sys.exit('No requests to replay')
+    first = records[0]['time']
+    schedules = [[] for _ in range(args.clients)]
+    for i, record in enumerate(records):
+        data = record['data']
+        if record['route'] == '/host_screen':
+            route, label = '/host_screen', 'hostScreen'
+        elif 'commands' in data:
+            if args.transport == 'ws':
+                sys.exit('A /send_commands batch in this recording can only be replayed over http')
+            route, label = '/send_commands', 'batch'
+        else:
+            route = '/send_command'
+            command = data.get('command', data)
+            label = command.get('name') if isinstance(command, dict) else str(command).partition('(')[0]
+        data = {k: v for k, v in data.items() if k != 'id'}
+        schedules[i % args.clients].append(((record['time'] - first) / 1000.0 / args.speed, label, route, data))
+    return schedules
+
+
+def summarize(results, elapsed):
+    by_label = collections.defaultdict(list)
+    for label, ok, latency, drift in results.records:
+        by_label[label].append((ok, latency, drift))
+    by_label['all'] = [(ok, latency, drift) for _, ok, latency, drift in results.records]
+
+    summary = {'elapsed_s': elapsed}
+    for label, records in by_label.items():
+        latencies = sorted(r[1] * 1000 for r in records if r[1] == r[1])
+        drifts = sorted(r[2] * 1000 for r in records)
+        summary[label] = {
+            'count': len(records),
+            'errors': sum(1 for r in records if not r[0]),
+            'throughput': len(records) / elapsed,
+            'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99), 'max': latencies[-1] if latencies else float('nan'),
+            'drift_p50': percentile(drifts, 50), 'drift_p99': percentile(drifts, 99),
+            'drift_max': drifts[-1],
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'command':<16}{'count':>8}{'errors':>8}{'req/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'max':>9}{'drift99':>9}{'driftmax':>10}   (ms)")
+    for label, s in summary.items():
+        if label == 'elapsed_s':
+            continue
+        print(f"{label:<16}{s['count']:>8}{s['errors']:>8}{s['throughput']:>10.1f}{s['p50']:>9.3f}"
+              f"{s['p95']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}{s['drift_p99']:>9.3f}{s['drift_max']:>10.3f}")
+
+
+def compare(summary, baseline, tolerance):
+    """Return the list of regressions of summary against baseline."""
+    regressions = []
+    for label, s in summary.items():
+        if label == 'elapsed_s' or label not in baseline:
+            continue
+        for key in ('p50', 'p95', 'p99'):
+            before, after = baseline[label][key], s[key]
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(f'{label} {key}: {before:.3f} ms -> {after:.3f} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--transport', choices=('post', 'ws'), default='post')
+    parser.add_argument('--clients', type=int, default=1, help='concurrent connections')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline summary JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative latency increase over the baseline')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    load = subparsers.add_parser('load', help='synthetic traffic')
+    load.add_argument('--rate', type=float, default=100.0, help='requests/s per client')
+    load.add_argument('--duration', type=float, default=10.0, help='seconds')
+    load.add_argument('--mix', type=parse_mix, default=parse_mix('sendMessage=8,sendCommand=2'),
+                      help='command=weight pairs, e.g. sendMessage=8,sendCommand=2')
+    load.add_argument('--seed', type=int, default=0)
+
+    replay = subparsers.add_parser('replay', help='replay recorded traffic')
+    replay.add_argument('traffic', help='file written by RECORD_TRAFFIC')
+    replay.add_argument('--speed', type=float, default=1.0, help='time compression factor')
+
+    args = parser.parse_args()
+    schedules = load_schedules(args) if args.mode == 'load' else replay_schedules(args)
+    results, elapsed = run_clients(schedules, args.host, args.port, args.transport)
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
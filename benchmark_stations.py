@@ -0,0 +1,99 @@
+"""Message latency as simulated stations are added to one server process.
+
+    python benchmark_stations.py --stations 1,2,4,8 --rate 200 --duration 5
+
+For each station count, every station gets a simulated tracker, recording
+at its sample rate with the full sample pipeline running, and a client
+thread sending sendMessage at --rate. With --busy the first station runs
+doTrackerSetup (about 2 s each) as one job after another meanwhile, like a
+station being calibrated. Commands go through Station.execute, the same path as a
+request, without HTTP. The report gives sendMessage latency (received to
+response ready) of the other stations; it should hold steady as stations
+are added and whether or not the first one is busy.
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import threading
+import time
+
+from percentiles import percentile
+from simulated_tracker import SimulatedEyeLink
+from stations import Station, StationRegistry
+
+
+def send_messages(station, rate, duration, latencies):
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i / rate - time.perf_counter()
+        if i / rate - delay > duration:
+            break  # a busy station falls behind its schedule
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        result, _ = station.execute({'name': 'sendMessage', 'args': [f'bench {i}']})
+        if result['status'] == 'success':
+            latencies.append((time.perf_counter() - sent) * 1000)
+
+
+def keep_busy(station, stop):
+    while not stop.is_set():
+        result, _ = station.execute('doTrackerSetup()')
+        if 'job' in result:
+            station.jobs.get(result['job']['id']).wait()  # the job returns at once, wait for it to end
+
+
+def run(count, args, folder):
+    stations = StationRegistry()
+    for i in range(count):
+        tracker = SimulatedEyeLink(sample_rate=args.sample_rate, log_folder=f'{folder}/{i}', seed=i)
+        station = stations.add(Station(str(i), tracker))
+        station.execute('startRecording(1, 1, 1, 1)')
+
+    latencies = {station.id: [] for station in stations.stations()}
+    stop = threading.Event()
+    threads = [threading.Thread(target=send_messages, args=(station, args.rate, args.duration, latencies[station.id]))
+               for station in stations.stations()]
+    if args.busy:
+        threads.append(threading.Thread(target=keep_busy, args=(stations.get('0'), stop)))
+    for thread in threads:
+        thread.start()
+    for thread in threads[:count]:
+        thread.join()
+    stop.set()
+    for thread in threads[count:]:
+        thread.join()
+    samples = sum(station.sample_buffer.state()['written'] for station in stations.stations())
+    stations.stop()
+
+    others = sorted(value for station_id, values in latencies.items() if station_id != '0' or count == 1
+                    for value in values)
+    return others, sorted(latencies['0']), samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stations', default='1,2,4,8', help='comma-separated station counts')
+    parser.add_argument('--rate', type=float, default=200.0, help='messages/s per station')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per station count')
+    parser.add_argument('--sample-rate', type=int, default=1000)
+    parser.add_argument('--busy', action='store_true', help='keep the first station in doTrackerSetup')
+    args = parser.parse_args()
+
+    print(f"{'stations':>8}{'messages':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+          f"{'busy p50':>10}{'samples/s':>11}   (ms)")
+    with tempfile.TemporaryDirectory() as folder:
+        for count in (int(n) for n in args.stations.split(',')):
+            # the command path prints every command
+            with contextlib.redirect_stdout(io.StringIO()):
+                others, first, samples = run(count, args, folder)
+            busy = f'{percentile(first, 50):>10.3f}' if args.busy and count > 1 else f"{'':>10}"
+            print(f'{count:>8}{len(others):>10}{percentile(others, 50):>9.3f}{percentile(others, 95):>9.3f}'
+                  f'{percentile(others, 99):>9.3f}{others[-1] if others else float("nan"):>9.3f}{busy}'
+                  f'{samples / args.duration:>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Compare sendMessage latency over POST /send_command, POST /beacon and the /ws socket.
+
+Start my_python_server.py first, then run e.g.
+
+    python benchmark_transport.py --count 500
+
+The POST path sends a CORS preflight (OPTIONS) before every request, the way
+a browser does for JSON bodies. POST /beacon needs no preflight; as it
+answers once the messages have been sent to the tracker, its round trip is
+the end-to-end latency too. It is measured with one message per request
+and with --batch messages per request (latency per request, throughput
+per message). The WebSocket path is measured twice: one
+message at a time (round-trip latency) and fully pipelined (throughput).
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import time
+
+import simple_websocket
+
+from percentiles import percentile
+
+
+def summarize(label, latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    ms = [x * 1000 for x in latencies]
+    print(f"{label:<24} n={n:<6} mean={statistics.mean(ms):7.3f} ms  "
+          f"p50={percentile(ms, 50):7.3f}  p95={percentile(ms, 95):7.3f}  "
+          f"p99={percentile(ms, 99):7.3f}  max={ms[-1]:7.3f}  "
+          f"stdev={statistics.pstdev(ms):7.3f}")
+
+
+def bench_post(host, port, count, preflight=True):
+    conn = http.client.HTTPConnection(host, port)
+    headers = {'Content-Type': 'application/json'}
+    latencies = []
+    for i in range(count):
+        body = json.dumps({'command': f'sendMessage("bench {i}")'})
+        start = time.perf_counter()
+        if preflight:
+            conn.request('OPTIONS', '/send_command', headers={
+                'Origin': 'http://localhost',
+                'Access-Control-Request-Method': 'POST',
+                'Access-Control-Request-Headers': 'content-type'})
+            conn.getresponse().read()
+        conn.request('POST', '/send_command', body=body, headers=headers)
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+
+def bench_beacon(host, port, count, batch=1):
+    conn = http.client.HTTPConnection(host, port)
+    headers = {'Content-Type': 'text/plain;charset=UTF-8'}
+    route = f'/beacon?client_id=bench-{time.time():.6f}'  # a new client, so seq may start from 1
+    latencies = []
+    seq = 0
+    start = time.perf_counter()
+    for i in range(0, count, batch):
+        lines = []
+        for _ in range(min(batch, count - i)):
+            seq += 1
+            lines.append(f'{seq} - bench {seq}')
+        sent = time.perf_counter()
+        conn.request('POST', route, body='\n'.join(lines), headers=headers)
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return latencies, count / elapsed
+
+
+def bench_ws(host, port, count):
+    ws = simple_websocket.Client.connect(f'ws://{host}:{port}/ws')
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        ws.send(json.dumps({'id': i, 'command': f'sendMessage("bench {i}")'}))
+        ws.receive()
+        latencies.append(time.perf_counter() - start)
+    ws.close()
+    return latencies
+
+
+def bench_ws_pipelined(host, port, count):
+    ws = simple_websocket.Client.connect(f'ws://{host}:{port}/ws')
+    sent_at = {}
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        sent_at[i] = time.perf_counter()
+        ws.send(json.dumps({'id': i, 'command': f'sendMessage("bench {i}")'}))
+    for _ in range(count):
+        ack = json.loads(ws.receive())
+        latencies.append(time.perf_counter() - sent_at[ack['id']])
+    elapsed = time.perf_counter() - start
+    ws.close()
+    return latencies, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=10, help='messages per batched beacon')
+    args = parser.parse_args()
+
+    summarize('POST + preflight', bench_post(args.host, args.port, args.count))
+    summarize('POST (no preflight)', bench_post(args.host, args.port, args.count, preflight=False))
+    latencies, _ = bench_beacon(args.host, args.port, args.count)
+    summarize('Beacon', latencies)
+    latencies, rate = bench_beacon(args.host, args.port, args.count, args.batch)
+    summarize(f'Beacon x{args.batch}', latencies)
+    print(f"Beacon x{args.batch} throughput: {rate:.0f} messages/s")
+    summarize('WebSocket', bench_ws(args.host, args.port, args.count))
+    latencies, rate = bench_ws_pipelined(args.host, args.port, args.count)
+    summarize('WebSocket pipelined', latencies)
+    print(f"WebSocket pipelined throughput: {rate:.0f} messages/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Browser-to-server clock synchronization.
+
+The browser runs NTP-style exchanges against the server: it notes its own
+send time t0, the server stamps receive (t1) and reply (t2) times, and the
+browser notes the receive time t3. Each completed exchange gives
+
+    offset = ((t1 - t0) + (t2 - t3)) / 2    (server clock minus client clock)
+    rtt    = (t3 - t0) - (t2 - t1)
+
+Exchanges with a short round trip are the least affected by network jitter,
+so the estimate is a least-squares line (offset and drift) through the
+lowest-RTT half of the recent exchanges.
+
+All times are in milliseconds. The server side uses the monotonic
+server_clock_ms(); the browser should use performance.now() (or
+performance.timeOrigin + performance.now()) consistently.
+"""
+
+import collections
+import threading
+import time
+
+# Drift is only estimated once the used exchanges span this long, and is
+# clamped to a plausible range; crystal clocks drift by well under 100 ppm.
+MIN_DRIFT_SPAN_MS = 10000.0
+MAX_DRIFT = 1e-3
+
+
+def server_clock_ms():
+    return time.perf_counter_ns() / 1e6
+
+
+class ClockSync:
+    def __init__(self, window=32):
+        self._samples = collections.deque(maxlen=window)  # (client_time, offset, rtt)
+        self._lock = threading.Lock()
+        self.offset = None  # server - client at reference_time, ms
+        self.drift = 0.0  # change of offset per client ms
+        self.reference_time = 0.0
+        self.uncertainty = None  # half the best round trip, ms
+
+    def add_exchange(self, t0, t1, t2, t3):
+        """Add one completed exchange and refresh the estimate."""
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < 0:
+            return  # clocks or stamps are inconsistent, ignore
+        offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        with self._lock:
+            # midpoint of the exchange on the client clock
+            self._samples.append(((t0 + t3) / 2.0, offset, rtt))
+            self._refit()
+
+    def _refit(self):
+        samples = sorted(self._samples, key=lambda s: s[2])
+        best = samples[:max(1, len(samples) // 2)]
+        self.uncertainty = best[0][2] / 2.0
+
+        n = len(best)
+        mean_t = sum(s[0] for s in best) / n
+        mean_o = sum(s[1] for s in best) / n
+        var_t = sum((s[0] - mean_t) ** 2 for s in best)
+        span = max(s[0] for s in best) - min(s[0] for s in best)
+        if n < 3 or span < MIN_DRIFT_SPAN_MS:
+            self.drift = 0.0
+        else:
+            drift = sum((s[0] - mean_t) * (s[1] - mean_o) for s in best) / var_t
+            self.drift = max(-MAX_DRIFT, min(MAX_DRIFT, drift))
+        self.reference_time = mean_t
+        self.offset = mean_o
+
+    @property
+    def synchronized(self):
+        return self.offset is not None
+
+    def to_server_time(self, client_time):
+        """Map a client timestamp to server_clock_ms()."""
+        with self._lock:
+            if self.offset is None:
+                raise ValueError('Clock not synchronized')
+            return client_time + self.offset + self.drift * (client_time - self.reference_time)
+
+    def state(self):
+        return {'offset': self.offset, 'drift': self.drift,
+                'uncertainty': self.uncertainty, 'samples': len(self._samples)}
+
+
+def backdated_message(text, event_time, now=None):
+    """Prefix text with the EyeLink time offset for an event at event_time.
+
+    The tracker subtracts a leading integer from the message timestamp, so a
+    message sent now about an event 7 ms ago becomes "7 <text>". Events that
+    appear to be in the future (estimate noise) are not offset.
+    """
+    if now is None:
+        now = server_clock_ms()
+    offset = int(round(now - event_time))
+    if offset <= 0:
+        return text, 0
+    return f'{offset} {text}', offset
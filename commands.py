@@ -0,0 +1,377 @@
+"""Registry of the commands the server accepts.
+
+Each command declares its arguments with a type (and optional default), the
+worker queue priority and the time a request handler waits for it. Requests
+are parsed and validated once, then dispatched by a dictionary lookup.
+
+Two request forms are accepted:
+
+    "startRecording(1, 1, 1, 1)"                      legacy string
+    {"name": "startRecording", "args": [1, 1, 1, 1]}  structured
+
+A command declared as a job runs in the background: the request returns
+the job at once and the command reports progress on it (see jobs.py).
+A command may also declare a prepare step, which runs in the request thread
+before the call is queued, for slow work that does not need the tracker.
+
+Trial macros (beginTrial, endTrial, abortTrial) expand into a sequence of
+these commands and run it in one go on the tracker worker, with the delays
+of the EyeLink trial protocol between the steps.
+
+Legacy argument lists are read as Python literals, so quoted text may
+contain commas and parentheses. If that fails the whole text between the
+parentheses is taken as one string argument, which keeps unquoted forms
+such as openEDF(TEST) working.
+"""
+
+import ast
+import copy
+import functools
+import json
+import time
+
+from backdrop import BackdropCache
+from clock_sync import backdated_message
+from edf_transfer import EDFDownloads
+from pylink_constants import BX_MAXCONTRAST, TRIAL_ERROR, TRIAL_OK
+from tracker_worker import PRIORITY_MESSAGE, PRIORITY_CONTROL, PRIORITY_BULK
+
+# Seconds a request handler waits for its pylink call; None waits forever
+DEFAULT_COMMAND_TIMEOUT = 5.0
+
+COMMANDS = {}
+
+# Called with the tracker and the text of every message sent, on the
+# tracker's worker thread
+MESSAGE_LISTENERS = []
+
+# Called with the tracker and True or False when recording starts or stops
+# through a command, on the tracker's worker thread
+RECORDING_LISTENERS = []
+
+# Converted images for the backdrop command; the server sets the folder
+BACKDROPS = BackdropCache()
+
+# Destination of receiveEDF; the server sets the folder
+EDF_DOWNLOADS = EDFDownloads()
+
+_REQUIRED = object()
+
+
+class CommandError(ValueError):
+    """A request that does not match any command or its argument schema."""
+
+
+class Arg:
+    def __init__(self, name, type, default=_REQUIRED):
+        self.name = name
+        self.type = type
+        self.default = default
+
+    def coerce(self, value):
+        if self.type is str:
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                return str(value)
+        elif self.type is int:
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, str):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+        elif self.type is float:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return float(value)
+            if isinstance(value, str):
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+        elif self.type is dict:
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            if isinstance(value, dict):
+                return value
+        raise CommandError(f'Argument "{self.name}" must be {self.type.__name__}, got {value!r}')
+
+
+class Command:
+    def __init__(self, name, func, args, priority, timeout, timed, prepare, job):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.timeout = timeout
+        self.timed = timed  # takes the client event time, see clock_sync.py
+        self.prepare = prepare  # maps validated args to func's args, off the worker
+        self.job = job  # runs in the background and takes the Job, see jobs.py
+
+    def validate(self, values):
+        """Check and convert raw argument values, filling in defaults."""
+        if len(values) > len(self.args):
+            raise CommandError(f'{self.name} takes at most {len(self.args)} arguments, got {len(values)}')
+        converted = []
+        for i, arg in enumerate(self.args):
+            if i < len(values):
+                converted.append(arg.coerce(values[i]))
+            elif arg.default is not _REQUIRED:
+                converted.append(arg.default)
+            else:
+                raise CommandError(f'{self.name} is missing argument "{arg.name}"')
+        return tuple(converted)
+
+    def run(self, tracker, args, event_time=None, job=None):
+        """Make the pylink call. Returns a dict of extra response fields."""
+        kwargs = {}
+        if self.timed:
+            kwargs['event_time'] = event_time
+        if self.job:
+            kwargs['job'] = job
+        result = self.func(tracker, *args, **kwargs)
+        return result or {}
+
+
+def command(name, *args, priority=PRIORITY_CONTROL, timeout=DEFAULT_COMMAND_TIMEOUT, timed=False,
+            prepare=None, job=False):
+    """Register the decorated function as command name taking args."""
+    def decorator(func):
+        COMMANDS[name] = Command(name, func, args, priority, timeout, timed, prepare, job)
+        return func
+    return decorator
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_legacy(text):
+    name, paren, rest = text.strip().partition('(')
+    name = name.strip()
+    if not paren:
+        return name, ()
+    if not rest.endswith(')'):
+        raise CommandError(f'Malformed command: {text}')
+    inner = rest[:-1].strip()
+    if not inner:
+        return name, ()
+    try:
+        values = ast.literal_eval(inner + ',')
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return name, (inner.strip('"'),)
+    return name, values
+
+
+def parse_command(command):
+    """Return (name, raw_args) for a legacy string or a structured command."""
+    if isinstance(command, str):
+        # the cached args may hold dicts and lists; each caller gets its own
+        name, args = _parse_legacy(command)
+        return name, copy.deepcopy(args)
+    if isinstance(command, dict) and isinstance(command.get('name'), str):
+        args = command.get('args', [])
+        if not isinstance(args, (list, tuple)):
+            raise CommandError('"args" must be a list')
+        return command['name'], tuple(args)
+    raise CommandError(f'Malformed command: {command!r}')
+
+
+def lookup(name, raw_args):
+    """Return (Command, validated args) or raise CommandError."""
+    spec = COMMANDS.get(name)
+    if spec is None:
+        raise CommandError(f'Unknown command: {name}')
+    return spec, spec.validate(raw_args)
+
+
+# Command implementations. They run on the tracker worker thread.
+
+# A failure is reported to the client; the connection and server stay up
+@command('openEDF', Arg('name', str))
+def open_edf(tracker, name):
+    edf_file = name + ".EDF"
+    try:
+        tracker.openDataFile(edf_file)
+    except RuntimeError as err:
+        raise RuntimeError(f'Error opening EDF file {edf_file}: {err}') from err
+
+
+def _leave_setup_on_cancel(tracker, job):
+    """Let a cancel leave the setup screen through exitCalibration, where it can.
+
+    The worker can only run exitCalibration while doTrackerSetup or
+    doDriftCorrect blocks it if the tracker calls back into the worker
+    meanwhile (idle_callback, see simulated_tracker.py). pylink.EyeLink does
+    not, so there the job refuses to be cancelled rather than report a
+    setup that ran to its end as cancelled.
+    """
+    if hasattr(tracker, 'idle_callback'):
+        job.on_cancel(tracker.exitCalibration)
+    else:
+        job.refuse_cancel('The setup screen can only be left on the Host PC')
+
+
+# doTrackerSetup blocks until the operator leaves the setup screen, so it
+# runs as a job; cancelling it leaves the setup screen through exitCalibration
+@command('doTrackerSetup', job=True)
+def do_tracker_setup(tracker, job=None):
+    _leave_setup_on_cancel(tracker, job)
+    tracker.doTrackerSetup()
+    job.check_cancelled()
+
+
+@command('doDriftCorrect', Arg('x', int), Arg('y', int), Arg('draw', int, 1), Arg('allow_setup', int, 1),
+         job=True)
+def do_drift_correct(tracker, x, y, draw, allow_setup, job=None):
+    _leave_setup_on_cancel(tracker, job)
+    result = tracker.doDriftCorrect(x, y, draw, allow_setup)
+    job.check_cancelled()
+    return {'result': result}
+
+
+@command('setOfflineMode')
+def set_offline_mode(tracker):
+    tracker.setOfflineMode()
+
+
+# arguments: sample_to_file, events_to_file, sample_over_link, event_over_link
+@command('startRecording', Arg('file_samples', int, 1), Arg('file_events', int, 1),
+         Arg('link_samples', int, 1), Arg('link_events', int, 1))
+def start_recording(tracker, file_samples, file_events, link_samples, link_events):
+    tracker.startRecording(file_samples, file_events, link_samples, link_events)
+    for listener in RECORDING_LISTENERS:
+        listener(tracker, True)
+
+
+@command('stopRecording')
+def stop_recording(tracker):
+    tracker.stopRecording()
+    for listener in RECORDING_LISTENERS:
+        listener(tracker, False)
+
+
+@command('sendMessage', Arg('text', str), priority=PRIORITY_MESSAGE, timed=True)
+def send_message(tracker, text, event_time=None):
+    extra = {}
+    original = text
+    if event_time is not None:
+        text, extra['offset'] = backdated_message(text, event_time)
+    tracker.sendMessage(text)
+    for listener in MESSAGE_LISTENERS:
+        listener(tracker, original)
+    return extra
+
+
+@command('sendCommand', Arg('text', str), priority=PRIORITY_BULK)
+def send_command(tracker, text):
+    tracker.sendCommand(text)
+
+
+# parameters: image_file, crop_x, crop_y, crop_width, crop_height,
+#             x, y on the Host, drawing options
+@command('imageBackdrop', Arg('image_file', str), Arg('crop_x', int, 0), Arg('crop_y', int, 0),
+         Arg('crop_width', int, 0), Arg('crop_height', int, 0), Arg('x', int, 0), Arg('y', int, 0),
+         Arg('options', int, BX_MAXCONTRAST), priority=PRIORITY_BULK, timeout=30.0)
+def image_backdrop(tracker, image_file, crop_x, crop_y, crop_width, crop_height, x, y, options):
+    tracker.imageBackdrop(image_file, crop_x, crop_y, crop_width, crop_height, x, y, options)
+
+
+def prepare_backdrop(image_file, width, height, crop_x, crop_y, crop_width, crop_height, x, y, options):
+    crop = (crop_x, crop_y, crop_width, crop_height)
+    image = BACKDROPS.image(image_file, width, height, crop)
+    return image.shape[1], image.shape[0], BACKDROPS.pixels(image_file, width, height, crop), x, y, options
+
+
+# Scaled backdrop through bitmapBackdrop(). The image, from the server's
+# backdrop folder, is resized to width x height (0: as is) and cropped, then
+# drawn at x, y on the Host
+@command('backdrop', Arg('image_file', str), Arg('width', int, 0), Arg('height', int, 0),
+         Arg('crop_x', int, 0), Arg('crop_y', int, 0), Arg('crop_width', int, 0), Arg('crop_height', int, 0),
+         Arg('x', int, 0), Arg('y', int, 0), Arg('options', int, BX_MAXCONTRAST),
+         priority=PRIORITY_BULK, timeout=30.0, prepare=prepare_backdrop)
+def bitmap_backdrop(tracker, width, height, pixels, x, y, options):
+    tracker.bitmapBackdrop(width, height, pixels, 0, 0, width, height, x, y, options)
+
+
+# Close the data file and download <name>.EDF into a session folder (by
+# default <name>_<date>) in the folder of the job's station, in the background
+@command('receiveEDF', Arg('name', str), Arg('session', str, ''), priority=PRIORITY_BULK, job=True)
+def receive_edf(tracker, name, session, job=None):
+    EDF_DOWNLOADS.destination(name, session, job.station)  # a bad name fails before the file is closed
+    tracker.closeDataFile()
+    return EDF_DOWNLOADS.receive(tracker, name, session, job.station, job)
+
+
+# Convert a comma-separated list of images in the background, e.g. every
+# image of the session, so later backdrop commands hit the cache
+@command('preloadBackdrops', Arg('image_files', str), Arg('width', int, 0), Arg('height', int, 0),
+         priority=PRIORITY_BULK)
+def preload_backdrops(tracker, image_files, width, height):
+    files = [name.strip() for name in image_files.split(',') if name.strip()]
+    BACKDROPS.prefetch(files, width, height)
+    return {'images': len(files)}
+
+
+# Trial macros. Each expands into steps, (command, *args) or
+# ('pumpDelay', ms), which run back to back in a single worker call, so
+# nothing else reaches the tracker in between and the delays are exact.
+# The messages follow the Data Viewer integration protocol, as in
+# run_trial() of example_exp_psychopy.py.
+
+def run_steps(tracker, steps):
+    """Run steps in order. Returns them with the ms since the first started."""
+    start = time.perf_counter()
+    done = []
+    for name, *args in steps:
+        done.append({'command': name, 'args': args, 'time': (time.perf_counter() - start) * 1000})
+        try:
+            if name == 'pumpDelay':
+                time.sleep(args[0] / 1000.0)
+            else:
+                spec = COMMANDS[name]
+                spec.run(tracker, spec.validate(args))
+        except Exception as e:
+            raise RuntimeError(f'Step {len(done)} ({name}) failed: {e}') from e
+    return {'steps': done}
+
+
+# Start recording trial trial_id. clear_screen >= 0 first clears the Host
+# screen to that color; leave it at -1 when a backdrop was drawn for the trial
+@command('beginTrial', Arg('trial_id', str), Arg('status_message', str, ''), Arg('clear_screen', int, -1))
+def begin_trial(tracker, trial_id, status_message, clear_screen):
+    steps = [('setOfflineMode',)]
+    if clear_screen >= 0:
+        steps.append(('sendCommand', f'clear_screen {clear_screen}'))
+    steps += [('sendMessage', f'TRIALID {trial_id}'),
+              ('sendCommand', f"record_status_message '{status_message or f'TRIAL number {trial_id}'}'"),
+              ('startRecording', 1, 1, 1, 1),
+              ('pumpDelay', 100)]  # let the tracker cache some samples
+    return run_steps(tracker, steps)
+
+
+# Stop recording and log the trial variables, e.g. {"condition": "easy",
+# "RT": 532}, and the result. background is the "r g b" the Data Viewer
+# screen is cleared to, '' for none
+@command('endTrial', Arg('variables', dict, {}), Arg('result', int, TRIAL_OK), Arg('background', str, '128 128 128'))
+def end_trial(tracker, variables, result, background):
+    steps = []
+    if background:
+        steps.append(('sendMessage', f'!V CLEAR {background}'))
+    steps += [('pumpDelay', 100), ('stopRecording',)]  # catch the final events
+    steps += [('sendMessage', f'!V TRIAL_VAR {name} {value}') for name, value in variables.items()]
+    steps.append(('sendMessage', f'TRIAL_RESULT {result}'))
+    return run_steps(tracker, steps)
+
+
+# End a trial that went wrong: stop recording if it is on and log the result
+@command('abortTrial', Arg('result', int, TRIAL_ERROR), Arg('background', str, '116 116 116'))
+def abort_trial(tracker, result, background):
+    steps = []
+    if tracker.isRecording() == TRIAL_OK:  # pylink returns TRIAL_OK while recording
+        steps += [('pumpDelay', 100), ('stopRecording',)]
+    if background:
+        steps.append(('sendMessage', f'!V CLEAR {background}'))
+    steps.append(('sendMessage', f'TRIAL_RESULT {result}'))
+    return run_steps(tracker, steps)
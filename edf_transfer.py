@@ -0,0 +1,101 @@
+"""Downloading EDF files from the Host PC into session folders.
+
+receiveDataFile() gives no progress of its own, so while it runs a watcher
+thread reads the size of the file growing on disk and reports bytes copied
+and throughput on the job. The file is written under a temporary name and
+renamed only once the transfer has succeeded: a file with the final name is
+always complete, and a failed or cancelled transfer leaves nothing behind.
+"""
+
+import os
+import threading
+import time
+
+
+def check_file_name(name, what='file name'):
+    """Return name if it is a plain file name, else raise ValueError.
+
+    Names from requests become paths on the server, so a name must not
+    hold a folder that could lead outside the folder it is meant for.
+    """
+    if (not name or name in (os.curdir, os.pardir) or os.path.basename(name) != name
+            or '/' in name or '\\' in name):
+        raise ValueError(f'Invalid {what}: {name!r}')
+    return name
+
+
+def receive_data_file(tracker, src, dest, job=None, interval=0.25):
+    """Copy src from the Host PC to dest. Returns a summary dict."""
+    folder = os.path.dirname(dest)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp = dest + '.part'
+    start = time.perf_counter()
+
+    def report():
+        try:
+            size = os.path.getsize(temp)
+        except OSError:
+            return 0
+        elapsed = time.perf_counter() - start
+        if job is not None:
+            job.update(bytes=size, seconds=elapsed, bytes_per_second=size / elapsed if elapsed > 0 else 0.0)
+        return size
+
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(interval):
+            report()
+
+    watcher = threading.Thread(target=watch, name='edf-transfer-progress', daemon=True)
+    watcher.start()
+    try:
+        result = tracker.receiveDataFile(src, temp)
+        # pylink returns the file size, 0 when cancelled or a negative error code
+        if result is not None and result <= 0:
+            raise RuntimeError(f'receiveDataFile({src}) failed with code {result}')
+        if job is not None:
+            job.check_cancelled()  # the transfer cannot be stopped, only discarded
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        if folder:
+            try:
+                os.rmdir(folder)  # only if the transfer created it empty
+            except OSError:
+                pass
+        raise
+    finally:
+        stop.set()
+        watcher.join()
+    size = report()
+    os.replace(temp, dest)
+    elapsed = time.perf_counter() - start
+    return {'path': dest, 'bytes': size, 'seconds': elapsed,
+            'bytes_per_second': size / elapsed if elapsed > 0 else 0.0}
+
+
+class EDFDownloads:
+    """Where received EDF files go: folder/<station>/<session>/<name><date>.EDF.
+
+    The folder per station keeps two stations receiving the same EDF name
+    (TEST.EDF, say) in the same minute from writing to the same file.
+    """
+
+    def __init__(self, folder='results'):
+        self.folder = folder
+
+    def destination(self, name, session='', station=''):
+        check_file_name(name, 'EDF name')
+        if session:
+            check_file_name(session, 'session name')
+        if station:
+            check_file_name(station, 'station id')
+        # the same naming as the example script's session folders
+        identifier = name + time.strftime('_%Y_%m_%d_%H_%M', time.localtime())
+        return os.path.join(self.folder, station, session or identifier, identifier + '.EDF')
+
+    def receive(self, tracker, name, session='', station='', job=None):
+        dest = self.destination(name, session, station)
+        return receive_data_file(tracker, name + '.EDF', dest, job)
@@ -0,0 +1,314 @@
+"""Online fixation, saccade and blink detection over the live sample stream.
+
+The detectors work on whole SAMPLE_DTYPE blocks as they arrive, keep the
+little state they need between blocks, and return EVENT_DTYPE arrays (see
+gaze_frames.py). Each eye of a binocular stream is detected separately.
+
+IVTDetector labels samples by velocity: above velocity_threshold (deg/s)
+is saccade, missing gaze is blink, anything else fixation. Velocity is
+taken over velocity_window ms rather than between neighbouring samples, so
+measurement noise at 1000/2000 Hz does not read as saccades.
+
+IDTDetector finds fixations by dispersion: a fixation starts once a window
+of min_fixation_duration ms stays within dispersion_threshold degrees
+((max x - min x) + (max y - min y)) and grows until the next sample would
+break it. The gaps between fixations are reported as saccades, or blinks if
+gaze was lost.
+
+Fixations are reported twice: a start event as soon as the fixation has
+lasted min_fixation_duration (its end is NaN), and a complete event when it
+ends. Saccades and blinks are reported when they end. Every event carries
+its detection latency: the tracker time at detection minus the start (for
+start events) or end of the event.
+
+EventStream runs a detector as a GazeStreamer listener and fans the events
+out to subscribers, the way GazeStreamer does for samples.
+"""
+
+import threading
+
+import numpy as np
+
+from gaze_frames import (EVENT_DTYPE, EVENT_FIXATION, EVENT_SACCADE, EVENT_BLINK,
+                         EYE_LEFT, EYE_RIGHT, MISSING_DATA)
+from gaze_stream import Subscription
+
+LABEL_FIXATION = 0
+LABEL_SACCADE = 1
+LABEL_BLINK = 2
+
+_EVENT_TYPES = {LABEL_FIXATION: EVENT_FIXATION, LABEL_SACCADE: EVENT_SACCADE, LABEL_BLINK: EVENT_BLINK}
+
+_EYES = ((EYE_LEFT, 'left_x', 'left_y', 'left_pupil'),
+         (EYE_RIGHT, 'right_x', 'right_y', 'right_pupil'))
+
+
+class _Run:
+    """The event in progress for one eye: samples of a single label."""
+
+    def __init__(self, label, t, x, y):
+        self.label = label
+        self.start = t
+        self.end = t
+        self.start_x = x
+        self.start_y = y
+        self.last_x = x
+        self.last_y = y
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_pupil = 0.0
+        self.count = 0
+        self.announced = False  # fixation start event sent
+
+    def add(self, t, x, y, pupil):
+        """Absorb a segment of samples (arrays) with this run's label."""
+        self.end = float(t[-1])
+        if self.label != LABEL_BLINK:
+            self.sum_x += float(x.sum())
+            self.sum_y += float(y.sum())
+            self.sum_pupil += float(pupil.sum())
+            self.count += len(t)
+            self.last_x = float(x[-1])
+            self.last_y = float(y[-1])
+
+    def record(self, eye, now, final):
+        mean = self.count or 1
+        event = (self.start, self.end if final else np.nan,
+                 self.sum_x / mean if self.label == LABEL_FIXATION else self.last_x,
+                 self.sum_y / mean if self.label == LABEL_FIXATION else self.last_y,
+                 self.start_x, self.start_y, self.sum_pupil / mean,
+                 now - (self.end if final else self.start), _EVENT_TYPES[self.label], eye)
+        return event
+
+
+class _Detector:
+    def __init__(self, pixels_per_degree=35.0, min_fixation_duration=60.0, min_saccade_duration=6.0):
+        self.pixels_per_degree = pixels_per_degree
+        self.min_fixation_duration = min_fixation_duration
+        self.min_saccade_duration = min_saccade_duration
+        self._state = {}
+
+    def process(self, block, now=None):
+        """Detect events in a new block of samples.
+
+        now is the tracker time (ms) at detection, used for the latency;
+        it defaults to the newest sample time.
+        """
+        events = []
+        if len(block):
+            if now is None:
+                now = float(block['time'][-1])
+            eyes = int(np.bitwise_or.reduce(block['eyes']))
+            for eye, x_name, y_name, pupil_name in _EYES:
+                if eyes & eye:
+                    self._process_eye(eye, block['time'].astype(np.float64), block[x_name].astype(np.float64),
+                                      block[y_name].astype(np.float64), block[pupil_name].astype(np.float64),
+                                      now, events)
+        return np.array(events, dtype=EVENT_DTYPE)
+
+    def _finish(self, run, eye, now, events):
+        """Emit the end of run if it qualifies as an event."""
+        if run is None:
+            return
+        duration = run.end - run.start
+        if run.label == LABEL_FIXATION:
+            if run.announced:
+                events.append(run.record(eye, now, True))
+        elif run.label == LABEL_SACCADE:
+            if duration >= self.min_saccade_duration:
+                events.append(run.record(eye, now, True))
+        else:
+            events.append(run.record(eye, now, True))
+
+    def _announce(self, run, eye, now, events):
+        if (run.label == LABEL_FIXATION and not run.announced
+                and run.end - run.start >= self.min_fixation_duration):
+            run.announced = True
+            events.append(run.record(eye, now, False))
+
+
+class IVTDetector(_Detector):
+    def __init__(self, velocity_threshold=30.0, velocity_window=4.0, **kwargs):
+        super().__init__(**kwargs)
+        self.velocity_threshold = velocity_threshold
+        self.velocity_window = velocity_window
+
+    def _process_eye(self, eye, t, x, y, pupil, now, events):
+        history, run = self._state.get(eye, (None, None))
+        n = len(t)
+        if history is not None:
+            t_all = np.concatenate((history[0], t))
+            x_all = np.concatenate((history[1], x))
+            y_all = np.concatenate((history[2], y))
+        else:
+            t_all, x_all, y_all = t, x, y
+        offset = len(t_all) - n  # index of the block's first sample in *_all
+
+        # velocity over velocity_window ms, ending at each sample of the block
+        interval = np.median(np.diff(t_all)) if len(t_all) > 1 else 1.0
+        lag = max(1, int(round(self.velocity_window / interval)))
+        index = np.arange(offset, offset + n)
+        back = np.maximum(index - lag, 0)
+        dt = t_all[index] - t_all[back]
+        missing = x_all == MISSING_DATA
+        distance = np.hypot(x_all[index] - x_all[back], y_all[index] - y_all[back])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity = np.where(dt > 0, distance / dt * 1000.0 / self.pixels_per_degree, 0.0)
+        velocity[missing[back] | missing[index]] = 0.0
+
+        labels = np.where(velocity > self.velocity_threshold, LABEL_SACCADE, LABEL_FIXATION)
+        labels[missing[index]] = LABEL_BLINK
+
+        # walk the runs of equal labels, a handful per block
+        bounds = np.concatenate(([0], np.flatnonzero(labels[1:] != labels[:-1]) + 1, [n]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            label = int(labels[start])
+            if run is None or run.label != label:
+                self._finish(run, eye, now, events)
+                if label == LABEL_SACCADE and run is not None and run.label == LABEL_FIXATION:
+                    sx, sy = run.last_x, run.last_y  # saccade leaves the fixation
+                else:
+                    sx, sy = float(x[start]), float(y[start])
+                run = _Run(label, float(t[start]), sx, sy)
+            run.add(t[start:end], x[start:end], y[start:end], pupil[start:end])
+            self._announce(run, eye, now, events)
+
+        keep = lag + 1
+        self._state[eye] = ((t_all[-keep:], x_all[-keep:], y_all[-keep:]), run)
+
+
+class IDTDetector(_Detector):
+    def __init__(self, dispersion_threshold=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.dispersion_threshold = dispersion_threshold
+
+    def _process_eye(self, eye, t, x, y, pupil, now, events):
+        state = self._state.get(eye)
+        if state is None:
+            state = {'pending': (t[:0], x[:0], y[:0], pupil[:0]), 'run': None, 'gap': None, 'bounds': None}
+            self._state[eye] = state
+        limit = self.dispersion_threshold * self.pixels_per_degree
+
+        pending = state['pending']
+        t = np.concatenate((pending[0], t))
+        x = np.concatenate((pending[1], x))
+        y = np.concatenate((pending[2], y))
+        pupil = np.concatenate((pending[3], pupil))
+        missing = x == MISSING_DATA
+        i = 0
+        n = len(t)
+        while i < n:
+            run = state['run']
+            if run is not None:
+                # extend the fixation while the dispersion stays within limit
+                min_x, max_x, min_y, max_y = state['bounds']
+                xs, ys = x[i:], y[i:]
+                lo_x = np.minimum.accumulate(np.minimum(xs, min_x))
+                hi_x = np.maximum.accumulate(np.maximum(xs, max_x))
+                lo_y = np.minimum.accumulate(np.minimum(ys, min_y))
+                hi_y = np.maximum.accumulate(np.maximum(ys, max_y))
+                broken = ((hi_x - lo_x) + (hi_y - lo_y) > limit) | missing[i:]
+                stop = int(np.argmax(broken)) if broken.any() else len(xs)
+                if stop:
+                    run.add(t[i:i + stop], xs[:stop], ys[:stop], pupil[i:i + stop])
+                    state['bounds'] = (lo_x[stop - 1], hi_x[stop - 1], lo_y[stop - 1], hi_y[stop - 1])
+                i += stop
+                if i < n:
+                    self._finish(run, eye, now, events)
+                    state['run'] = None
+                continue
+
+            # look for the first window of min_fixation_duration that is tight enough
+            interval = np.median(np.diff(t)) if n > 1 else 1.0
+            width = max(2, int(round(self.min_fixation_duration / interval)) + 1)
+            if n - i < width:
+                break
+            windows_x = np.lib.stride_tricks.sliding_window_view(x[i:], width)
+            windows_y = np.lib.stride_tricks.sliding_window_view(y[i:], width)
+            windows_missing = np.lib.stride_tricks.sliding_window_view(missing[i:], width)
+            dispersion = (windows_x.max(axis=1) - windows_x.min(axis=1)
+                          + windows_y.max(axis=1) - windows_y.min(axis=1))
+            tight = (dispersion <= limit) & ~windows_missing.any(axis=1)
+            if not tight.any():
+                # all but the last width - 1 samples can no longer start a fixation
+                self._extend_gap(state, t, x, y, pupil, missing, i, n - width + 1)
+                i = n - width + 1
+                break
+            start = i + int(np.argmax(tight))
+            self._extend_gap(state, t, x, y, pupil, missing, i, start)
+            self._close_gap(state, eye, now, events, x[start], y[start])
+            run = _Run(LABEL_FIXATION, float(t[start]), float(x[start]), float(y[start]))
+            end = start + width
+            run.add(t[start:end], x[start:end], y[start:end], pupil[start:end])
+            state['run'] = run
+            state['bounds'] = (x[start:end].min(), x[start:end].max(), y[start:end].min(), y[start:end].max())
+            self._announce(run, eye, now, events)
+            i = end
+
+        state['pending'] = (t[i:], x[i:], y[i:], pupil[i:])
+
+    def _extend_gap(self, state, t, x, y, pupil, missing, start, end):
+        """Samples start..end belong to the gap between two fixations."""
+        if end <= start:
+            return
+        gap = state['gap']
+        if gap is None:
+            previous = state.get('last_fixation')
+            sx, sy = previous if previous else (float(x[start]), float(y[start]))
+            gap = state['gap'] = _Run(LABEL_SACCADE, float(t[start]), sx, sy)
+        valid = ~missing[start:end]
+        if not valid.all():
+            gap.label = LABEL_BLINK
+        gap.end = float(t[end - 1])
+        if valid.any():
+            gap.sum_pupil += float(pupil[start:end][valid].sum())
+            gap.count += int(valid.sum())
+
+    def _close_gap(self, state, eye, now, events, x, y):
+        gap = state['gap']
+        if gap is not None:
+            gap.last_x, gap.last_y = float(x), float(y)
+            self._finish(gap, eye, now, events)
+            state['gap'] = None
+
+    def _finish(self, run, eye, now, events):
+        super()._finish(run, eye, now, events)
+        if run is not None and run.label == LABEL_FIXATION:
+            self._state[eye]['last_fixation'] = (run.last_x, run.last_y)
+
+
+class EventStream:
+    """Feeds every sample block to detector and publishes the events.
+
+    clock, if given, returns the current tracker time in ms (or None while
+    unknown) for the detection latency.
+    """
+
+    def __init__(self, detector, clock=None):
+        self.detector = detector
+        self.clock = clock
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def __call__(self, block):
+        now = self.clock() if self.clock else None
+        events = self.detector.process(block, now)
+        if len(events):
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                try:
+                    subscription.publish(events)
+                except Exception as e:
+                    print(f'Error publishing events: {e}')
+
+    def subscribe(self, maxlen=1000):
+        subscription = Subscription(maxlen, dtype=EVENT_DTYPE)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
@@ -37,6 +37,8 @@ from __future__ import division
 from __future__ import print_function
 
 import pylink
+import collections
+import concurrent.futures
 import os
 import platform
 import random
@@ -44,7 +46,8 @@ import time
 import sys
 from EyeLinkCoreGraphicsPsychoPy import EyeLinkCoreGraphicsPsychoPy
 from psychopy import visual, core, event, monitors, gui
-from PIL import Image  # for preparing the Host backdrop image
+from PIL import Image  # for decoding the stimuli off the main thread
+from backdrop import BackdropCache  # for preparing the Host backdrop image
 from string import ascii_letters, digits
 
 # Switch to the script folder
@@ -239,6 +242,11 @@ el_tracker.sendCommand(el_coords)
 dv_coords = "DISPLAY_COORDS  0 0 %d %d" % (scn_width - 1, scn_height - 1)
 el_tracker.sendMessage(dv_coords)
 
+# Convert the Host backdrop images of all trials in the background, so
+# run_trial() finds them ready and the ITI stays short
+backdrops = BackdropCache(folder='images')
+backdrops.prefetch([pic for cond, pic in trials], scn_width, scn_height)
+
 # Configure a graphics environment (genv) for tracker calibration
 genv = EyeLinkCoreGraphicsPsychoPy(el_tracker, win)
 print(genv)  # print out the version number of the CoreGraphics library
@@ -383,6 +391,82 @@ def abort_trial():
     return pylink.TRIAL_ERROR
 
 
+class StimulusCache:
+    """ Keep the ImageStim of every trial image, loaded from disk only once
+
+    prefetch() decodes an image and converts its Host backdrop on a
+    background thread while the current trial runs. The ImageStim itself,
+    whose texture goes to the graphics card, must be created on the main
+    thread; upload() does that for finished prefetches, get() for anything
+    still missing. The least recently used stimuli are dropped beyond
+    max_bytes of texture memory.
+    """
+
+    def __init__(self, win, folder, size, backdrops, max_bytes=512 * 1024 * 1024):
+        self.win = win
+        self.folder = folder
+        self.size = size
+        self.backdrops = backdrops
+        self.max_bytes = max_bytes
+        self._stims = collections.OrderedDict()  # pic -> (ImageStim, bytes)
+        self._bytes = 0
+        # prefetches in trial order, as (pic, Future of (image or None, pixels))
+        self._pending = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _load(self, pic):
+        with Image.open(os.path.join(self.folder, pic)) as im:
+            return im.convert('RGB')
+
+    def _decode(self, pic, need_image):
+        image = self._load(pic) if need_image else None
+        pixels = self.backdrops.pixels(pic, self.size[0], self.size[1])
+        return image, pixels
+
+    def prefetch(self, pic):
+        """ Start preparing pic in the background"""
+        need_image = pic not in self._stims and \
+            all(p != pic for p, _ in self._pending)
+        self._pending.append((pic, self._executor.submit(self._decode, pic,
+                                                         need_image)))
+
+    def upload(self):
+        """ Create the ImageStims of finished prefetches (main thread only)"""
+        for pic, future in self._pending:
+            if future.done() and pic not in self._stims:
+                image, pixels = future.result()
+                if image is not None:
+                    self._add(pic, image)
+
+    def get(self, pic):
+        """ Return the ImageStim and the Host backdrop pixels of pic"""
+        for i, (p, future) in enumerate(self._pending):
+            if p == pic:
+                del self._pending[i]
+                break
+        else:
+            future = self._executor.submit(self._decode, pic,
+                                           pic not in self._stims)
+        image, pixels = future.result()
+        if pic not in self._stims:
+            if image is None:  # evicted since the prefetch
+                image = self._load(pic)
+            self._add(pic, image)
+        self._stims.move_to_end(pic)
+        return self._stims[pic][0], pixels
+
+    def _add(self, pic, image):
+        # here we stretch the image to fill full screen
+        stim = visual.ImageStim(self.win, image=image, size=self.size)
+        nbytes = image.size[0] * image.size[1] * 4  # RGBA texture
+        self._stims[pic] = (stim, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and len(self._stims) > 1:
+            _, (_, evicted) = self._stims.popitem(last=False)
+            self._bytes -= evicted
+        return stim
+
+
 def run_trial(trial_pars, trial_index):
     """ Helper function specifying the events that will occur in a single trial
 
@@ -394,10 +478,13 @@ def run_trial(trial_pars, trial_index):
     # unpacking the trial parameters
     cond, pic = trial_pars
 
-    # load the image to display, here we stretch the image to fill full screen
-    img = visual.ImageStim(win,
-                           image=os.path.join('images', pic),
-                           size=(scn_width, scn_height))
+    # get the image to display and its Host backdrop from the stimulus
+    # cache; they were normally prepared during the previous trial. The time
+    # this takes is part of the ITI and is logged with the trial variables
+    load_start = core.getTime()
+    img, pixels = stimuli.get(pic)
+    load_time = int((core.getTime() - load_start)*1000)
+    print('Trial %d: %d ms loading the stimulus' % (trial_index, load_time))
 
     # get a reference to the currently active EyeLink connection
     el_tracker = pylink.getEYELINK()
@@ -426,12 +513,7 @@ def run_trial(trial_pars, trial_index):
     # parameters: width, height, pixel, crop_x, crop_y,
     #             crop_width, crop_height, x, y on the Host, drawing options
     #
-    # Use the code commented below to convert the image and send the backdrop
-    im = Image.open('images' + os.sep + pic)  # read image with PIL
-    im = im.resize((scn_width, scn_height))
-    img_pixels = im.load()  # access the pixel data of the image
-    pixels = [[img_pixels[i, j] for i in range(scn_width)]
-              for j in range(scn_height)]
+    # The pixels were converted in the background (see StimulusCache)
     el_tracker.bitmapBackdrop(scn_width, scn_height, pixels,
                               0, 0, scn_width, scn_height,
                               0, 0, pylink.BX_MAXCONTRAST)
@@ -505,6 +587,10 @@ def run_trial(trial_pars, trial_index):
     el_tracker.sendMessage('image_onset')
     img_onset_time = core.getTime()  # record the image onset time
 
+    # the image stays on screen, so this is a good moment to upload the
+    # next trial's image if its prefetch has finished
+    stimuli.upload()
+
     # Send a message to clear the Data Viewer screen, get it ready for
     # drawing the pictures during visualization
     bgcolor_RGB = (116, 116, 116)
@@ -587,12 +673,25 @@ def run_trial(trial_pars, trial_index):
     el_tracker.sendMessage('!V TRIAL_VAR condition %s' % cond)
     el_tracker.sendMessage('!V TRIAL_VAR image %s' % pic)
     el_tracker.sendMessage('!V TRIAL_VAR RT %d' % RT)
+    el_tracker.sendMessage('!V TRIAL_VAR load_time %d' % load_time)
 
     # send a 'TRIAL_RESULT' message to mark the end of trial, see Data
     # Viewer User Manual, "Protocol for EyeLink Data to Viewer Integration"
     el_tracker.sendMessage('TRIAL_RESULT %d' % pylink.TRIAL_OK)
 
 
+# Stimuli are loaded once and prepared one trial ahead
+stimuli = StimulusCache(win, 'images', (scn_width, scn_height), backdrops)
+
+# construct a list of 4 trials
+test_list = trials[:]*2
+
+# randomize the trial list
+random.shuffle(test_list)
+
+# prepare the first trial during the instructions and calibration
+stimuli.prefetch(test_list[0][1])
+
 # Step 5: Set up the camera and calibrate the tracker
 
 # Show the task instructions
@@ -614,14 +713,11 @@ if not dummy_mode:
 
 # Step 6: Run the experimental trials, index all the trials
 
-# construct a list of 4 trials
-test_list = trials[:]*2
-
-# randomize the trial list
-random.shuffle(test_list)
-
 trial_index = 1
 for trial_pars in test_list:
+    # prepare the next trial's stimulus while this one runs
+    if trial_index < len(test_list):
+        stimuli.prefetch(test_list[trial_index][1])
     run_trial(trial_pars, trial_index)
     trial_index += 1
 
@@ -0,0 +1,251 @@
+// Browser-side helpers for talking to my_python_server.py.
+//
+// EyeLinkSocket keeps one WebSocket open to the server's /ws route. Every
+// command gets a request id; send() returns a Promise that resolves with the
+// server's ack for that id, so many commands can be in flight at once.
+//
+// Timestamps are performance.now() values. Call sync() once after connect
+// (and occasionally afterwards) so the server can translate them; then
+// sendMessageAt() back-dates a message to the time of the browser event,
+// e.g. the timestamp passed to a requestAnimationFrame callback.
+
+class EyeLinkSocket {
+    constructor(url = 'ws://localhost:5000/ws', clientId = 'default') {
+        this.url = url;
+        this.clientId = clientId;
+        this.previousSync = null;
+        this.nextId = 1;
+        this.pending = new Map();
+        this.ws = null;
+    }
+
+    connect() {
+        return new Promise((resolve, reject) => {
+            this.ws = new WebSocket(this.url);
+            this.ws.onopen = () => resolve(this);
+            this.ws.onerror = (error) => reject(error);
+            this.ws.onmessage = (event) => this._onMessage(event);
+            this.ws.onclose = () => {
+                // fail everything still waiting for an ack
+                for (const { reject } of this.pending.values()) {
+                    reject(new Error('WebSocket closed'));
+                }
+                this.pending.clear();
+            };
+        });
+    }
+
+    send(command) {
+        return this._request({ command: command });
+    }
+
+    _request(payload) {
+        const id = this.nextId++;
+        return new Promise((resolve, reject) => {
+            this.pending.set(id, { resolve, reject });
+            this.ws.send(JSON.stringify({ id: id, ...payload }));
+        });
+    }
+
+    sendMessage(text) {
+        // the structured form, so quotes and backslashes in text arrive as sent
+        return this.send({ name: 'sendMessage', args: [text] });
+    }
+
+    sendMessageAt(text, eventTime) {
+        return this._request({
+            command: { name: 'sendMessage', args: [text] },
+            client_time: eventTime,
+            client_id: this.clientId,
+        });
+    }
+
+    // Trial macros, see commands.py: each trial boundary is one request
+    beginTrial(trialId, statusMessage = '', clearScreen = -1) {
+        return this.send({ name: 'beginTrial', args: [String(trialId), statusMessage, clearScreen] });
+    }
+
+    endTrial(variables = {}, result = 0) {
+        return this.send({ name: 'endTrial', args: [variables, result] });
+    }
+
+    abortTrial(result = -1) {
+        return this.send({ name: 'abortTrial', args: [result] });
+    }
+
+    async sync(rounds = 10) {
+        let ack = null;
+        for (let i = 0; i < rounds; i++) {
+            const t0 = performance.now();
+            ack = await this._request({
+                sync: { client_time: t0, client_id: this.clientId, previous: this.previousSync },
+            });
+            this.previousSync = { t0: t0, t1: ack.server_receive, t2: ack.server_send, t3: ack.receivedAt };
+        }
+        // report the last exchange too, so the estimate includes every round
+        return this._request({ sync: { client_time: performance.now(), client_id: this.clientId, previous: this.previousSync } });
+    }
+
+    close() {
+        if (this.ws) {
+            this.ws.close();
+        }
+    }
+
+    _onMessage(event) {
+        const receivedAt = performance.now();
+        const ack = JSON.parse(event.data);
+        ack.receivedAt = receivedAt;
+        const waiter = this.pending.get(ack.id);
+        if (!waiter) {
+            console.warn('Unmatched ack:', ack);
+            return;
+        }
+        this.pending.delete(ack.id);
+        waiter.resolve(ack);
+    }
+}
+
+// EyeLinkBeacon sends messages without waiting for an answer and without a
+// CORS preflight, through POST /beacon (see beacon.py). Messages logged in
+// one task are sent together, with navigator.sendBeacon when the page is
+// being hidden or closed so the last ones are not lost. Messages the
+// server could not send for now (503) are sent again after retryDelay ms. Use the clientId
+// the page synchronized with (EyeLinkSocket.sync) for back-dating; it must
+// be new for every page load, as seq starts from 1 again.
+
+class EyeLinkBeacon {
+    constructor(url = 'http://localhost:5000/beacon', clientId = 'default', station = null, retryDelay = 100) {
+        this.url = url + '?client_id=' + encodeURIComponent(clientId)
+            + (station ? '&station=' + encodeURIComponent(station) : '');
+        this.seq = 0;
+        this.lines = [];
+        this.flushTimer = null;
+        this.retryDelay = retryDelay;
+        addEventListener('pagehide', () => this.flush(true));
+    }
+
+    sendMessage(text) {
+        this._add('-', text);
+    }
+
+    sendMessageAt(text, eventTime) {
+        this._add(eventTime.toFixed(3), text);
+    }
+
+    _add(clientTime, text) {
+        this.seq += 1;
+        this.lines.push(this.seq + ' ' + clientTime + ' ' + text.replace(/[\r\n]+/g, ' '));
+        this._schedule(0);
+    }
+
+    _schedule(delay) {
+        if (this.flushTimer === null) {
+            this.flushTimer = setTimeout(() => this.flush(), delay);
+        }
+    }
+
+    flush(unloading = false) {
+        clearTimeout(this.flushTimer);
+        this.flushTimer = null;
+        if (!this.lines.length) {
+            return;
+        }
+        const lines = this.lines;
+        const body = lines.join('\n');
+        this.lines = [];
+        if (unloading) {
+            navigator.sendBeacon(this.url, body);  // a string is sent as text/plain
+            return;
+        }
+        fetch(this.url, { method: 'POST', body: body, keepalive: true })
+            .then(async (response) => {
+                if (response.status !== 503) {
+                    return;
+                }
+                const failed = new Set((await response.json()).failed);
+                const retry = lines.filter((line) => failed.has(parseInt(line, 10)));
+                this.lines = retry.concat(this.lines);
+                this._schedule(this.retryDelay);
+            })
+            .catch(() => navigator.sendBeacon(this.url, body));  // duplicates are skipped by seq
+    }
+}
+
+// Binary gaze frames, see gaze_frames.py for the layout. decodeGazeFrame
+// returns { kind, count, dropped, columns } where every column is a typed
+// array view on the received buffer (no copying).
+
+const GAZE_FRAME_MAGIC = 0x4b4c5945;  // 'EYLK' read as little-endian uint32
+const GAZE_FRAME_VERSION = 1;
+const GAZE_FRAME_LAYOUTS = {
+    1: ['samples', [
+        ['time', Float64Array],
+        ['left_x', Float32Array], ['left_y', Float32Array], ['left_pupil', Float32Array],
+        ['right_x', Float32Array], ['right_y', Float32Array], ['right_pupil', Float32Array],
+        ['eyes', Uint8Array], ['status', Uint8Array],
+    ]],
+    2: ['events', [
+        ['start', Float64Array], ['end', Float64Array],
+        ['x', Float32Array], ['y', Float32Array], ['start_x', Float32Array], ['start_y', Float32Array],
+        ['pupil', Float32Array], ['latency', Float32Array],
+        ['type', Uint8Array], ['eye', Uint8Array],
+    ]],
+};
+
+function decodeGazeFrame(buffer) {
+    const header = new DataView(buffer, 0, 16);
+    if (header.getUint32(0, true) !== GAZE_FRAME_MAGIC || header.getUint8(4) !== GAZE_FRAME_VERSION) {
+        throw new Error('Not a version ' + GAZE_FRAME_VERSION + ' gaze frame');
+    }
+    const [kind, layout] = GAZE_FRAME_LAYOUTS[header.getUint8(5)];
+    const count = header.getUint32(8, true);
+    const dropped = header.getUint32(12, true);
+    const columns = {};
+    let offset = 16;
+    for (const [name, ArrayType] of layout) {
+        columns[name] = new ArrayType(buffer, offset, count);
+        offset += ArrayType.BYTES_PER_ELEMENT * count;
+    }
+    return { kind: kind, count: count, dropped: dropped, columns: columns };
+}
+
+// EyeLinkGazeStream subscribes to live link samples from /ws/samples.
+// onSamples receives the decoded frame: frame.columns.time, .left_x, ...
+// are typed arrays of frame.count samples. decimate = 'frame' delivers only
+// the newest sample once per display frame.
+
+class EyeLinkGazeStream {
+    constructor(onSamples, { url = 'ws://localhost:5000/ws/samples', decimate = 'all', fps = 60, buffer = 2000 } = {}) {
+        this.onSamples = onSamples;
+        this.url = url + '?decimate=' + decimate + '&fps=' + fps + '&buffer=' + buffer;
+        this.dropped = 0;
+        this.ws = null;
+    }
+
+    connect() {
+        return new Promise((resolve, reject) => {
+            this.ws = new WebSocket(this.url);
+            this.ws.binaryType = 'arraybuffer';
+            this.ws.onopen = () => resolve(this);
+            this.ws.onerror = (error) => reject(error);
+            this.ws.onmessage = (event) => this._onMessage(event);
+        });
+    }
+
+    close() {
+        if (this.ws) {
+            this.ws.close();
+        }
+    }
+
+    _onMessage(event) {
+        if (typeof event.data === 'string') {
+            console.error('Gaze stream error:', JSON.parse(event.data));
+            return;
+        }
+        const frame = decodeGazeFrame(event.data);
+        this.dropped += frame.dropped;
+        this.onSamples(frame);
+    }
+}
@@ -0,0 +1,106 @@
+"""Binary frames for gaze samples and eye events.
+
+Samples and events are kept in numpy structured arrays and encoded in bulk.
+A frame is a 16-byte header followed by the columns of the block, one after
+the other (struct of arrays), all little-endian:
+
+    header  magic b'EYLK', version (u1), kind (u1), reserved (u2),
+            count (u4), dropped (u4)
+    columns count values of each field in the order of the kind's layout
+
+Columns are ordered widest type first and the header is 16 bytes, so every
+column starts at an offset aligned to its element size: the browser decoder
+(decodeGazeFrame in eyelink_client.js) wraps each column in a typed array
+without copying. JSON encodings of the same blocks are kept as a debug
+fallback.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from pylink_constants import MISSING_DATA
+
+MAGIC = b'EYLK'
+VERSION = 1
+KIND_SAMPLES = 1
+KIND_EVENTS = 2
+
+HEADER = struct.Struct('<4sBBHII')
+
+# eyes: bit 0 left, bit 1 right. status: bit 0 left missing, bit 1 right missing
+EYE_LEFT = 1
+EYE_RIGHT = 2
+STATUS_LEFT_MISSING = 1
+STATUS_RIGHT_MISSING = 2
+
+SAMPLE_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('left_x', '<f4'), ('left_y', '<f4'), ('left_pupil', '<f4'),
+    ('right_x', '<f4'), ('right_y', '<f4'), ('right_pupil', '<f4'),
+    ('eyes', 'u1'), ('status', 'u1'),
+])
+
+EVENT_FIXATION = 1
+EVENT_SACCADE = 2
+EVENT_BLINK = 3
+
+# x, y is the fixation position or the saccade end point. end is NaN for
+# the start event of a fixation still in progress. latency is the detection
+# delay in ms, see event_detection.py
+EVENT_DTYPE = np.dtype([
+    ('start', '<f8'), ('end', '<f8'),
+    ('x', '<f4'), ('y', '<f4'), ('start_x', '<f4'), ('start_y', '<f4'), ('pupil', '<f4'),
+    ('latency', '<f4'),
+    ('type', 'u1'), ('eye', 'u1'),
+])
+
+_DTYPES = {KIND_SAMPLES: SAMPLE_DTYPE, KIND_EVENTS: EVENT_DTYPE}
+
+
+def samples_to_array(rows):
+    """Build a sample block from (time, lx, ly, lpa, rx, ry, rpa, eyes) tuples.
+
+    eyes holds the EYE_LEFT and EYE_RIGHT bits of the eyes the sample has
+    data for.
+    """
+    block = np.zeros(len(rows), dtype=SAMPLE_DTYPE)
+    if not rows:
+        return block
+    values = np.asarray(rows, dtype=np.float64)
+    for i, name in enumerate(SAMPLE_DTYPE.names[:8]):
+        block[name] = values[:, i]
+    block['status'] = ((block['left_x'] == MISSING_DATA) * STATUS_LEFT_MISSING
+                       | (block['right_x'] == MISSING_DATA) * STATUS_RIGHT_MISSING)
+    return block
+
+
+def encode(block, dropped=0):
+    """Encode a SAMPLE_DTYPE or EVENT_DTYPE array as one binary frame."""
+    kind = KIND_SAMPLES if block.dtype == SAMPLE_DTYPE else KIND_EVENTS
+    parts = [HEADER.pack(MAGIC, VERSION, kind, 0, len(block), dropped)]
+    parts.extend(np.ascontiguousarray(block[name]).tobytes() for name in block.dtype.names)
+    return b''.join(parts)
+
+
+def decode(frame):
+    """Decode a binary frame. Returns (block, dropped)."""
+    magic, version, kind, _, count, dropped = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'Not a version {VERSION} gaze frame')
+    dtype = _DTYPES[kind]
+    block = np.empty(count, dtype=dtype)
+    offset = HEADER.size
+    for name in dtype.names:
+        column = dtype[name]
+        block[name] = np.frombuffer(frame, dtype=column, count=count, offset=offset)
+        offset += column.itemsize * count
+    return block, dropped
+
+
+def encode_json(block, dropped=0):
+    """Debug fallback: the same block as JSON rows."""
+    kind = 'samples' if block.dtype == SAMPLE_DTYPE else 'events'
+    return json.dumps({'kind': kind, 'fields': block.dtype.names,
+                       kind: block.tolist(), 'dropped': dropped})
@@ -0,0 +1,183 @@
+"""Live link samples, fanned out to browser subscribers.
+
+GazeStreamer polls the tracker for new link samples in a tight loop (through
+the tracker worker, like every other pylink call), appends each block to an
+optional SampleRingBuffer and hands it to every Subscription. A subscription keeps a bounded buffer: when a client
+falls behind, the oldest samples are dropped rather than building up lag.
+Listeners (add_listener) are called with each block on the streamer thread,
+for online processing such as event detection; they must keep up.
+
+Each block is a SAMPLE_DTYPE array (see gaze_frames.py). Values of an eye
+that is not tracked, and gaze during blinks, are MISSING_DATA.
+"""
+
+import collections
+import concurrent.futures
+import threading
+
+import numpy as np
+
+from gaze_frames import SAMPLE_DTYPE, MISSING_DATA, EYE_LEFT, EYE_RIGHT, samples_to_array
+from pylink_constants import SAMPLE_TYPE
+from tracker_worker import PRIORITY_CONTROL
+
+
+def _eye_values(eye):
+    if eye is None:
+        return MISSING_DATA, MISSING_DATA, 0.0
+    gx, gy = eye.getGaze()
+    return gx, gy, eye.getPupilSize()
+
+
+def read_link_samples(tracker):
+    """Drain the link queue, returning the new samples. Runs on the worker.
+
+    Returns (time, lx, ly, lpa, rx, ry, rpa, eyes) tuples, eyes as in
+    gaze_frames.py; events also arrive through getNextData() and are skipped
+    here.
+    """
+    samples = []
+    while True:
+        data_type = tracker.getNextData()
+        if not data_type:
+            break
+        data = tracker.getFloatData()
+        if data_type != SAMPLE_TYPE or data is None:
+            continue
+        has_left, has_right = data.isLeftSample(), data.isRightSample()
+        left = _eye_values(data.getLeftEye() if has_left else None)
+        right = _eye_values(data.getRightEye() if has_right else None)
+        eyes = (EYE_LEFT if has_left else 0) | (EYE_RIGHT if has_right else 0)
+        samples.append((data.getTime(),) + left + right + (eyes,))
+    return samples
+
+
+class Subscription:
+    def __init__(self, maxlen, dtype=SAMPLE_DTYPE):
+        if maxlen < 1:
+            raise ValueError(f'A subscription must hold at least one sample, got maxlen={maxlen}')
+        self.maxlen = maxlen
+        self.dtype = dtype
+        self._blocks = collections.deque()
+        self._count = 0
+        self._condition = threading.Condition()
+        self.dropped = 0  # since the last take_dropped()
+
+    def publish(self, block):
+        with self._condition:
+            self._blocks.append(block)
+            self._count += len(block)
+            # drop the oldest samples beyond maxlen
+            while self._count > self.maxlen:
+                overflow = self._count - self.maxlen
+                oldest = self._blocks[0]
+                if len(oldest) <= overflow:
+                    self._blocks.popleft()
+                    removed = len(oldest)
+                else:
+                    self._blocks[0] = oldest[overflow:]
+                    removed = overflow
+                self._count -= removed
+                self.dropped += removed
+            self._condition.notify()
+
+    def drain(self, timeout=None):
+        """Return every buffered sample as one block, waiting up to timeout."""
+        with self._condition:
+            if not self._blocks and timeout != 0:
+                self._condition.wait(timeout)
+            if not self._blocks:
+                return np.empty(0, dtype=self.dtype)
+            block = self._blocks[0] if len(self._blocks) == 1 else np.concatenate(self._blocks)
+            self._blocks.clear()
+            self._count = 0
+            return block
+
+    def take_dropped(self):
+        with self._condition:
+            dropped, self.dropped = self.dropped, 0
+            return dropped
+
+
+class GazeStreamer(threading.Thread):
+    """Polls link samples every poll_interval seconds.
+
+    Without a buffer it only polls while anyone listens; with one it polls
+    all the time so the buffer always holds the most recent samples.
+    """
+
+    def __init__(self, worker, tracker, poll_interval=0.002, buffer=None):
+        super().__init__(name='gaze-streamer', daemon=True)
+        self.worker = worker
+        self.tracker = tracker
+        self.poll_interval = poll_interval
+        self.buffer = buffer
+        self._subscriptions = []
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._stop_event = threading.Event()
+        if buffer is not None:
+            self._active.set()
+
+    def subscribe(self, maxlen=2000):
+        subscription = Subscription(maxlen)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._active.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            if not self._subscriptions and not self._listeners and self.buffer is None:
+                self._active.clear()
+
+    def add_listener(self, listener):
+        """Call listener(block) with every new block of samples."""
+        with self._lock:
+            self._listeners.append(listener)
+            self._active.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._active.set()
+
+    def run(self):
+        idle = True
+        while not self._stop_event.is_set():
+            if not self._active.is_set():
+                idle = True
+                self._active.wait()
+            try:
+                samples = self.worker.call(read_link_samples, self.tracker,
+                                           priority=PRIORITY_CONTROL, timeout=1.0)
+            except concurrent.futures.TimeoutError:
+                samples = []  # the worker is busy with a long call, e.g. a file transfer
+            except Exception as e:
+                print(f'Error reading link samples: {e}')
+                samples = []
+            if idle:
+                # whatever queued up while nobody listened is stale
+                idle = False
+                samples = []
+            if samples:
+                block = samples_to_array(samples)
+                if self.buffer is not None:
+                    self.buffer.write(block)
+                with self._lock:
+                    subscriptions = list(self._subscriptions)
+                    listeners = list(self._listeners)
+                for subscription in subscriptions:
+                    # one broken subscriber must not stop acquisition for everyone
+                    try:
+                        subscription.publish(block)
+                    except Exception as e:
+                        print(f'Error publishing samples: {e}')
+                for listener in listeners:
+                    try:
+                        listener(block)
+                    except Exception as e:
+                        print(f'Error in sample listener: {e}')
+            self._stop_event.wait(self.poll_interval)
@@ -0,0 +1,306 @@
+"""Model of the Host PC screen, redrawn by difference.
+
+The Host screen is a picture, not a set of objects: drawing commands
+(draw_box, draw_text, ...) paint over what is there and nothing can be
+taken off again. HostScreen keeps the scene the browser wants (background,
+backdrop and named objects, drawn in order) and the scene last drawn. A
+redraw sends only what changed:
+
+    added objects      are drawn on top
+    removed or changed objects are painted over with the background (and
+                       the backdrop under them restored), then every object
+                       overlapping that area is drawn again, in order
+    background or backdrop changed, or the Host state unknown
+                       clear_screen and draw everything
+
+and falls back to the full redraw when that would be cheaper. The Host
+screen has no text metrics, so the area of text and crosses is estimated
+generously.
+
+While the tracker records, redraws are spaced at least min_interval apart;
+changes in between are merged and drawn together when the interval is up.
+The station sets recording from startRecording and stopRecording, so a
+redraw never has to ask the tracker.
+The model assumes it alone draws on the Host screen. After drawing
+otherwise (sendCommand, backdrop, beginTrial clearing the screen), send a
+full redraw.
+"""
+
+import threading
+import time
+
+from backdrop import to_pylink
+from pylink_constants import BX_MAXCONTRAST
+
+OBJECT_FIELDS = {
+    'box': ('x1', 'y1', 'x2', 'y2'),
+    'filled_box': ('x1', 'y1', 'x2', 'y2'),
+    'line': ('x1', 'y1', 'x2', 'y2'),
+    'cross': ('x', 'y'),
+    'text': ('x', 'y'),
+}
+
+# Estimated extent of what the Host draws, in pixels
+MARGIN = 2
+CROSS_SIZE = 25
+TEXT_HEIGHT = 24
+TEXT_CHAR_WIDTH = 14
+
+# A restored backdrop region costs about one command per this many pixels
+BACKDROP_PIXELS_PER_COMMAND = 20000
+
+
+def make_object(spec):
+    """Validate an object from the browser, e.g. {"type": "cross", "x": 960, "y": 540}."""
+    if not isinstance(spec, dict) or spec.get('type') not in OBJECT_FIELDS:
+        raise ValueError(f'Object needs a "type" out of {", ".join(OBJECT_FIELDS)}: {spec!r}')
+    obj = {'type': spec['type'], 'color': int(spec.get('color', 15))}
+    for field in OBJECT_FIELDS[spec['type']]:
+        if field not in spec:
+            raise ValueError(f'{spec["type"]} needs "{field}"')
+        obj[field] = int(spec[field])
+    if spec['type'] == 'text':
+        obj['text'] = str(spec.get('text', '')).replace('"', "'")
+    return obj
+
+
+def draw_command(obj):
+    kind = obj['type']
+    if kind == 'cross':
+        return f"draw_cross {obj['x']} {obj['y']} {obj['color']}"
+    if kind == 'text':
+        return f"draw_text {obj['x']} {obj['y']} {obj['color']} \"{obj['text']}\""
+    return f"draw_{kind} {obj['x1']} {obj['y1']} {obj['x2']} {obj['y2']} {obj['color']}"
+
+
+def extent(obj):
+    """(left, top, right, bottom) the object may have painted."""
+    kind = obj['type']
+    if kind == 'cross':
+        left, top = obj['x'] - CROSS_SIZE, obj['y'] - CROSS_SIZE
+        right, bottom = obj['x'] + CROSS_SIZE, obj['y'] + CROSS_SIZE
+    elif kind == 'text':
+        half_width = (len(obj['text']) + 1) * TEXT_CHAR_WIDTH // 2
+        left, top = obj['x'] - half_width, obj['y'] - TEXT_HEIGHT
+        right, bottom = obj['x'] + half_width, obj['y'] + TEXT_HEIGHT
+    else:
+        left, right = sorted((obj['x1'], obj['x2']))
+        top, bottom = sorted((obj['y1'], obj['y2']))
+    return max(0, left - MARGIN), max(0, top - MARGIN), right + MARGIN, bottom + MARGIN
+
+
+def overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class Scene:
+    def __init__(self, background=0, backdrop=None, objects=None):
+        self.background = background
+        self.backdrop = backdrop  # {"image", "width", "height", "x", "y", "options"} or None
+        self.objects = dict(objects or {})  # id -> object, in drawing order
+
+    def copy(self):
+        return Scene(self.background, self.backdrop, self.objects)
+
+    def as_dict(self):
+        return {'background': self.background, 'backdrop': self.backdrop, 'objects': dict(self.objects)}
+
+
+def full_plan(scene):
+    steps = [('command', f'clear_screen {scene.background}')]
+    if scene.backdrop is not None:
+        steps.append(('backdrop', None))
+    steps += [('command', draw_command(obj)) for obj in scene.objects.values()]
+    return steps
+
+
+def cost(steps, backdrop_pixels):
+    """Rough cost of steps in commands, a restored backdrop counting by its area."""
+    total = 0.0
+    for kind, area in steps:
+        total += 1
+        if kind == 'backdrop':
+            pixels = backdrop_pixels if area is None else (area[2] - area[0]) * (area[3] - area[1])
+            total += pixels / BACKDROP_PIXELS_PER_COMMAND
+    return total
+
+
+def plan(shown, target):
+    """Steps that turn the Host screen from shown (None: unknown) into target.
+
+    Each step is ('command', text), ('backdrop', None) for the whole
+    backdrop or ('backdrop', (left, top, right, bottom)) to restore part of
+    it. Returns (steps, full).
+    """
+    full = full_plan(target)
+    if shown is None or shown.background != target.background or shown.backdrop != target.backdrop:
+        return full, True
+    old, new = shown.objects, target.objects
+    kept = [key for key in old if new.get(key) == old[key]]
+    if kept != [key for key in new if old.get(key) == new[key]]:
+        return full, True  # the drawing order of unchanged objects changed
+
+    dirty = [extent(obj) for key, obj in old.items() if new.get(key) != obj]
+    steps = []
+    for area in dirty:
+        steps.append(('command', f'draw_filled_box {area[0]} {area[1]} {area[2]} {area[3]} {target.background}'))
+        if target.backdrop is not None:
+            steps.append(('backdrop', area))
+
+    order = list(new)
+    extents = {key: extent(obj) for key, obj in new.items()}
+    redraw = {key for key in order if old.get(key) != new[key]
+              or any(overlaps(extents[key], area) for area in dirty)}
+    # whatever lies on top of a redrawn object must be drawn again after it
+    for i, key in enumerate(order):
+        if key not in redraw and any(other in redraw and overlaps(extents[key], extents[other])
+                                     for other in order[:i]):
+            redraw.add(key)
+    steps += [('command', draw_command(new[key])) for key in order if key in redraw]
+    backdrop = target.backdrop or {}
+    backdrop_pixels = (backdrop.get('width') or 1920) * (backdrop.get('height') or 1080)
+    if cost(steps, backdrop_pixels) >= cost(full, backdrop_pixels):
+        return full, True
+    return steps, False
+
+
+class HostScreen:
+    """The Host screen of one tracker; see the module docstring."""
+
+    def __init__(self, worker, tracker, backdrops, min_interval=0.1, timeout=30.0):
+        self.worker = worker
+        self.tracker = tracker
+        self.backdrops = backdrops
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.target = Scene()
+        self.shown = None  # the Host screen's state is unknown until the first draw
+        self.recording = False  # set by the station as recording starts and stops
+        self._invalid = False  # set by invalidate(), read by the next draw
+        self.stats = {'draws': 0, 'full_draws': 0, 'commands': 0, 'full_commands': 0, 'deferred': 0}
+        self._last_draw = 0.0
+        self._timer = None
+        self._lock = threading.Lock()  # guards target, stats, the timer and _invalid
+        self._draw_lock = threading.Lock()  # one draw at a time, guards shown
+
+    def update(self, changes):
+        """Apply changes from the browser and redraw. Returns what was done.
+
+        changes may hold "background" (color index), "backdrop" (null or
+        {"image", "width", "height", "x", "y", "options"}), "clear" (remove
+        every object first), "objects" ({id: object or null to remove}) and
+        "redraw" (draw everything, e.g. after the Host screen was drawn on
+        otherwise).
+        """
+        objects = changes.get('objects') or {}
+        if not isinstance(objects, dict):
+            raise ValueError('"objects" must map ids to objects')
+        made = {str(key): None if spec is None else make_object(spec) for key, spec in objects.items()}
+        backdrop = changes.get('backdrop')
+        if backdrop is not None:
+            if not isinstance(backdrop, dict) or not backdrop.get('image'):
+                raise ValueError('"backdrop" needs an "image"')
+            backdrop = {'image': str(backdrop['image']), 'width': int(backdrop.get('width', 0)),
+                        'height': int(backdrop.get('height', 0)), 'x': int(backdrop.get('x', 0)),
+                        'y': int(backdrop.get('y', 0)), 'options': int(backdrop.get('options', BX_MAXCONTRAST))}
+            self.backdrops.image(backdrop['image'], backdrop['width'], backdrop['height'])  # fails early
+
+        with self._lock:
+            if 'background' in changes:
+                self.target.background = int(changes['background'])
+            if 'backdrop' in changes:
+                self.target.backdrop = backdrop
+            if changes.get('clear'):
+                self.target.objects = {}
+            for key, obj in made.items():
+                if obj is None:
+                    self.target.objects.pop(key, None)
+                else:
+                    self.target.objects[key] = obj  # a changed object keeps its place in the order
+        if changes.get('redraw'):
+            self.invalidate()
+        return self.flush()
+
+    def invalidate(self):
+        """Forget what the Host screen shows, so the next draw is a full one.
+
+        Called on the tracker worker, so it must not wait for a draw, which
+        waits for the worker.
+        """
+        with self._lock:
+            self._invalid = True
+
+    def flush(self):
+        """Draw the target scene now, or once min_interval is up while recording."""
+        with self._draw_lock:
+            wait = self.min_interval - (time.monotonic() - self._last_draw)
+            if wait > 0 and self.recording:
+                with self._lock:
+                    self.stats['deferred'] += 1
+                    if self._timer is None:
+                        self._timer = threading.Timer(wait, self._deferred_flush)
+                        self._timer.daemon = True
+                        self._timer.start()
+                return {'deferred': True, 'delay': wait}
+
+            with self._lock:
+                target = self.target.copy()
+                if self._invalid:
+                    self._invalid = False
+                    self.shown = None
+            steps, full = plan(self.shown, target)
+            calls = self._prepare(steps, target.backdrop)
+            try:
+                self.worker.call(self._draw, calls, timeout=self.timeout)
+            except BaseException:
+                self.shown = None  # drawn partly, if at all
+                raise
+            self.shown = target
+            self._last_draw = time.monotonic()
+            with self._lock:
+                self.stats['draws'] += 1
+                self.stats['full_draws'] += full
+                self.stats['commands'] += len(steps)
+                self.stats['full_commands'] += len(full_plan(target))
+            return {'deferred': False, 'full': full,
+                    'steps': [call[1] if call[0] == 'sendCommand'
+                              else f'bitmapBackdrop {call[1]}x{call[2]} at {call[8]},{call[9]}' for call in calls]}
+
+    def _deferred_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f'Error redrawing the Host screen: {e}')
+
+    def _prepare(self, steps, backdrop):
+        """Turn steps into tracker calls, converting backdrop pixels here rather than on the worker."""
+        calls = []
+        for kind, area in steps:
+            if kind == 'command':
+                calls.append(('sendCommand', area))
+                continue
+            image = self.backdrops.image(backdrop['image'], backdrop['width'], backdrop['height'])
+            height, width = image.shape[:2]
+            left, top, right, bottom = (backdrop['x'], backdrop['y'], backdrop['x'] + width, backdrop['y'] + height)
+            if area is not None:
+                left, top = max(left, area[0]), max(top, area[1])
+                right, bottom = min(right, area[2] + 1), min(bottom, area[3] + 1)
+            if right <= left or bottom <= top:
+                continue
+            region = image[top - backdrop['y']:bottom - backdrop['y'], left - backdrop['x']:right - backdrop['x']]
+            w, h = right - left, bottom - top
+            calls.append(('bitmapBackdrop', w, h, to_pylink(region), 0, 0, w, h, left, top, backdrop['options']))
+        return calls
+
+    def _draw(self, calls):
+        for name, *args in calls:
+            getattr(self.tracker, name)(*args)
+
+    def state(self):
+        with self._lock:
+            target = self.target.as_dict()
+            stats = dict(self.stats)
+        shown = self.shown
+        return {'target': target, 'shown': shown.as_dict() if shown is not None else None, 'stats': stats}
@@ -0,0 +1,386 @@
+"""Interest areas declared by the experiment, and gaze hit-testing against them.
+
+Trials declare interest areas with Data Viewer messages, which the server
+sees as they pass through sendMessage:
+
+    !V IAREA RECTANGLE <id> <left> <top> <right> <bottom> [label]
+    !V IAREA ELLIPSE <id> <left> <top> <right> <bottom> [label]
+    !V IAREA FREEHAND <id> <x1,y1> <x2,y2> ... [label]
+
+A TRIALID message starts a new trial and clears them. The areas of a trial
+go into a uniform grid (InterestAreaIndex): every cell lists the areas whose
+bounding box overlaps it, so hit-testing a gaze point only looks at the few
+areas in its cell instead of all of them, and a whole block of samples is
+tested in one vectorized pass. Where areas overlap, the one declared first
+wins. The grid only covers the display, as declared by the Data Viewer
+message DISPLAY_COORDS <left> <top> <right> <bottom> (up to DEFAULT_DISPLAY
+until then), so that an area with huge coordinates cannot make it huge too.
+
+AOIMonitor runs as a GazeStreamer listener and turns the hits into enter,
+exit and dwell events (dwell: gaze has stayed dwell_time ms in one area).
+Gaze is held in the current area through missing samples, so a blink does
+not count as leaving it.
+"""
+
+import threading
+
+import numpy as np
+
+from gaze_frames import MISSING_DATA
+from subscribers import Subscribers
+
+SHAPE_RECTANGLE = 1
+SHAPE_ELLIPSE = 2
+SHAPE_FREEHAND = 3
+
+_SHAPES = {'RECTANGLE': SHAPE_RECTANGLE, 'ELLIPSE': SHAPE_ELLIPSE, 'FREEHAND': SHAPE_FREEHAND}
+_SHAPE_NAMES = {value: name for name, value in _SHAPES.items()}
+
+# left, top, right, bottom the grid covers until a DISPLAY_COORDS message
+# says otherwise: room for an 8K display
+DEFAULT_DISPLAY = (0.0, 0.0, 8191.0, 8191.0)
+
+
+class InterestArea:
+    def __init__(self, id, shape, left, top, right, bottom, label='', vertices=None):
+        self.id = id
+        self.shape = shape
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+        self.label = label
+        self.vertices = vertices  # (n, 2) array for freehand areas
+
+    def as_dict(self):
+        area = {'id': self.id, 'shape': _SHAPE_NAMES[self.shape].lower(), 'label': self.label,
+                'left': self.left, 'top': self.top, 'right': self.right, 'bottom': self.bottom}
+        if self.vertices is not None:
+            area['vertices'] = self.vertices.tolist()
+        return area
+
+
+def _strip_offset(parts):
+    """Drop the time offset prefix of a back-dated message."""
+    if parts and parts[0].lstrip('-').isdigit():
+        return parts[1:]
+    return parts
+
+
+def parse_interest_area(text):
+    """Parse a '!V IAREA' message. Returns None for other messages.
+
+    Raises ValueError for interest area messages it cannot read.
+    """
+    parts = _strip_offset(text.split())
+    if parts[:2] != ['!V', 'IAREA']:
+        return None
+    if len(parts) < 4 or parts[2].upper() not in _SHAPES:
+        raise ValueError(f'Unsupported interest area: {text}')
+    shape = _SHAPES[parts[2].upper()]
+    area_id = parts[3]
+    if shape == SHAPE_FREEHAND:
+        points = []
+        rest = parts[4:]
+        while rest and ',' in rest[0]:
+            x, _, y = rest.pop(0).partition(',')
+            points.append((float(x), float(y)))
+        if len(points) < 3:
+            raise ValueError(f'Freehand interest area needs at least 3 points: {text}')
+        vertices = np.array(points)
+        if not np.isfinite(vertices).all():
+            raise ValueError(f'Interest area coordinates must be finite: {text}')
+        (left, top), (right, bottom) = vertices.min(axis=0), vertices.max(axis=0)
+        return InterestArea(area_id, shape, float(left), float(top), float(right), float(bottom),
+                            ' '.join(rest), vertices)
+    if len(parts) < 8:
+        raise ValueError(f'Interest area needs left, top, right and bottom: {text}')
+    left, top, right, bottom = (float(value) for value in parts[4:8])
+    if not np.isfinite([left, top, right, bottom]).all():
+        raise ValueError(f'Interest area coordinates must be finite: {text}')
+    return InterestArea(area_id, shape, min(left, right), min(top, bottom), max(left, right),
+                        max(top, bottom), ' '.join(parts[8:]))
+
+
+def _polygon_edges(vertices, size):
+    """(size, 4) array of x1, y1, x2, y2, padded with edges that cross nothing."""
+    edges = np.zeros((size, 4))
+    edges[:, 1] = edges[:, 3] = np.inf
+    edges[:len(vertices), :2] = vertices
+    edges[:len(vertices), 2:] = np.roll(vertices, -1, axis=0)
+    return edges
+
+
+def _in_polygon(x, y, edges):
+    """Even-odd rule for points x, y against polygons given as (n, edges, 4)."""
+    x, y = x[:, None], y[:, None]
+    ax, ay, bx, by = edges[..., 0], edges[..., 1], edges[..., 2], edges[..., 3]
+    crosses = (ay > y) != (by > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at = ax + (y - ay) * (bx - ax) / (by - ay)
+    return (np.count_nonzero(crosses & (x < at), axis=1) % 2).astype(bool)
+
+
+def parse_display_coords(text):
+    """(left, top, right, bottom) of a DISPLAY_COORDS message, else None."""
+    parts = _strip_offset(text.split())
+    if len(parts) != 5 or parts[0] != 'DISPLAY_COORDS':
+        return None
+    try:
+        left, top, right, bottom = (float(value) for value in parts[1:])
+    except ValueError:
+        return None
+    if not np.isfinite([left, top, right, bottom]).all() or right < left or bottom < top:
+        return None
+    return left, top, right, bottom
+
+
+class InterestAreaIndex:
+    """A uniform grid over a fixed list of interest areas, within display."""
+
+    def __init__(self, areas, cell_size=50.0, display=DEFAULT_DISPLAY):
+        self.areas = list(areas)
+        self.cell_size = cell_size
+        n = len(self.areas)
+        self._bounds = np.array([(a.left, a.top, a.right, a.bottom) for a in self.areas],
+                                dtype=np.float64).reshape(n, 4)
+        self._shapes = np.array([a.shape for a in self.areas], dtype=np.uint8)
+        if not n:
+            return
+        # freehand outlines as edge lists, padded to the longest one
+        longest = max((len(a.vertices) for a in self.areas if a.vertices is not None), default=0)
+        self._edges = np.zeros((n, longest, 4))
+        for i, area in enumerate(self.areas):
+            if area.vertices is not None:
+                self._edges[i] = _polygon_edges(area.vertices, longest)
+        # the grid covers the part of the areas on the display; gaze off it hits nothing
+        grid = self._bounds.copy()
+        grid[:, 0::2] = np.clip(grid[:, 0::2], display[0], display[2])
+        grid[:, 1::2] = np.clip(grid[:, 1::2], display[1], display[3])
+        self._x0, self._y0 = grid[:, 0].min(), grid[:, 1].min()
+        self._columns = int((grid[:, 2].max() - self._x0) // cell_size) + 1
+        self._rows = int((grid[:, 3].max() - self._y0) // cell_size) + 1
+
+        # cells overlapped by each area's bounding box, as (cell, area) pairs
+        cells, owners = [], []
+        for i, (left, top, right, bottom) in enumerate(grid):
+            c0, c1 = int((left - self._x0) // cell_size), int((right - self._x0) // cell_size)
+            r0, r1 = int((top - self._y0) // cell_size), int((bottom - self._y0) // cell_size)
+            block = (np.arange(r0, r1 + 1)[:, None] * self._columns + np.arange(c0, c1 + 1)).ravel()
+            cells.append(block)
+            owners.append(np.full(len(block), i))
+        cells, owners = np.concatenate(cells), np.concatenate(owners)
+        # stable sort keeps the areas of each cell in declaration order
+        order = np.argsort(cells, kind='stable')
+        self._items = owners[order]
+        self._starts = np.searchsorted(cells[order], np.arange(self._rows * self._columns + 1))
+
+    def __len__(self):
+        return len(self.areas)
+
+    def hit_test(self, x, y):
+        """Index of the area under each point, -1 for none.
+
+        x and y are arrays; NaN and MISSING_DATA points hit nothing.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        result = np.full(len(x), -1, dtype=np.int64)
+        if not self.areas or not len(x):
+            return result
+        with np.errstate(invalid='ignore'):
+            column = np.floor((x - self._x0) / self.cell_size)
+            row = np.floor((y - self._y0) / self.cell_size)
+            valid = ((column >= 0) & (column < self._columns) & (row >= 0) & (row < self._rows)
+                     & (x != MISSING_DATA))
+        points = np.flatnonzero(valid)
+        if not len(points):
+            return result
+        cell = row[points].astype(np.int64) * self._columns + column[points].astype(np.int64)
+        starts = self._starts[cell]
+        counts = self._starts[cell + 1] - starts
+
+        # one row per (point, candidate area) pair
+        point = np.repeat(points, counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        area = self._items[np.repeat(starts, counts) + np.arange(len(point)) - first]
+        px, py = x[point], y[point]
+        left, top, right, bottom = self._bounds[area].T
+        hit = (px >= left) & (px < right) & (py >= top) & (py < bottom)
+
+        shapes = self._shapes[area]
+        ellipse = hit & (shapes == SHAPE_ELLIPSE)
+        if ellipse.any():
+            rx = (right[ellipse] - left[ellipse]) / 2
+            ry = (bottom[ellipse] - top[ellipse]) / 2
+            dx = (px[ellipse] - left[ellipse] - rx) / rx
+            dy = (py[ellipse] - top[ellipse] - ry) / ry
+            hit[ellipse] = dx * dx + dy * dy <= 1.0
+        freehand = hit & (shapes == SHAPE_FREEHAND)
+        if freehand.any():
+            hit[freehand] = _in_polygon(px[freehand], py[freehand], self._edges[area[freehand]])
+
+        # candidates come in declaration order, so the first hit is the winner
+        point, area = point[hit], area[hit]
+        first = np.ones(len(point), dtype=bool)
+        first[1:] = point[1:] != point[:-1]
+        result[point[first]] = area[first]
+        return result
+
+    def area_at(self, x, y):
+        """The area under one point, or None."""
+        i = self.hit_test([x], [y])[0]
+        return self.areas[i] if i >= 0 else None
+
+
+class InterestAreaRegistry:
+    """The interest areas of the current trial, fed with sendMessage texts."""
+
+    def __init__(self, cell_size=50.0):
+        self.cell_size = cell_size
+        self.display = DEFAULT_DISPLAY
+        self.trial = None
+        self.generation = 0  # changes whenever the area list is replaced
+        self._areas = []
+        self._positions = {}  # id -> position in _areas
+        self._index = None
+        self._lock = threading.Lock()
+
+    def handle_message(self, text):
+        parts = _strip_offset(text.split())
+        if parts and parts[0] == 'TRIALID':
+            self.clear(' '.join(parts[1:]))
+            return
+        display = parse_display_coords(text)
+        if display is not None:
+            with self._lock:
+                self.display = display
+                self._index = None
+            return
+        try:
+            area = parse_interest_area(text)
+        except ValueError as e:
+            print(f'Error reading interest area: {e}')
+            return
+        if area is not None:
+            self.add(area)
+
+    def add(self, area):
+        with self._lock:
+            position = self._positions.get(area.id)
+            if position is None:
+                self._positions[area.id] = len(self._areas)
+                self._areas.append(area)
+            else:
+                # a redefinition changes what an index means
+                self._areas[position] = area
+                self.generation += 1
+            self._index = None
+
+    def clear(self, trial=None):
+        with self._lock:
+            self.trial = trial
+            self._areas = []
+            self._positions = {}
+            self._index = None
+            self.generation += 1
+
+    def index(self):
+        """Return (generation, InterestAreaIndex) for the current areas.
+
+        The index is built on first use after a change, so declaring
+        hundreds of areas in a row costs one build.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = InterestAreaIndex(self._areas, self.cell_size, self.display)
+            return self.generation, self._index
+
+    def state(self):
+        with self._lock:
+            return {'trial': self.trial, 'areas': [area.as_dict() for area in self._areas]}
+
+
+def gaze_position(block):
+    """Binocular average of the valid eyes of each sample, NaN if none."""
+    left = block['left_x'] != MISSING_DATA
+    right = block['right_x'] != MISSING_DATA
+    count = left.astype(np.float64) + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (np.where(left, block['left_x'], 0.0) + np.where(right, block['right_x'], 0.0)) / count
+        y = (np.where(left, block['left_y'], 0.0) + np.where(right, block['right_y'], 0.0)) / count
+    return x, y
+
+
+class AOIMonitor:
+    """Turns samples into interest area enter, exit and dwell events.
+
+    Events are dicts with type, id, label, time (tracker ms) and, for exit
+    and dwell, dwell (ms spent in the area).
+    """
+
+    def __init__(self, registry, dwell_time=500.0):
+        self.registry = registry
+        self.dwell_time = dwell_time
+        self._generation = None
+        self._areas = []
+        self._current = -1
+        self._entered = None
+        self._dwell_sent = False
+        self._subscribers = Subscribers()
+
+    def __call__(self, block):
+        if not len(block):
+            return
+        generation, index = self.registry.index()
+        times = block['time']
+        events = []
+        if generation != self._generation:
+            # new trial or redefined areas: leave the old area
+            self._change(-1, float(times[0]), events)
+            self._generation = generation
+        self._areas = index.areas
+
+        x, y = gaze_position(block)
+        hits = index.hit_test(x, y)
+        # hold the current area through missing samples
+        values = np.concatenate(([self._current], hits))
+        missing = np.concatenate(([False], np.isnan(x)))
+        filled = values[np.maximum.accumulate(np.where(missing, 0, np.arange(len(values))))]
+        changes = np.flatnonzero(filled[1:] != filled[:-1])
+        for i in changes:
+            self._change(int(filled[i + 1]), float(times[i]), events)
+        self._check_dwell(float(times[-1]), events)
+        if events:
+            self._subscribers.publish(events)
+
+    def _change(self, area, time, events):
+        self._check_dwell(time, events)
+        if self._current >= 0:
+            events.append(self._event('exit', self._current, time, time - self._entered))
+        self._current = area
+        self._entered = time
+        self._dwell_sent = False
+        if area >= 0:
+            events.append(self._event('enter', area, time))
+
+    def _check_dwell(self, time, events):
+        if (self._current >= 0 and not self._dwell_sent
+                and time - self._entered >= self.dwell_time):
+            self._dwell_sent = True
+            events.append(self._event('dwell', self._current, self._entered + self.dwell_time,
+                                      self.dwell_time))
+
+    def _event(self, kind, area, time, dwell=None):
+        event = {'type': kind, 'id': self._areas[area].id, 'label': self._areas[area].label,
+                 'time': time}
+        if dwell is not None:
+            event['dwell'] = dwell
+        return event
+
+    def subscribe(self, maxsize=1000):
+        """A queue.Queue that receives every event from now on."""
+        return self._subscribers.subscribe(maxsize)
+
+    def unsubscribe(self, subscription):
+        self._subscribers.unsubscribe(subscription)
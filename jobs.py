@@ -0,0 +1,211 @@
+"""Tracker calls that run in the background instead of holding up a request.
+
+A job runs on the tracker worker like any other pylink call, but the request
+that starts it returns straight away with the job's id. The job reports
+progress while it runs; GET /jobs/<id> returns its state, which ends in
+"done" with a result, "failed" with an error or "cancelled". Every change of
+state is also pushed to subscribers (WS /ws/jobs).
+
+A queued job is cancelled by dropping it from the worker queue. A running
+one cannot be interrupted from outside, so cancel() only sets a flag and
+queues the hook the job registered with on_cancel(), e.g. exitCalibration(),
+as urgent work on the tracker worker (see tracker_worker.py); the job raises
+JobCancelled when it sees the flag. A job that can neither be interrupted
+nor have its outcome discarded calls refuse_cancel() instead, and cancel()
+then raises CannotCancel while it runs.
+"""
+
+import itertools
+import threading
+import time
+
+from subscribers import Subscribers
+from tracker_worker import PRIORITY_BULK
+
+
+class JobCancelled(Exception):
+    """Raised by a job that stopped because it was cancelled."""
+
+
+class TooManyJobs(Exception):
+    """Raised by JobRegistry.start when max_unfinished jobs have not finished yet."""
+
+
+class CannotCancel(Exception):
+    """Raised by JobRegistry.cancel for a running job that refused to be cancelled."""
+
+
+class Job:
+    def __init__(self, id, name, args, publish=None, station=''):
+        self.id = id
+        self.name = name
+        self.args = args
+        self.station = station  # id of the station the job runs on
+        self.status = 'queued'  # queued, running, done, failed or cancelled
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+        self._on_cancel = None
+        self._refuse_cancel = None  # why cancel() is refused while the job runs
+        self._future = None
+        self._publish = publish
+
+    def update(self, **progress):
+        """Record progress; safe to call from any thread."""
+        with self._lock:
+            self.progress.update(progress)
+        if self._publish is not None:
+            self._publish(self)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def on_cancel(self, hook):
+        """Call hook() on the worker, as urgent work, if the job is cancelled while it runs."""
+        with self._lock:
+            self._on_cancel = hook
+        if self._cancel.is_set():
+            hook()
+
+    def refuse_cancel(self, reason):
+        """Make cancel() raise CannotCancel(reason) from now on; call from the running job.
+
+        Raises JobCancelled if the job was cancelled before it got here.
+        """
+        with self._lock:
+            self._refuse_cancel = reason
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if the job has been cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout=None):
+        """Wait until the job has finished. Returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def state(self):
+        with self._lock:
+            return {'id': self.id, 'name': self.name, 'args': list(self.args), 'station': self.station,
+                    'status': self.status, 'created': self.created, 'started': self.started,
+                    'finished': self.finished, 'progress': dict(self.progress), 'result': self.result,
+                    'error': self.error}
+
+
+class JobRegistry:
+    """Starts jobs on the tracker worker and keeps the most recent ones."""
+
+    def __init__(self, worker, keep=100, max_unfinished=10, on_start=None, on_finish=None, station=''):
+        self.worker = worker
+        self.station = station
+        self.keep = keep
+        self.max_unfinished = max_unfinished
+        self.on_start = on_start  # called with each job as it starts, on the worker
+        self.on_finish = on_finish  # called with each job once it has finished
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._subscribers = Subscribers()
+        self._lock = threading.Lock()
+
+    def start(self, name, fn, args=(), priority=PRIORITY_BULK):
+        """Queue fn(job) on the worker and return the Job at once.
+
+        Raises TooManyJobs rather than queue more than max_unfinished jobs.
+        """
+        with self._lock:
+            unfinished = sum(1 for old in self._jobs.values() if old.finished is None)
+            if unfinished >= self.max_unfinished:
+                raise TooManyJobs(f'{unfinished} jobs have not finished yet')
+            job = Job(str(next(self._ids)), name, args, publish=self._publish, station=self.station)
+            self._jobs[job.id] = job
+            # forget the oldest finished jobs
+            finished = [old for old in self._jobs.values() if old.finished is not None]
+            for old in finished[:max(0, len(self._jobs) - self.keep)]:
+                del self._jobs[old.id]
+        job._future = self.worker.submit(self._run, job, fn, priority=priority)
+        self._publish(job)
+        return job
+
+    def _run(self, job, fn):
+        with job._lock:
+            job.status = 'running'
+            job.started = time.time()
+        self._publish(job)
+        if self.on_start is not None:
+            self.on_start(job)
+        try:
+            job.check_cancelled()  # cancelled while the worker was picking it up
+            result = fn(job)
+        except JobCancelled:
+            self._finish(job, 'cancelled', error='Cancelled')
+        except Exception as e:
+            self._finish(job, 'failed', error=str(e) or type(e).__name__)
+            print(f'Job {job.id} ({job.name}) failed: {job.error}')
+        else:
+            self._finish(job, 'done', result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        with job._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+        job._done.set()
+        self._publish(job)
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def cancel(self, job):
+        """Cancel a job. Returns False if it had already finished.
+
+        Raises CannotCancel for a running job that called refuse_cancel().
+        """
+        with job._lock:
+            if job.finished is not None:
+                return False
+            if job._refuse_cancel is not None:
+                raise CannotCancel(job._refuse_cancel)
+            job._cancel.set()
+            hook = job._on_cancel
+        if job._future is not None and job._future.cancel():
+            self._finish(job, 'cancelled', error='Cancelled before it started')
+        elif hook is not None:
+            def report(future):
+                if not future.cancelled() and future.exception() is not None:
+                    print(f'Error cancelling job {job.id} ({job.name}): {future.exception()}')
+            self.worker.submit_urgent(hook).add_done_callback(report)
+        return True
+
+    def running(self):
+        """The job the worker is busy with, or None."""
+        for job in self.jobs():
+            if job.status == 'running':
+                return job
+        return None
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def subscribe(self, maxsize=1000):
+        """A queue.Queue that receives the state of a job whenever it changes."""
+        return self._subscribers.subscribe(maxsize)
+
+    def unsubscribe(self, subscription):
+        self._subscribers.unsubscribe(subscription)
+
+    def _publish(self, job):
+        if self._subscribers:
+            self._subscribers.publish([job.state()])
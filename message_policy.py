@@ -0,0 +1,183 @@
+"""Policies for high-frequency sendMessage traffic.
+
+Experiments that log a message every display frame send more than the
+tracker's message buffer takes comfortably, and every message queued on the
+tracker worker delays the markers behind it. Each message is therefore
+matched against a list of rules, (pattern, policy) with the first match
+winning, and handled by its policy:
+
+    critical   sent at once, as every message used to be; never coalesced,
+               batched or refused. The default for messages no rule matches.
+    coalesce   latest wins: held for up to flush_interval, and replaced by a
+               newer message with the same key meanwhile. The key is the
+               pattern's first group, or the pattern itself.
+    batch      held and sent with the other held messages every
+               flush_interval, at bulk priority.
+
+Held messages are sent in the order they arrived, each back-dated to the
+time it reached the server (or its client_time), so holding them does not
+move them in the EDF. Before a critical message, whatever is held is sent
+first, so the EDF keeps the order of the messages too.
+
+While a job holds the tracker worker (see jobs.py), critical messages are
+held too, and sent in order once the job has finished.
+
+The request for a held message returns at once (HTTP 202). Once limit
+messages are held, new ones are refused with HTTP 429 and counted as
+dropped; a critical message is never refused. Every response to sendMessage
+carries "backpressure": true while the held messages or the tracker
+worker's queue are past half their bound, as a signal to log less.
+"""
+
+import re
+import threading
+
+from clock_sync import server_clock_ms
+from commands import send_message
+from tracker_worker import PRIORITY_BULK, PRIORITY_MESSAGE
+
+POLICIES = ('critical', 'coalesce', 'batch')
+
+# Trial structure, display onsets and responses (also as part of a name,
+# image_onset or key_response) are always sent at once; STATUS <name> ...
+# keeps the latest per name; !V FRAME and NOTE are batched
+DEFAULT_RULES = [
+    (r'^(TRIALID|TRIAL_RESULT|!V TRIAL_VAR|SYNCTIME|DISPLAY ON)\b', 'critical'),
+    (r'(?i)(^|_|\b)(onset|response)(\b|_)', 'critical'),
+    (r'^STATUS\s+(\S+)', 'coalesce'),
+    (r'^(!V FRAME|NOTE)\b', 'batch'),
+]
+
+
+class MessagePolicy:
+    """Holds, coalesces and batches one station's messages; see the module docstring."""
+
+    def __init__(self, worker, tracker, rules=None, limit=1000, flush_interval=0.05, worker_limit=100):
+        self.worker = worker
+        self.tracker = tracker
+        self.rules = []
+        for pattern, policy in DEFAULT_RULES if rules is None else rules:
+            if policy not in POLICIES:
+                raise ValueError(f'Unknown message policy {policy!r}, expected one of {", ".join(POLICIES)}')
+            self.rules.append((re.compile(pattern), policy))
+        self.limit = limit
+        self.flush_interval = flush_interval
+        self.worker_limit = worker_limit
+        self.stats = {'critical': 0, 'held': 0, 'coalesced': 0, 'dropped': 0, 'sent': 0, 'failed': 0,
+                      'flushes': 0, 'max_pending': 0}
+        self._pending = {}  # key -> (text, event_time), in order of arrival
+        self._sequence = 0
+        self._timer = None
+        self._flush_queued = False  # a flush is waiting on the worker, e.g. behind a job
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        """(policy, key) of a message.
+
+        With the default rules (python -m doctest message_policy.py):
+
+        >>> policy = MessagePolicy(None, None)
+        >>> [policy.classify(text)[0] for text in ('image_onset', 'key_response', 'Stimulus Onset 3', 'TRIALID 4')]
+        ['critical', 'critical', 'critical', 'critical']
+        >>> policy.classify('STATUS fixation 12 3')
+        ('coalesce', 'fixation')
+        >>> [policy.classify(text)[0] for text in ('!V FRAME 120', 'NOTE blink')]
+        ['batch', 'batch']
+        >>> policy.classify('NOTE image_onset')[0]  # the first matching rule wins
+        'critical'
+        """
+        for pattern, policy in self.rules:
+            match = pattern.search(text)
+            if match:
+                key = match.group(1) if pattern.groups else pattern.pattern
+                return policy, key
+        return 'critical', None
+
+    def backpressure(self):
+        return len(self._pending) * 2 > self.limit or self.worker.pending() * 2 > self.worker_limit
+
+    def submit(self, text, event_time=None, hold=False):
+        """Hold a message if its policy says so, or any message with hold.
+
+        Returns None for a critical message, which the caller sends at once
+        (everything held is queued ahead of it), else the response as a
+        (response_dict, http_status) tuple.
+        """
+        policy, key = self.classify(text)
+        if policy == 'critical' and not hold:
+            with self._lock:
+                self.stats['critical'] += 1
+                held = bool(self._pending)
+            if held:
+                self.worker.submit(self._send_pending, priority=PRIORITY_MESSAGE)
+            return None
+
+        if event_time is None:
+            event_time = server_clock_ms()
+        with self._lock:
+            key = ('coalesce', key) if policy == 'coalesce' else ('held', self._sequence)
+            self._sequence += 1
+            replaced = self._pending.pop(key, None) is not None
+            if not replaced and len(self._pending) >= self.limit and policy != 'critical':
+                self.stats['dropped'] += 1
+                pending = len(self._pending)
+                print(f'Message refused, {pending} messages held: {text}')
+                return {'status': 'error', 'message': f'Too many messages held ({pending}), message dropped',
+                        'policy': policy, 'pending': pending, 'backpressure': True,
+                        'retry_after': self.flush_interval * 1000}, 429
+            self._pending[key] = (text, event_time)
+            self.stats['held'] += 1
+            self.stats['coalesced'] += replaced
+            pending = len(self._pending)
+            self.stats['max_pending'] = max(self.stats['max_pending'], pending)
+            if self._timer is None and not self._flush_queued:
+                self._timer = threading.Timer(self.flush_interval, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        result = {'status': 'success', 'message': f'Message held ({policy})', 'policy': policy,
+                  'pending': pending, 'backpressure': self.backpressure()}
+        if replaced:
+            result['replaced'] = True
+        return result, 202
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            self._flush_queued = True
+        self.worker.submit(self._send_pending, priority=PRIORITY_BULK)
+
+    def _send_pending(self):
+        """Send every held message. Runs on the tracker worker."""
+        with self._lock:
+            self._flush_queued = False
+            messages = list(self._pending.values())
+            self._pending.clear()
+        if not messages:
+            return
+        sent = failed = 0
+        for text, event_time in messages:
+            try:
+                send_message(self.tracker, text, event_time)
+                sent += 1
+            except Exception as e:
+                failed += 1
+                print(f'Error sending held message {text!r}: {e}')
+        with self._lock:
+            self.stats['sent'] += sent
+            self.stats['failed'] += failed
+            self.stats['flushes'] += 1
+
+    def stop(self):
+        """Queue whatever is held to be sent; call before stopping the worker."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.worker.submit(self._send_pending, priority=PRIORITY_BULK)
+
+    def state(self):
+        with self._lock:
+            stats = dict(self.stats)
+            pending = len(self._pending)
+        return {'pending': pending, 'limit': self.limit, 'worker_pending': self.worker.pending(),
+                'worker_limit': self.worker_limit, 'backpressure': self.backpressure(), **stats}
@@ -1,93 +1,603 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from flask_sock import Sock
+import atexit
+import json
+import math
+import os
+import queue
 import time
-import re
-import sys  # For sys.exit()
+import threading
+from beacon import BeaconError, SequenceFilter, parse_lines
+from clock_sync import ClockSync, server_clock_ms
+from commands import BACKDROPS, EDF_DOWNLOADS
+from gaze_frames import encode, encode_json
+from jobs import CannotCancel
+from simulated_tracker import SimulatedEyeLink
+from stations import Station, StationRegistry
 # import pylink  # Uncomment if connecting to EyeLink
 
 dummy_mode = True
+# Path of a JSON-lines file that records every command (from /send_command,
+# /send_commands, /ws and /beacon alike) and Host screen update with its
+# arrival time, for replay by benchmark_server.py; None disables recording
+RECORD_TRAFFIC = None
+# Seconds of link samples kept in memory for /samples, at up to 2000 Hz
+SAMPLE_BUFFER_SECONDS = 60
+# Sample rate of the simulated tracker used in dummy mode: 500, 1000 or 2000
+SIMULATED_SAMPLE_RATE = 1000
+# Online event detection for /ws/events: 'ivt' (velocity) or 'idt' (dispersion)
+EVENT_DETECTOR = 'ivt'
+# Pixels per degree of visual angle at the participant's viewing distance
+PIXELS_PER_DEGREE = 35.0
+# Folder the backdrop command reads images from, the memory its cache of
+# converted images may use, and the memory for the few most recent images
+# kept as pylink rows, about 150 MB each at 1920x1080
+BACKDROP_FOLDER = 'images'
+BACKDROP_CACHE_MB = 256
+BACKDROP_ROWS_MB = 400
+# receiveEDF downloads into a session folder under this folder
+DATA_FOLDER = 'results'
+# ms of gaze in one interest area before a dwell event on /ws/aoi
+AOI_DWELL_TIME = 500.0
+# Seconds between Host screen redraws while recording, see host_screen.py
+HOST_SCREEN_INTERVAL = 0.1
+# How sendMessage traffic is handled, (pattern, policy) with the first
+# match winning, None for the defaults; see message_policy.py
+MESSAGE_RULES = None
+# Messages held for coalescing or batching at most; more are refused (HTTP 429)
+MESSAGE_HOLD_LIMIT = 1000
+# Every command is logged to a JSON-lines file in a folder per station
+# under this folder, a new file for each openEDF; see audit_log.py
+AUDIT_LOG_FOLDER = 'logs'
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes, allowing all origins by default
+sock = Sock(app)  # WebSocket routes share the Flask app and port
 
 EYE_HOST_IP = '100.1.1.1'
+# Host PC address of every station this server drives, by station id. The
+# first is the default for requests that do not name a station
+STATIONS = {'default': EYE_HOST_IP}
 
-if dummy_mode:
-    print("Running in dummy mode, EyeLink will not be connected")
-    el_tracker = None
-else:
+def connect_tracker(station_id, host):
+    if dummy_mode:
+        print(f"Running station '{station_id}' in dummy mode, using a simulated EyeLink")
+        return SimulatedEyeLink(sample_rate=SIMULATED_SAMPLE_RATE,
+                                log_folder=os.path.join('simulated_host', station_id))
     try:
         # Uncomment when not in dummy mode
-        # el_tracker = pylink.EyeLink(EYE_HOST_IP)
+        # return pylink.EyeLink(host)
         pass
     except RuntimeError as error:
         print('ERROR:', error)
+    return None
 
-def parse_command(command):
-    match = re.match(r'(\w+)\((.*)\)', command)
-    if match:
-        command_name = match.group(1)
-        argument = match.group(2).strip('\"')
-        return command_name, argument
-    else:
-        return command, None
+# Each station has its own tracker worker, clock model, sample pipeline,
+# jobs and audit log (a folder per station), see stations.py
+stations = StationRegistry()
+for station_id, host in STATIONS.items():
+    stations.add(Station(station_id, connect_tracker(station_id, host), buffer_seconds=SAMPLE_BUFFER_SECONDS,
+                         detector=EVENT_DETECTOR, pixels_per_degree=PIXELS_PER_DEGREE,
+                         dwell_time=AOI_DWELL_TIME, host_screen_interval=HOST_SCREEN_INTERVAL,
+                         message_rules=MESSAGE_RULES, message_limit=MESSAGE_HOLD_LIMIT,
+                         audit_folder=os.path.join(AUDIT_LOG_FOLDER, station_id)))
+atexit.register(stations.stop)
+
+BACKDROPS.folder = BACKDROP_FOLDER
+BACKDROPS.max_bytes = BACKDROP_CACHE_MB << 20
+BACKDROPS.rows_max_bytes = BACKDROP_ROWS_MB << 20
+EDF_DOWNLOADS.folder = DATA_FOLDER
+
+traffic_lock = threading.Lock()
+traffic_file = open(RECORD_TRAFFIC, 'a', buffering=1) if RECORD_TRAFFIC else None
+
+# Browser clock estimates, keyed by the "client_id" the browser sends
+clock_syncs = {}
+clock_syncs_lock = threading.Lock()
+
+# seq numbers of the messages received through /beacon, by client_id
+beacon_sequences = SequenceFilter()
+beacon_stats = {'batches': 0, 'messages': 0, 'duplicates': 0, 'failed': 0}
+beacon_stats_lock = threading.Lock()
+
+class UnknownStation(Exception):
+    pass
+
+def get_station(station_id=None):
+    """The station a request names with "station" in its payload (station_id)
+    or ?station= in its URL, else the default one."""
+    station_id = station_id or request.args.get('station')
+    station = stations.get(station_id)
+    if station is None:
+        raise UnknownStation(f'Unknown station: {station_id}')
+    return station
+
+@app.errorhandler(UnknownStation)
+def unknown_station(error):
+    return jsonify({'status': 'error', 'message': str(error)}), 404
+
+def record_traffic(route, data):
+    """Append one command or Host screen update to the RECORD_TRAFFIC file.
+
+    Commands are recorded one by one in run_request, whichever route they
+    came through, so that any of them can be replayed over /send_command
+    or /ws.
+    """
+    if traffic_file is None:
+        return
+    line = json.dumps({'time': server_clock_ms(), 'route': route, 'data': data})
+    with traffic_lock:
+        traffic_file.write(line + '\n')
+
+def client_number(value, name):
+    """A time sent by a client as a float; ValueError if it is not a finite number."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number, got {value!r}') from None
+    if not math.isfinite(number):
+        raise ValueError(f'{name} must be a finite number, got {value!r}')
+    return number
+
+def positive_arg(name, default, kind=int):
+    """A query parameter that must be a positive number; ValueError if not."""
+    value = request.args.get(name, default)
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number, got {value!r}') from None
+    if not number > 0 or not math.isfinite(number):
+        raise ValueError(f'{name} must be a positive number, got {value!r}')
+    return number
+
+def client_event_time(data):
+    """Server-clock time of the client event stamped in a request payload.
+
+    Returns None when the payload has no "client_time" or the client's clock
+    has not been synchronized through /sync yet. Raises ValueError for a
+    client_time that is not a number.
+    """
+    client_time = data.get('client_time')
+    if client_time is None:
+        return None
+    client_time = client_number(client_time, 'client_time')
+    clock = clock_syncs.get(data.get('client_id', 'default'))
+    if clock is None or not clock.synchronized:
+        print(f"Clock of client '{data.get('client_id', 'default')}' not synchronized, message not back-dated")
+        return None
+    return clock.to_server_time(client_time)
+
+def run_request(data, station_id=None):
+    """Parse and run one command payload.
+
+    data is {"command": ..., "client_time": ..., "client_id": ..., "station": ...};
+    client_time and client_id are optional and only used to back-date
+    sendMessage. The command is a legacy string or a structured
+    {"name": ..., "args": [...]} object, which may also be given as the
+    payload itself. It runs on the station named in data, else station_id
+    or the request URL, else the default station.
+    """
+    record_traffic(request.path, data)
+    command = data.get('command')
+    if not command and 'name' in data:
+        command = data
+    if not command:
+        return {'status': 'error', 'message': 'No command provided'}, 400
+    try:
+        station = get_station(data.get('station') or station_id)
+    except UnknownStation as e:
+        return {'status': 'error', 'message': str(e)}, 404
+
+    try:
+        event_time = client_event_time(data)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    result, status = station.execute(command, event_time)
+    if data.get('client_time') is not None and 'offset' not in result and status == 200:
+        result['warning'] = 'Message not back-dated, clock not synchronized'
+    return result, status
+
+def handle_sync(data, receive_time):
+    """One NTP-style exchange, see clock_sync.py.
+
+    data carries the client's send time "client_time" and, from the second
+    exchange on, the completed previous exchange as "previous": {t0, t1, t2, t3}.
+    Raises ValueError for a malformed exchange, before it is used.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    previous = data.get('previous')
+    if previous:
+        if not isinstance(previous, dict):
+            raise ValueError('"previous" must be an object {t0, t1, t2, t3}')
+        times = [client_number(previous.get(key), f'previous.{key}') for key in ('t0', 't1', 't2', 't3')]
+
+    client_id = data.get('client_id', 'default')
+    with clock_syncs_lock:
+        clock = clock_syncs.setdefault(client_id, ClockSync())
+    if previous:
+        clock.add_exchange(*times)
+
+    return {'status': 'success', 'client_time': data.get('client_time'), 'server_receive': receive_time,
+            **clock.state(), 'server_send': server_clock_ms()}
+
+def preflight_response():
+    response = jsonify({'status': 'success'})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    return response, 200
 
 @app.route('/send_command', methods=['POST', 'OPTIONS'])
 def send_command():
     if request.method == 'OPTIONS':
-        response = jsonify({'status': 'success'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
-        return response, 200
+        return preflight_response()
+
+    data = request.json or {}
+    result, status = run_request(data)
+    return jsonify(result), status
+
+@app.route('/clock', methods=['GET'])
+def clock():
+    """Current server-to-tracker clock model, for aligning logs offline."""
+    tracker_clock = get_station().clock
+    now = server_clock_ms()
+    tracker_time, uncertainty = tracker_clock.estimate(now)
+    return jsonify({'status': 'success', 'server_time': now, 'tracker_time': tracker_time,
+                    'tracker_time_uncertainty': uncertainty, 'model': tracker_clock.state()}), 200
+
+@app.route('/samples', methods=['GET'])
+def samples():
+    """Recent link samples from the server's ring buffer.
+
+    Returns the samples with since < time <= until (tracker ms; either
+    bound may be left out) as a binary frame, see gaze_frames.py, or as
+    JSON with format=json. Polling clients pass the last time they saw as
+    since. GET /samples?stats=1 describes the buffer instead.
+    """
+    sample_buffer = get_station().sample_buffer
+    if request.args.get('stats'):
+        return jsonify({'status': 'success', **sample_buffer.state()}), 200
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+        until = float(request.args['until']) if 'until' in request.args else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'since and until must be numbers'}), 400
+
+    if request.args.get('format') == 'json':
+        return Response(sample_buffer.encode_range(since, until, encode_json), mimetype='application/json')
+    return Response(sample_buffer.encode_range(since, until, encode), mimetype='application/octet-stream')
+
+@app.route('/interest_areas', methods=['GET'])
+def get_interest_areas():
+    return jsonify(get_station().interest_areas.state())
+
+@app.route('/host_screen', methods=['GET', 'POST', 'OPTIONS'])
+def host_screen():
+    """The Host screen scene (GET), or edit it and redraw what changed (POST).
+
+    POST takes {"background": 0, "backdrop": {"image": ..., "width": ...,
+    "height": ...} or null, "objects": {"fixation": {"type": "cross", "x":
+    960, "y": 540, "color": 15}, "old": null, ...}, "clear": false,
+    "redraw": false}, every field optional; see host_screen.py.
+    """
+    if request.method == 'OPTIONS':
+        return preflight_response()
+    if request.method == 'GET':
+        return jsonify(get_station().host_screen.state())
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+    record_traffic('/host_screen', dict(data, station=data.get('station') or request.args.get('station')))
+    result, status = get_station(data.pop('station', None)).update_host_screen(data)
+    return jsonify(result), status
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': [job.state() for job in get_station().jobs.jobs()]})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """State of a background job. ?wait=<s> waits up to s seconds for it to finish."""
+    job = get_station().jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Unknown job: {job_id}'}), 404
+    wait = request.args.get('wait', type=float)
+    if wait:
+        job.wait(min(wait, 60.0))
+    return jsonify(job.state())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job; GET /jobs/<id> shows when it has stopped."""
+    jobs = get_station().jobs
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Unknown job: {job_id}'}), 404
+    try:
+        cancelled = jobs.cancel(job)
+    except CannotCancel as e:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} cannot be cancelled: {e}',
+                        'job': job.state()}), 409
+    if not cancelled:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} has already finished', 'job': job.state()}), 409
+    return jsonify({'status': 'success', 'message': f'Job {job_id} cancelled', 'job': job.state()}), 202
+
+@app.route('/jobs/<job_id>/file', methods=['GET'])
+def get_job_file(job_id):
+    """Download the file a finished job produced, e.g. a received EDF."""
+    job = get_station().jobs.get(job_id)
+    if job is None or job.status != 'done' or not isinstance(job.result, dict) or 'path' not in job.result:
+        return jsonify({'status': 'error', 'message': f'No file for job {job_id}'}), 404
+    path = job.result['path']
+
+    def chunks():
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                yield chunk
+
+    return Response(chunks(), mimetype='application/octet-stream',
+                    headers={'Content-Length': str(os.path.getsize(path)),
+                             'Content-Disposition': f'attachment; filename="{os.path.basename(path)}"'})
+
+@app.route('/stations', methods=['GET'])
+def list_stations():
+    """Every station with its queue, jobs, sample buffer, clock and command metrics."""
+    return jsonify({'default': stations.default, 'stations': [station.state() for station in stations.stations()]})
+
+@app.route('/stations/<station_id>', methods=['GET'])
+def get_station_state(station_id):
+    return jsonify(get_station(station_id).state())
+
+@app.route('/sync', methods=['POST'])
+def sync():
+    """Clock synchronization exchange.
+
+    The body is parsed as JSON whatever its content type, so browsers can
+    send it as text/plain and avoid a CORS preflight skewing the round trip.
+    """
+    receive_time = server_clock_ms()
+    try:
+        return jsonify(handle_sync(request.get_json(force=True), receive_time)), 200
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/send_commands', methods=['POST', 'OPTIONS'])
+def send_commands():
+    """Run an ordered list of commands in a single round trip.
+
+    Expects {"commands": ["setOfflineMode()", ...], "on_error": "stop"|"continue"}.
+    A command may also be an object as accepted by /send_command, e.g. to
+    pass "client_time". With "stop" (the default) the remaining commands are
+    reported as skipped after the first failure.
+    """
+    if request.method == 'OPTIONS':
+        return preflight_response()
+
+    data = request.json or {}
+    commands = data.get('commands')
+    on_error = data.get('on_error', 'stop')
+
+    if not isinstance(commands, list) or not commands:
+        return jsonify({'status': 'error', 'message': 'No commands provided'}), 400
+    if on_error not in ('stop', 'continue'):
+        return jsonify({'status': 'error', 'message': f'Unknown on_error policy: {on_error}'}), 400
 
-    data = request.json
-    command = data.get('command')
     received_time = time.time()
+    results = []
+    failed = False
+    for command in commands:
+        if failed and on_error == 'stop':
+            results.append({'command': command, 'status': 'skipped'})
+            continue
+        result, _ = run_request(command if isinstance(command, dict) else {'command': command},
+                                data.get('station'))
+        result['command'] = command
+        results.append(result)
+        if result['status'] != 'success':
+            failed = True
+
+    return jsonify({'status': 'error' if failed else 'success', 'results': results,
+                    'latency': time.time() - received_time}), 200
+
+@app.route('/beacon', methods=['GET', 'POST'])
+def beacon():
+    """Messages sent without a CORS preflight, e.g. by navigator.sendBeacon.
+
+    POST a text/plain body of "<seq> <client_time> <text>" lines with
+    ?client_id=...&station=...; see beacon.py. Answers 204 with no body,
+    503 with the seq numbers of the messages to send again, or 400 for a
+    malformed batch, none of which is sent. GET returns how many batches
+    and messages were received, skipped as duplicates and failed.
+    """
+    if request.method == 'GET':
+        with beacon_stats_lock:
+            return jsonify({'status': 'success', **beacon_stats})
+    get_station()  # 404 for an unknown station before anything is sent
+    client_id = request.args.get('client_id', 'default')
+    if request.mimetype == 'application/x-www-form-urlencoded':
+        body = request.form.get('lines', '')
+    else:
+        body = request.get_data(as_text=True)
+    try:
+        lines = list(parse_lines(body))
+    except BeaconError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    duplicates = failed = 0
+    retry = []
+    for seq, client_time, text in lines:
+        if not beacon_sequences.first_time(client_id, seq):
+            duplicates += 1
+            continue
+        result, status = run_request({'command': {'name': 'sendMessage', 'args': [text]},
+                                      'client_time': client_time, 'client_id': client_id})
+        if result['status'] != 'success':
+            failed += 1
+            if status in (409, 429) or status >= 500:  # may succeed when sent again
+                beacon_sequences.forget(client_id, seq)
+                retry.append(seq)
+    with beacon_stats_lock:
+        beacon_stats['batches'] += 1
+        beacon_stats['messages'] += len(lines) - duplicates
+        beacon_stats['duplicates'] += duplicates
+        beacon_stats['failed'] += failed
+    if retry:
+        return jsonify({'status': 'error', 'message': f'{len(retry)} messages not sent, send them again',
+                        'failed': retry}), 503
+    return '', 204
+
+@sock.route('/ws')
+def command_socket(ws):
+    """Persistent command channel, an alternative to POST /send_command.
+
+    Each text frame is a JSON object {"id": <any>, "command": "sendMessage(...)"}
+    using the same command vocabulary as /send_command. Clients may pipeline
+    several requests without waiting; every request is acknowledged with a
+    frame carrying the same "id" and the usual status/message/latency fields.
+    Acks are sent in the order the requests were received. A frame with a
+    "sync" object instead of a command is a clock synchronization exchange
+    (see /sync). Commands run on the station of the socket's ?station=
+    unless a frame names another.
+    """
+    while True:
+        frame = ws.receive()
+        if frame is None:
+            break
+        receive_time = server_clock_ms()
 
-    if command:
-        command_name, argument = parse_command(command)
+        try:
+            data = json.loads(frame)
+        except ValueError:
+            ws.send(json.dumps({'id': None, 'status': 'error', 'message': 'Invalid JSON'}))
+            continue
 
-        if dummy_mode:
-            print(f"Simulated sending command to EyeLink: {command_name} with argument '{argument}'")
-            return jsonify({'status': 'success', 'message': f'Command "{command_name}" with argument "{argument}" simulated as sent to EyeLink'}), 200
+        if not isinstance(data, dict):
+            data = {}
+        if isinstance(data.get('sync'), dict):
+            try:
+                result = handle_sync(data['sync'], receive_time)
+            except ValueError as e:
+                result = {'status': 'error', 'message': str(e)}
         else:
+            result, _ = run_request(data)
+        result['id'] = data.get('id')
+        ws.send(json.dumps(result))
+
+@sock.route('/ws/samples')
+def sample_socket(ws):
+    """Push live link samples to the browser.
+
+    Query parameters: decimate=all (default) sends every sample, in blocks
+    as they arrive; decimate=frame sends only the newest sample once per
+    display frame, at fps (default 60). buffer bounds the samples held for
+    a slow client (default 2000); older ones are dropped and counted.
+    format=binary (default) sends binary frames as described in
+    gaze_frames.py; format=json sends the same blocks as JSON for debugging.
+    """
+    decimate = request.args.get('decimate', 'all')
+    if decimate not in ('all', 'frame'):
+        ws.send(json.dumps({'status': 'error', 'message': f'Unknown decimation: {decimate}'}))
+        return
+    encoder = encode_json if request.args.get('format') == 'json' else encode
+    try:
+        frame_interval = 1.0 / positive_arg('fps', 60, float)
+        maxlen = 1 if decimate == 'frame' else positive_arg('buffer', 2000)
+    except ValueError as e:
+        ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+        return
+
+    try:
+        gaze_streamer = get_station().gaze_streamer
+    except UnknownStation as e:
+        ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+        return
+
+    subscription = gaze_streamer.subscribe(maxlen)
+    try:
+        while ws.connected:
+            if decimate == 'frame':
+                time.sleep(frame_interval)
+                samples = subscription.drain(timeout=0)
+            else:
+                samples = subscription.drain(timeout=1.0)
+            if len(samples):
+                # in frame mode skipping samples is the point, not a loss
+                dropped = subscription.take_dropped() if decimate == 'all' else 0
+                ws.send(encoder(samples, dropped))
+    finally:
+        gaze_streamer.unsubscribe(subscription)
+
+@sock.route('/ws/events')
+def event_socket(ws):
+    """Push fixations, saccades and blinks as they are detected.
+
+    Each frame holds EVENT_DTYPE rows (see gaze_frames.py and
+    event_detection.py). format=binary (default) or json, as for
+    /ws/samples. buffer bounds the events held for a slow client
+    (default 1000).
+    """
+    encoder = encode_json if request.args.get('format') == 'json' else encode
+    try:
+        maxlen = positive_arg('buffer', 1000)
+        event_stream = get_station().event_stream
+    except (ValueError, UnknownStation) as e:
+        ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+        return
+    subscription = event_stream.subscribe(maxlen)
+    try:
+        while ws.connected:
+            events = subscription.drain(timeout=1.0)
+            if len(events):
+                ws.send(encoder(events, subscription.take_dropped()))
+    finally:
+        event_stream.unsubscribe(subscription)
+
+@sock.route('/ws/jobs')
+def job_socket(ws):
+    """Push the state of a job, as from GET /jobs/<id>, whenever it changes."""
+    try:
+        jobs = get_station().jobs
+    except UnknownStation as e:
+        ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+        return
+    subscription = jobs.subscribe()
+    try:
+        while ws.connected:
             try:
-                # Handle opening an EDF file
-                if command_name == 'openEDF' and argument:
-                    edf_file = argument + ".EDF"
-                    try:
-                        el_tracker.openDataFile(edf_file)
-                    except RuntimeError as err:
-                        print(f'Error opening EDF file: {err}')
-                        # Close the EyeLink connection if it exists
-                        if el_tracker.isConnected():
-                            el_tracker.close()
-                                                
-                        sys.exit()  # Exit the program
-                elif command_name == 'doTrackerSetup':
-                    el_tracker.doTrackerSetup()  
-                elif command_name == 'startRecording':
-                    el_tracker.startRecording(1, 1, 1, 1)  
-                elif command_name == 'stopRecording':
-                    el_tracker.stopRecording()  
-                elif command_name == 'sendMessage' and argument:
-                    el_tracker.sendMessage(argument)  
-                elif command_name == 'sendCommand' and argument:
-                    el_tracker.sendCommand(argument)  
-                else:
-                    return jsonify({'status': 'error', 'message': f'Unknown command: {command_name}'}), 400
-
-                send_time = time.time()
-                print(f"Command '{command_name}' executed with argument '{argument}'")
-                return jsonify({'status': 'success', 'message': f'Command "{command_name}" executed with argument "{argument}"', 
-                                'latency': send_time - received_time}), 200
-            except Exception as e:
-                print(f"Error executing command {command_name} with argument '{argument}': {str(e)}")
-                return jsonify({'status': 'error', 'message': str(e)}), 500
-    else:
-        return jsonify({'status': 'error', 'message': 'No command provided'}), 400
+                ws.send(json.dumps({'kind': 'job', 'job': subscription.get(timeout=1.0)}))
+            except queue.Empty:
+                continue
+    finally:
+        jobs.unsubscribe(subscription)
+
+@sock.route('/ws/aoi')
+def aoi_socket(ws):
+    """Push interest area enter, exit and dwell events as JSON lists."""
+    try:
+        aoi_monitor = get_station().aoi_monitor
+    except UnknownStation as e:
+        ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+        return
+    subscription = aoi_monitor.subscribe()
+    try:
+        while ws.connected:
+            try:
+                events = [subscription.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            while not subscription.empty():
+                events.append(subscription.get_nowait())
+            ws.send(json.dumps({'kind': 'aoi', 'events': events}))
+    finally:
+        aoi_monitor.unsubscribe(subscription)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    # Handlers only wait on the tracker worker, so serving requests from
+    # several threads at once is safe
+    app.run(host='0.0.0.0', port=5000, threaded=True)
 
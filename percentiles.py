@@ -0,0 +1,17 @@
+"""Latency percentiles, as reported by the stations and the benchmarks."""
+
+
+def percentile(sorted_values, p):
+    """The p-th percentile (nearest rank) of values sorted ascending, NaN if there are none."""
+    if not sorted_values:
+        return float('nan')
+    rank = -(-p * len(sorted_values) // 100)  # ceil without floats
+    return sorted_values[min(len(sorted_values), max(1, int(rank))) - 1]
+
+
+def summary(values):
+    """{"p50", "p95", "max"} of values, None if there are none."""
+    if not values:
+        return None
+    values = sorted(values)
+    return {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'max': values[-1]}
@@ -0,0 +1,15 @@
+"""The pylink constants the server uses, with pylink's values.
+
+pylink is not importable in dummy mode, so the modules that need these take
+them from here rather than from pylink.
+"""
+
+BX_MAXCONTRAST = 4  # bitmapBackdrop option: stretch the image to the Host's contrast
+
+# trial results for TRIAL_RESULT; isRecording() returns TRIAL_OK while recording
+TRIAL_OK = 0
+TRIAL_ERROR = -1
+
+ESC_KEY = 27
+SAMPLE_TYPE = 200  # getNextData() for a sample
+MISSING_DATA = -32768  # gaze of an eye that is not tracked, or in a blink
@@ -0,0 +1,78 @@
+"""The last N seconds of link samples, in one preallocated array.
+
+SampleRingBuffer stores SAMPLE_DTYPE rows (see gaze_frames.py) in a numpy
+array allocated once, so memory stays flat however long the session runs.
+Every row is written twice, at i and i + capacity. Any run of up to
+capacity consecutive samples is then one contiguous region, and a time
+range query is a plain slice of the array: no copying and no per-sample
+Python objects. Tracker timestamps only increase, so ranges are found with
+a binary search on the time column.
+"""
+
+import threading
+
+import numpy as np
+
+from gaze_frames import SAMPLE_DTYPE
+
+
+class SampleRingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=SAMPLE_DTYPE)
+        self._written = 0  # samples written since the start, oldest ones overwritten
+        self.lock = threading.Lock()
+
+    def write(self, block):
+        cap = self.capacity
+        with self.lock:
+            # only the newest capacity samples of a large block survive
+            skipped = max(0, len(block) - cap)
+            block = block[skipped:]
+            self._written += skipped
+
+            n = len(block)
+            pos = self._written % cap
+            first = min(n, cap - pos)
+            self._data[pos:pos + first] = block[:first]
+            self._data[pos + cap:pos + cap + first] = block[:first]
+            rest = n - first
+            if rest:
+                self._data[:rest] = block[first:]
+                self._data[cap:cap + rest] = block[first:]
+            self._written += n
+
+    def _window(self):
+        """Contiguous view of every stored sample, oldest first. Hold the lock."""
+        count = min(self._written, self.capacity)
+        start = (self._written - count) % self.capacity
+        return self._data[start:start + count]
+
+    def view(self, since=None, until=None):
+        """Samples with since < time <= until, as a view into the buffer.
+
+        The view is only stable while self.lock is held; writers reuse the
+        memory once the buffer wraps around. Use query() for a copy.
+        """
+        window = self._window()
+        times = window['time']
+        lo = 0 if since is None else int(np.searchsorted(times, since, side='right'))
+        hi = len(window) if until is None else int(np.searchsorted(times, until, side='right'))
+        return window[lo:max(lo, hi)]
+
+    def query(self, since=None, until=None):
+        """A copy of the samples with since < time <= until."""
+        with self.lock:
+            return self.view(since, until).copy()
+
+    def encode_range(self, since, until, encoder):
+        """Encode a time range straight from the buffer memory."""
+        with self.lock:
+            return encoder(self.view(since, until))
+
+    def state(self):
+        with self.lock:
+            window = self._window()
+            return {'capacity': self.capacity, 'count': len(window), 'written': self._written,
+                    'oldest': float(window['time'][0]) if len(window) else None,
+                    'newest': float(window['time'][-1]) if len(window) else None}
@@ -0,0 +1,443 @@
+"""A stand-in for pylink.EyeLink that needs no lab hardware.
+
+SimulatedEyeLink has the tracker methods the server and the example script
+use. Each call sleeps for a latency drawn from a per-method distribution, so
+latency and throughput can be measured on any machine. While recording it
+produces synthetic binocular gaze (fixations, saccades and blinks) at the
+configured sample rate; samples are available over the "link" through
+getNewestSample()/getNextData()/getFloatData() as with pylink.
+
+The data file is written locally in the text format of an EDF-to-ASC export
+(MSG lines, samples, SFIX/EFIX, SSACC/ESACC, SBLINK/EBLINK), and
+receiveDataFile() copies it to the requested destination.
+"""
+
+import collections
+import math
+import os
+import random
+import threading
+import time
+
+from pylink_constants import ESC_KEY, MISSING_DATA, SAMPLE_TYPE, TRIAL_ERROR, TRIAL_OK
+
+# Latency of each call as (median ms, lognormal sigma); a latencies entry
+# passed to SimulatedEyeLink may also be a callable returning ms
+DEFAULT_LATENCIES = {
+    'openDataFile': (10.0, 0.3),
+    'closeDataFile': (20.0, 0.3),
+    'doTrackerSetup': (2000.0, 0.2),
+    'doDriftCorrect': (800.0, 0.3),
+    'setOfflineMode': (5.0, 0.3),
+    'startRecording': (40.0, 0.2),
+    'stopRecording': (20.0, 0.2),
+    'sendMessage': (0.2, 0.4),
+    'sendCommand': (1.0, 0.4),
+    'imageBackdrop': (150.0, 0.3),
+    'bitmapBackdrop': (400.0, 0.3),
+    'trackerTime': (0.05, 0.3),  # each way
+}
+
+# receiveDataFile copies at this rate, in chunks, so progress is observable
+TRANSFER_BYTES_PER_SECOND = 20e6
+TRANSFER_CHUNK_SIZE = 1 << 20
+
+
+class SimulatedSampleData:
+    def __init__(self, gx, gy, pupil):
+        self._gaze = (gx, gy)
+        self._pupil = pupil
+
+    def getGaze(self):
+        return self._gaze
+
+    def getPupilSize(self):
+        return self._pupil
+
+
+class SimulatedSample:
+    """Mimics pylink.Sample for one row (time, lx, ly, lpa, rx, ry, rpa)."""
+
+    def __init__(self, row, eyes):
+        self._row = row
+        self._eyes = eyes
+
+    def getTime(self):
+        return self._row[0]
+
+    def getType(self):
+        return SAMPLE_TYPE
+
+    def isLeftSample(self):
+        return self._eyes in ('left', 'both')
+
+    def isRightSample(self):
+        return self._eyes in ('right', 'both')
+
+    def isBinocular(self):
+        return self._eyes == 'both'
+
+    def getLeftEye(self):
+        return SimulatedSampleData(*self._row[1:4]) if self.isLeftSample() else None
+
+    def getRightEye(self):
+        return SimulatedSampleData(*self._row[4:7]) if self.isRightSample() else None
+
+
+class GazeModel:
+    """Random scanpath: fixations joined by saccades, with occasional blinks.
+
+    step(t) returns (x, y, pupil, phase) for tracker time t in ms, where
+    phase is 'fixation', 'saccade' or 'blink'. Calls must be in time order.
+    """
+
+    def __init__(self, width=1920, height=1080, seed=None):
+        self.width = width
+        self.height = height
+        self.random = random.Random(seed)
+        self.x, self.y = width / 2.0, height / 2.0
+        self.phase = 'fixation'
+        self.phase_end = None
+        self.saccade = None  # (start_time, duration, x0, y0, x1, y1)
+        self.pupil = 900.0
+
+    def _next_phase(self, t):
+        r = self.random
+        if self.phase == 'fixation':
+            if r.random() < 0.05:
+                self.phase = 'blink'
+                self.phase_end = t + r.uniform(80, 150)
+                return
+            x1 = min(max(self.x + r.gauss(0, self.width / 5), 0), self.width - 1)
+            y1 = min(max(self.y + r.gauss(0, self.height / 5), 0), self.height - 1)
+            amplitude = math.hypot(x1 - self.x, y1 - self.y)
+            duration = 15.0 + amplitude * 0.06
+            self.saccade = (t, duration, self.x, self.y, x1, y1)
+            self.phase = 'saccade'
+            self.phase_end = t + duration
+        else:
+            if self.phase == 'saccade':
+                self.x, self.y = self.saccade[4], self.saccade[5]
+            self.phase = 'fixation'
+            self.phase_end = t + max(80.0, r.gauss(250, 80))
+
+    def step(self, t):
+        if self.phase_end is None:
+            self.phase_end = t + max(80.0, self.random.gauss(250, 80))
+        while t >= self.phase_end:
+            self._next_phase(self.phase_end)
+
+        self.pupil = min(max(self.pupil + self.random.gauss(0, 2), 600), 1400)
+        if self.phase == 'blink':
+            return MISSING_DATA, MISSING_DATA, 0.0, 'blink'
+        if self.phase == 'saccade':
+            start, duration, x0, y0, x1, y1 = self.saccade
+            p = 0.5 - 0.5 * math.cos(math.pi * (t - start) / duration)
+            return x0 + (x1 - x0) * p, y0 + (y1 - y0) * p, self.pupil, 'saccade'
+        return (self.x + self.random.gauss(0, 0.6), self.y + self.random.gauss(0, 0.6),
+                self.pupil, 'fixation')
+
+
+class SimulatedEyeLink:
+    def __init__(self, sample_rate=1000, eyes='both', latencies=None, log_folder='simulated_host',
+                 link_buffer_size=20000, seed=None):
+        self.sample_rate = sample_rate
+        self.eyes = eyes
+        self.latencies = dict(DEFAULT_LATENCIES)
+        self.latencies.update(latencies or {})
+        self.log_folder = log_folder
+        self.random = random.Random(seed)
+        self.gaze = GazeModel(seed=seed)
+
+        self._lock = threading.RLock()
+        self._start = time.perf_counter()
+        self._connected = True
+        self._recording = False
+        self._next_sample_time = None
+        self._phase = None
+        self._phase_start = None
+        self._phase_samples = []
+        self._link = collections.deque(maxlen=link_buffer_size)
+        self._newest = None
+        self._data_file = None
+        self._pending = None  # sample returned by getNextData, for getFloatData
+        self._exit_calibration = threading.Event()
+        # Called every 10 ms on the calling thread while doTrackerSetup or
+        # doDriftCorrect runs, as pylink calls the custom display's
+        # get_input_key()
+        self.idle_callback = None
+
+    # timing
+
+    def _delay(self, method, interrupt=None):
+        """Sleep for the latency of method. Returns True if interrupt cut it short."""
+        latency = self.latencies.get(method, (0.0, 0.0))
+        if callable(latency):
+            ms = latency()
+        else:
+            median, sigma = latency
+            ms = median * math.exp(self.random.gauss(0, sigma))
+        if interrupt is not None:
+            deadline = time.monotonic() + max(ms, 0.0) / 1000.0
+            while True:
+                if interrupt.wait(max(0.0, min(deadline - time.monotonic(), 0.01))):
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                if self.idle_callback is not None:
+                    self.idle_callback()
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+        return False
+
+    def _now(self):
+        return (time.perf_counter() - self._start) * 1000.0
+
+    def trackerTimeUsec(self):
+        # the link round trip is split around the clock read, like a real query
+        self._delay('trackerTime')
+        now = self._now() * 1000.0
+        self._delay('trackerTime')
+        return now
+
+    def trackerTime(self):
+        return int(self.trackerTimeUsec() / 1000)
+
+    # data file
+
+    def _write(self, line):
+        if self._data_file is not None:
+            self._data_file.write(line + '\n')
+
+    def openDataFile(self, name):
+        self._delay('openDataFile')
+        with self._lock:
+            if not os.path.exists(self.log_folder):
+                os.makedirs(self.log_folder)
+            if self._data_file is not None:
+                self._data_file.close()
+            self._data_file = open(os.path.join(self.log_folder, name), 'w', buffering=1 << 16)
+            self._write(f'** CONVERTED FROM {name} using simulated_tracker.py')
+            self._write(f'** DATE: {time.ctime()}')
+            self._write('** TYPE: EDF_FILE BINARY EVENT SAMPLE TAGGED')
+
+    def closeDataFile(self):
+        self._delay('closeDataFile')
+        with self._lock:
+            if self._recording:
+                self._advance(self._now())
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+
+    def receiveDataFile(self, src, dest):
+        """Copy the local data file to dest at TRANSFER_BYTES_PER_SECOND."""
+        path = os.path.join(self.log_folder, src)
+        if not os.path.exists(path):
+            raise RuntimeError(f'File {src} not found on the simulated Host PC')
+        size = os.path.getsize(path)
+        with open(path, 'rb') as source, open(dest, 'wb') as target:
+            while True:
+                chunk = source.read(TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+                target.flush()
+                time.sleep(len(chunk) / TRANSFER_BYTES_PER_SECOND)
+        return size
+
+    # connection and modes
+
+    def isConnected(self):
+        return self._connected
+
+    def close(self):
+        with self._lock:
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+            self._connected = False
+
+    def getTrackerVersionString(self):
+        return 'EYELINK CL 5.15 (simulated)'
+
+    def breakPressed(self):
+        return False
+
+    # The operator's time on the setup and drift check screens; like pylink,
+    # exitCalibration() from another thread leaves them early
+
+    def doTrackerSetup(self):
+        try:
+            self._delay('doTrackerSetup', self._exit_calibration)
+        finally:
+            self._exit_calibration.clear()
+
+    def exitCalibration(self):
+        self._exit_calibration.set()
+
+    def doDriftCorrect(self, x, y, draw, allow_setup):
+        try:
+            return ESC_KEY if self._delay('doDriftCorrect', self._exit_calibration) else 0
+        finally:
+            self._exit_calibration.clear()
+
+    def setOfflineMode(self):
+        self._delay('setOfflineMode')
+        with self._lock:
+            if self._recording:
+                self._stop()
+
+    def sendCommand(self, command):
+        self._delay('sendCommand')
+        parts = command.replace('=', ' ').split()
+        if len(parts) == 2 and parts[0] == 'sample_rate':
+            self.sample_rate = int(parts[1])
+        elif len(parts) == 5 and parts[0] == 'screen_pixel_coords':
+            self.gaze.width = float(parts[3]) + 1
+            self.gaze.height = float(parts[4]) + 1
+        return 0
+
+    def sendMessage(self, text):
+        self._delay('sendMessage')
+        with self._lock:
+            now = self._now()
+            if self._recording:
+                self._advance(now)
+            # a leading integer is a time offset, as on a real tracker
+            offset, _, rest = text.partition(' ')
+            if offset.lstrip('-').isdigit() and rest:
+                now -= int(offset)
+                text = rest
+            self._write(f'MSG\t{int(now)} {text}')
+        return 0
+
+    def imageBackdrop(self, *args):
+        self._delay('imageBackdrop')
+
+    def bitmapBackdrop(self, width, height, pixels, *args):
+        if len(pixels) != height or any(len(row) != width for row in pixels):
+            raise RuntimeError(f'bitmapBackdrop: pixels are not {width}x{height}')
+        self._delay('bitmapBackdrop')
+
+    # recording
+
+    def startRecording(self, file_samples, file_events, link_samples, link_events):
+        self._delay('startRecording')
+        with self._lock:
+            now = self._now()
+            interval = 1000.0 / self.sample_rate
+            self._next_sample_time = math.ceil(now / interval) * interval
+            self._recording = True
+            self._phase = None
+            eyes = {'left': 'LEFT', 'right': 'RIGHT', 'both': 'LEFT\tRIGHT'}[self.eyes]
+            self._write(f'START\t{int(now)} \t{eyes}\tSAMPLES\tEVENTS')
+            self._write(f'SAMPLES\tGAZE\t{eyes}\tRATE\t{self.sample_rate:.2f}\tTRACKING\tCR\tFILTER\t2')
+        return 0
+
+    def stopRecording(self):
+        self._delay('stopRecording')
+        with self._lock:
+            if self._recording:
+                self._stop()
+
+    def _stop(self):
+        now = self._now()
+        self._advance(now)
+        self._end_phase(now)
+        self._recording = False
+        self._write(f'END\t{int(now)} \tSAMPLES\tEVENTS\tRES\t 38.00\t 36.00')
+
+    def isRecording(self):
+        with self._lock:
+            return TRIAL_OK if self._recording else TRIAL_ERROR
+
+    def _eye_letters(self):
+        return {'left': 'L', 'right': 'R', 'both': 'LR'}[self.eyes]
+
+    def _end_phase(self, end):
+        """Write the end event of the current phase."""
+        if self._phase is None:
+            return
+        start = self._phase_start
+        samples = self._phase_samples or [(start, MISSING_DATA, MISSING_DATA, 0.0)]
+        duration = end - start
+        for eye in self._eye_letters():
+            dx = 3.0 if eye == 'R' else 0.0
+            if self._phase == 'fixation':
+                x = sum(s[1] for s in samples) / len(samples) + dx
+                y = sum(s[2] for s in samples) / len(samples)
+                pupil = sum(s[3] for s in samples) / len(samples)
+                self._write(f'EFIX {eye}   {self._ms(start)}\t{self._ms(end)}\t{self._ms(duration)}\t{x:.1f}\t{y:.1f}\t{pupil:.0f}')
+            elif self._phase == 'saccade':
+                first, last = samples[0], samples[-1]
+                amplitude = math.hypot(last[1] - first[1], last[2] - first[2]) / 35.0  # ~35 px/deg
+                peak = amplitude / max(duration, 1.0) * 1000.0 * 1.8
+                self._write(f'ESACC {eye}  {self._ms(start)}\t{self._ms(end)}\t{self._ms(duration)}\t{first[1] + dx:.1f}\t'
+                            f'{first[2]:.1f}\t{last[1] + dx:.1f}\t{last[2]:.1f}\t{amplitude:.2f}\t{peak:.0f}')
+            else:
+                self._write(f'EBLINK {eye} {self._ms(start)}\t{self._ms(end)}\t{self._ms(duration)}')
+
+    def _ms(self, t):
+        """A tracker time or duration as ASC files write it: whole ms, or to 0.1 ms at 2000 Hz."""
+        return f'{t:.1f}' if self.sample_rate > 1000 else f'{t:.0f}'
+
+    def _advance(self, now):
+        """Generate every sample due up to tracker time now (ms)."""
+        interval = 1000.0 / self.sample_rate
+        lines = []
+        t = self._next_sample_time
+        while t <= now:
+            x, y, pupil, phase = self.gaze.step(t)
+            if phase != self._phase:
+                if lines:
+                    self._write('\n'.join(lines))
+                    lines = []
+                self._end_phase(t)
+                start_tag = {'fixation': 'SFIX', 'saccade': 'SSACC', 'blink': 'SBLINK'}[phase]
+                for eye in self._eye_letters():
+                    self._write(f'{start_tag} {eye}   {self._ms(t)}')
+                self._phase, self._phase_start, self._phase_samples = phase, t, []
+            if phase != 'blink':
+                self._phase_samples.append((t, x, y, pupil))
+
+            if x == MISSING_DATA:
+                row = (t, x, y, pupil, x, y, pupil)
+                text = '   .\t   .\t    0.0'
+            else:
+                row = (t, x, y, pupil, x + 3.0, y, pupil)
+                text = f'{x:.1f}\t{y:.1f}\t{pupil:.1f}'
+            self._link.append(row)
+            self._newest = row
+            if self.eyes == 'both':
+                right = '   .\t   .\t    0.0' if x == MISSING_DATA else f'{x + 3.0:.1f}\t{y:.1f}\t{pupil:.1f}'
+                lines.append(f'{self._ms(t)}\t{text}\t{right}\t.....')
+            else:
+                lines.append(f'{self._ms(t)}\t{text}\t...')
+            t += interval
+        self._next_sample_time = t
+        if lines:
+            self._write('\n'.join(lines))
+
+    # link data
+
+    def getNewestSample(self):
+        with self._lock:
+            if not self._recording:
+                return None
+            self._advance(self._now())
+            return SimulatedSample(self._newest, self.eyes) if self._newest else None
+
+    def getNextData(self):
+        """Return SAMPLE_TYPE if a link sample is waiting, else 0."""
+        with self._lock:
+            if self._recording:
+                self._advance(self._now())
+            if not self._link:
+                self._pending = None
+                return 0
+            self._pending = self._link.popleft()
+            return SAMPLE_TYPE
+
+    def getFloatData(self):
+        return SimulatedSample(self._pending, self.eyes) if self._pending else None
@@ -0,0 +1,362 @@
+"""Several EyeLink stations driven by one server.
+
+A station is one tracker connection and everything that belongs to it: the
+worker thread that owns its pylink calls, its clock model, the sample
+pipeline (ring buffer, event detection, interest areas), message policies,
+background jobs, audit log and metrics. Stations share nothing but the backdrop cache, so
+calibration or an EDF transfer on one station only queues behind that
+station's own work and never delays another station's messages.
+
+Requests choose a station with "station" in the payload or ?station= in the
+URL; see my_python_server.py.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+from audit_log import AuditLog
+from clock_sync import server_clock_ms
+from commands import BACKDROPS, COMMANDS, MESSAGE_LISTENERS, RECORDING_LISTENERS, CommandError, lookup, parse_command
+from event_detection import EventStream, IDTDetector, IVTDetector
+from gaze_stream import GazeStreamer
+from host_screen import HostScreen
+from interest_areas import AOIMonitor, InterestAreaRegistry
+from jobs import JobRegistry, TooManyJobs
+from message_policy import MessagePolicy
+from percentiles import summary
+from sample_buffer import SampleRingBuffer
+from tracker_clock import TrackerClockModel, TrackerClockRefresher
+from tracker_worker import TrackerWorker
+
+DETECTORS = {'ivt': IVTDetector, 'idt': IDTDetector}
+
+
+class StationMetrics:
+    """Counts and latencies of the commands run on one station.
+
+    Latency is in ms, split into queue (request received to pylink call
+    started) and total (received to response ready), over the last window
+    commands of each name.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started = time.time()
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, status, received, dispatched, completed):
+        with self._lock:
+            entry = self._commands.get(name)
+            if entry is None:
+                entry = self._commands[name] = {
+                    'count': 0, 'errors': 0, 'queue': collections.deque(maxlen=self.window),
+                    'total': collections.deque(maxlen=self.window)}
+            entry['count'] += 1
+            if status != 'success':
+                entry['errors'] += 1
+            if dispatched is not None:
+                entry['queue'].append(dispatched - received)
+            entry['total'].append(completed - received)
+
+    def state(self):
+        with self._lock:
+            commands = {name: (entry['count'], entry['errors'], list(entry['queue']), list(entry['total']))
+                        for name, entry in self._commands.items()}
+        return {name: {'count': count, 'errors': errors, 'queue_ms': summary(queue), 'total_ms': summary(total)}
+                for name, (count, errors, queue, total) in commands.items()}
+
+
+class Station:
+    def __init__(self, id, tracker, buffer_seconds=60, detector='ivt', pixels_per_degree=35.0,
+                 dwell_time=500.0, host_screen_interval=0.1, message_rules=None, message_limit=1000,
+                 audit_folder=None):
+        self.id = id
+        self.tracker = tracker
+        self.worker = TrackerWorker(name=f'tracker-worker-{id}')
+        self.clock = TrackerClockModel()
+        self.clock_refresher = TrackerClockRefresher(self.clock, self.worker, tracker)
+
+        # One acquisition loop feeds the ring buffer, event detection and
+        # interest area monitoring
+        self.sample_buffer = SampleRingBuffer(buffer_seconds * 2000)
+        self.gaze_streamer = GazeStreamer(self.worker, tracker, buffer=self.sample_buffer)
+        self.event_stream = EventStream(DETECTORS[detector](pixels_per_degree=pixels_per_degree),
+                                        clock=lambda: self.clock.estimate(server_clock_ms())[0])
+        self.gaze_streamer.add_listener(self.event_stream)
+        self.interest_areas = InterestAreaRegistry()
+        self.aoi_monitor = AOIMonitor(self.interest_areas, dwell_time=dwell_time)
+        self.gaze_streamer.add_listener(self.aoi_monitor)
+
+        self.audit_log = AuditLog(audit_folder) if audit_folder else None
+        # jobs carry the station id, e.g. for the folder received EDF files go to
+        self.jobs = JobRegistry(self.worker, on_start=self._job_started, on_finish=self._job_finished,
+                                station=id)
+        self.metrics = StationMetrics()
+        self.host_screen = HostScreen(self.worker, tracker, BACKDROPS, min_interval=host_screen_interval)
+        self.messages = MessagePolicy(self.worker, tracker, rules=message_rules, limit=message_limit)
+        self._waiting = set()  # futures of the commands waiting for the worker
+        self._waiting_lock = threading.Lock()
+        if hasattr(tracker, 'idle_callback'):
+            # cancelling a setup or drift check reaches the worker this way;
+            # pylink.EyeLink has no such callback, see _leave_setup_on_cancel
+            tracker.idle_callback = self.worker.run_urgent
+
+    def start(self):
+        self.worker.start()
+        if self.audit_log is not None:
+            self.audit_log.start()
+        MESSAGE_LISTENERS.append(self._on_message)
+        RECORDING_LISTENERS.append(self._on_recording)
+        if self.tracker is not None:
+            self.clock_refresher.start()
+            self.gaze_streamer.start()
+
+    def stop(self):
+        """Stop the station's threads after the work already queued."""
+        MESSAGE_LISTENERS.remove(self._on_message)
+        RECORDING_LISTENERS.remove(self._on_recording)
+        if self.tracker is not None:
+            self.clock_refresher.stop()
+            self.gaze_streamer.stop()
+        self.messages.stop()
+        self.worker.stop()
+        if self.audit_log is not None:
+            self.audit_log.stop()
+
+    def _on_message(self, tracker, text):
+        if tracker is self.tracker:
+            self.interest_areas.handle_message(text)
+
+    def _on_recording(self, tracker, recording):
+        if tracker is self.tracker:
+            self.host_screen.recording = recording
+
+    def dispatch(self, spec, args, event_time=None):
+        """Make the pylink call for one command. Runs on the worker thread.
+
+        event_time (server_clock_ms) back-dates a sendMessage to when the
+        event happened in the browser. Returns a dict of extra response
+        fields.
+        """
+        sent_time = server_clock_ms()
+        extra = spec.run(self.tracker, args, event_time)
+
+        # Host PC time the command reached the tracker; a back-dated message
+        # is stamped offset ms earlier
+        tracker_time, uncertainty = self.clock.estimate(sent_time)
+        extra['server_time'] = sent_time
+        if tracker_time is not None:
+            extra['tracker_time'] = tracker_time - extra.get('offset', 0)
+            extra['tracker_time_uncertainty'] = uncertainty
+        return extra
+
+    def execute(self, command, event_time=None):
+        """Run one command (see _execute) and record it in the metrics and audit log."""
+        received = server_clock_ms()
+        wall_time = time.time()
+        result, status = self._execute(command, event_time)
+        completed = server_clock_ms()
+        if 'job' in result:
+            return result, status  # recorded once the job has finished, see _job_finished
+        try:
+            name, args = parse_command(command)
+        except CommandError:
+            name, args = None, ()
+        if name in COMMANDS:  # any other name a client sends would add a metrics entry
+            self.metrics.record(name, result.get('status'), received, result.get('server_time'), completed)
+        if self.audit_log is None:
+            return result, status
+        if status == 200 and name == 'openEDF':
+            self.audit_log.rotate(args[0])  # one log file per EDF session
+        self.audit_log.record(received=received, time=wall_time, dispatched=result.get('server_time'),
+                              completed=completed, request=command, event_time=event_time,
+                              status=result.get('status'), http_status=status, message=result.get('message'),
+                              tracker_time=result.get('tracker_time'), offset=result.get('offset'))
+        return result, status
+
+    def _execute(self, command, event_time=None):
+        """Validate and run one command, a legacy string or {"name", "args"}.
+
+        The pylink call is queued on the station's worker and this thread
+        waits for it, up to the command's timeout. Returns a
+        (response_dict, http_status) tuple so that every endpoint reports
+        results in exactly the same shape.
+        """
+        received_time = time.time()
+
+        try:
+            command_name, raw_args = parse_command(command)
+            spec, args = lookup(command_name, raw_args)
+        except CommandError as e:
+            return {'status': 'error', 'message': str(e)}, 400
+        argument = ', '.join(str(arg) for arg in args)
+
+        if command_name == 'sendMessage':
+            # while a job holds the worker even critical messages wait, in order
+            held = self.messages.submit(args[0], event_time, hold=self.jobs.running() is not None)
+            if held is not None:
+                held[0]['latency'] = time.time() - received_time
+                return held
+
+        if spec.job:
+            try:
+                job = self.jobs.start(command_name, lambda job: spec.run(self.tracker, args, job=job), args,
+                                      priority=spec.priority)
+            except TooManyJobs as e:
+                print(f"Command '{command_name}' refused: {e}")
+                return {'status': 'error', 'message': f'Command "{command_name}" refused: {e}'}, 429
+            print(f"Command '{command_name}' with argument '{argument}' started as job {job.id}")
+            return {'status': 'success', 'message': f'Command "{command_name}" started as job {job.id}',
+                    'job': job.state(), 'latency': time.time() - received_time}, 202
+
+        # A job holds the worker until it ends; fail at once rather than
+        # queue behind it until the timeout
+        busy = self.jobs.running()
+        if busy is not None:
+            if command_name == 'sendMessage':
+                return self._hold_message(args[0], event_time, received_time)  # the job started meanwhile
+            return self._refuse_busy(command_name, busy)
+
+        future = None
+        try:
+            if spec.prepare is not None:
+                args = spec.prepare(*args)
+            future = self.worker.submit(self.dispatch, spec, args, event_time, priority=spec.priority)
+            with self._waiting_lock:
+                self._waiting.add(future)
+            if self.jobs.running() is not None:
+                future.cancel()  # a job started before the command was in _waiting
+            try:
+                extra = future.result(timeout=spec.timeout)
+            finally:
+                with self._waiting_lock:
+                    self._waiting.discard(future)
+            send_time = time.time()
+            print(f"Command '{command_name}' executed with argument '{argument}'")
+            if command_name == 'sendMessage':
+                extra['backpressure'] = self.messages.backpressure()
+            return {'status': 'success', 'message': f'Command "{command_name}" executed with argument "{argument}"',
+                    'latency': send_time - received_time, **extra}, 200
+        except concurrent.futures.CancelledError:
+            # a job started on the worker while the command was queued
+            if command_name == 'sendMessage':
+                return self._hold_message(args[0], event_time, received_time)
+            return self._refuse_busy(command_name, self.jobs.running())
+        except concurrent.futures.TimeoutError:
+            if future is not None:
+                future.cancel()
+            print(f"Command {command_name} with argument '{argument}' timed out after {spec.timeout} s")
+            return {'status': 'error', 'message': f'Command "{command_name}" timed out after {spec.timeout} s'}, 504
+        except Exception as e:
+            print(f"Error executing command {command_name} with argument '{argument}': {str(e)}")
+            return {'status': 'error', 'message': str(e)}, 500
+
+    def _hold_message(self, text, event_time, received_time):
+        """Hold a message that a job kept from the worker, to be sent once the job has finished."""
+        result, status = self.messages.submit(text, event_time, hold=True)
+        result['latency'] = time.time() - received_time
+        return result, status
+
+    def _refuse_busy(self, command_name, busy):
+        if busy is None:  # the job has finished already
+            print(f"Command '{command_name}' refused, a job took the tracker")
+            return {'status': 'error', 'message': 'Tracker busy with a job'}, 409
+        print(f"Command '{command_name}' refused, job {busy.id} ({busy.name}) is running")
+        return {'status': 'error', 'message': f'Tracker busy with job {busy.id} ({busy.name})',
+                'running_job': busy.state()}, 409
+
+    def _job_started(self, job):
+        """Refuse the commands queued behind a job rather than let them wait for it. Runs on the worker."""
+        with self._waiting_lock:
+            waiting = list(self._waiting)
+        for future in waiting:
+            future.cancel()  # only succeeds for those that have not started
+
+    def update_host_screen(self, changes):
+        """Edit and redraw the Host screen scene (see host_screen.py), recorded like a command.
+
+        Returns a (response_dict, http_status) tuple.
+        """
+        received = server_clock_ms()
+        busy = self.jobs.running()
+        if busy is not None:
+            result, status = {'status': 'error', 'message': f'Tracker busy with job {busy.id} ({busy.name})',
+                              'running_job': busy.state()}, 409
+        else:
+            try:
+                result, status = {'status': 'success', **self.host_screen.update(changes)}, 200
+            except (ValueError, OSError) as e:
+                result, status = {'status': 'error', 'message': str(e)}, 400
+            except concurrent.futures.TimeoutError:
+                result, status = {'status': 'error', 'message': 'Host screen update timed out'}, 504
+            except Exception as e:
+                print(f'Error updating the Host screen: {e}')
+                result, status = {'status': 'error', 'message': str(e)}, 500
+        completed = server_clock_ms()
+        self.metrics.record('hostScreen', result['status'], received, None, completed)
+        if self.audit_log is not None:
+            self.audit_log.record(received=received, time=time.time(), completed=completed,
+                                  request={'name': 'hostScreen', 'args': [changes]}, status=result['status'],
+                                  http_status=status, message=result.get('message'))
+        return result, status
+
+    def _job_finished(self, job):
+        """Record a finished job in the metrics and audit log, on the server clock."""
+        if job.name in ('doTrackerSetup', 'doDriftCorrect'):
+            self.host_screen.invalidate()  # the setup screens draw over the Host screen
+        completed = server_clock_ms()
+        received = completed - (job.finished - job.created) * 1000
+        dispatched = completed - (job.finished - job.started) * 1000 if job.started is not None else None
+        status = {'done': 'success', 'cancelled': 'cancelled'}.get(job.status, 'error')
+        self.metrics.record(job.name, status, received, dispatched, completed)
+        if self.audit_log is not None:
+            self.audit_log.record(received=received, time=job.created, dispatched=dispatched, completed=completed,
+                                  request={'name': job.name, 'args': list(job.args)}, job=job.id,
+                                  status=status, message=job.error, result=job.result)
+
+    def state(self):
+        return {'id': self.id, 'connected': self.tracker is not None, 'pending': self.worker.pending(),
+                'jobs': sum(1 for job in self.jobs.jobs() if job.finished is None),
+                'samples': self.sample_buffer.state(), 'clock': self.clock.state(),
+                'host_screen': self.host_screen.state()['stats'], 'messages': self.messages.state(),
+                'commands': self.metrics.state()}
+
+
+class StationRegistry:
+    """The stations of the server by id; the first one added is the default."""
+
+    def __init__(self):
+        self.default = None
+        self._stations = {}
+        self._lock = threading.Lock()
+
+    def add(self, station):
+        with self._lock:
+            if station.id in self._stations:
+                raise ValueError(f'Station {station.id} already exists')
+            self._stations[station.id] = station
+            if self.default is None:
+                self.default = station.id
+        station.start()
+        return station
+
+    def get(self, station_id=None):
+        """The station with this id, the default one for None, or None if unknown."""
+        with self._lock:
+            return self._stations.get(self.default if station_id is None else station_id)
+
+    def stations(self):
+        with self._lock:
+            return list(self._stations.values())
+
+    def stop(self):
+        """Stop and forget every station."""
+        with self._lock:
+            stopping = list(self._stations.values())
+            self._stations.clear()
+            self.default = None
+        for station in stopping:
+            station.stop()
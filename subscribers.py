@@ -0,0 +1,43 @@
+"""Bounded queues of the clients subscribed to a stream of updates.
+
+Each subscriber, e.g. a WebSocket handler, gets its own queue.Queue and
+reads it at its own pace. Publishing never blocks: a client that does not
+read loses what does not fit in its queue, rather than holding up the
+thread that publishes, which is often the sample acquisition loop.
+"""
+
+import queue
+import threading
+
+
+class Subscribers:
+    def __init__(self):
+        self._queues = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queues)
+
+    def subscribe(self, maxsize=1000):
+        """A new queue.Queue that receives every item published from now on."""
+        subscription = queue.Queue(maxsize)
+        with self._lock:
+            self._queues.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._queues:
+                self._queues.remove(subscription)
+
+    def publish(self, items):
+        """Put each of items on every queue that has room for it."""
+        with self._lock:
+            subscriptions = list(self._queues)
+        for subscription in subscriptions:
+            for item in items:
+                try:
+                    subscription.put_nowait(item)
+                except queue.Full:
+                    pass
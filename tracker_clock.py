@@ -0,0 +1,127 @@
+"""Model of the Host PC (tracker) clock in terms of the server clock.
+
+The tracker clock is read periodically on the tracker worker thread. Each
+reading is bracketed by two server_clock_ms() stamps; the tracker read the
+value somewhere inside that bracket, so its midpoint is the best guess and
+half its width the error. A straight line (offset and rate) through the
+tightest half of the recent readings maps any server time to tracker time.
+"""
+
+import collections
+import concurrent.futures
+import threading
+
+from clock_sync import server_clock_ms
+from tracker_worker import PRIORITY_BULK
+
+# Rate is only fitted once readings span this long, and is clamped to a
+# plausible range around 1.0
+MIN_RATE_SPAN_MS = 10000.0
+MAX_RATE_ERROR = 1e-3
+# Allowance for drift since the last reading when quoting uncertainty
+DRIFT_ALLOWANCE = 1e-4
+
+
+def read_tracker_clock(tracker):
+    """Read the tracker clock in ms, bracketed by server clock stamps.
+
+    Must run on the thread that owns the tracker. Returns
+    (before_ms, tracker_ms, after_ms).
+    """
+    before = server_clock_ms()
+    if hasattr(tracker, 'trackerTimeUsec'):
+        tracker_ms = tracker.trackerTimeUsec() / 1000.0
+    else:
+        tracker_ms = float(tracker.trackerTime())
+    after = server_clock_ms()
+    return before, tracker_ms, after
+
+
+class TrackerClockModel:
+    def __init__(self, window=60):
+        self._readings = collections.deque(maxlen=window)  # (server_ms, tracker_ms, half_width)
+        self._lock = threading.Lock()
+        self.reference_time = None  # server ms
+        self.offset = None  # tracker ms at reference_time
+        self.rate = 1.0  # tracker ms per server ms
+        self.residual = 0.0  # largest fit error of the readings used, ms
+        self.bracket = None  # narrowest half bracket of the readings used, ms
+        self.last_reading = None  # server ms
+
+    def add_reading(self, before, tracker_ms, after):
+        with self._lock:
+            self._readings.append(((before + after) / 2.0, tracker_ms, (after - before) / 2.0))
+            self.last_reading = after
+            self._refit()
+
+    def _refit(self):
+        readings = sorted(self._readings, key=lambda r: r[2])
+        best = readings[:max(1, len(readings) // 2)]
+
+        n = len(best)
+        mean_s = sum(r[0] for r in best) / n
+        mean_t = sum(r[1] for r in best) / n
+        span = max(r[0] for r in best) - min(r[0] for r in best)
+        if n < 3 or span < MIN_RATE_SPAN_MS:
+            rate = 1.0
+        else:
+            var_s = sum((r[0] - mean_s) ** 2 for r in best)
+            rate = sum((r[0] - mean_s) * (r[1] - mean_t) for r in best) / var_s
+            rate = max(1.0 - MAX_RATE_ERROR, min(1.0 + MAX_RATE_ERROR, rate))
+
+        self.reference_time = mean_s
+        self.offset = mean_t
+        self.rate = rate
+        self.residual = max(abs(r[1] - (mean_t + rate * (r[0] - mean_s))) for r in best)
+        self.bracket = best[0][2]
+
+    @property
+    def ready(self):
+        return self.offset is not None
+
+    def estimate(self, server_ms):
+        """Return (tracker_ms, uncertainty_ms) for a server_clock_ms() time."""
+        with self._lock:
+            if self.offset is None:
+                return None, None
+            tracker_ms = self.offset + self.rate * (server_ms - self.reference_time)
+            age = abs(server_ms - self.last_reading)
+            return tracker_ms, self.bracket + self.residual + age * DRIFT_ALLOWANCE
+
+    def state(self):
+        with self._lock:
+            return {'reference_time': self.reference_time, 'offset': self.offset, 'rate': self.rate,
+                    'residual': self.residual, 'bracket': self.bracket,
+                    'readings': len(self._readings), 'last_reading': self.last_reading}
+
+
+class TrackerClockRefresher(threading.Thread):
+    """Feeds a TrackerClockModel with a reading every interval seconds.
+
+    Readings are queued on the tracker worker at bulk priority so they never
+    delay messages; the bracket is taken inside the worker, so queueing time
+    does not affect accuracy.
+    """
+
+    def __init__(self, model, worker, tracker, interval=1.0):
+        super().__init__(name='tracker-clock', daemon=True)
+        self.model = model
+        self.worker = worker
+        self.tracker = tracker
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                reading = self.worker.call(read_tracker_clock, self.tracker,
+                                           priority=PRIORITY_BULK, timeout=self.interval * 5)
+                self.model.add_reading(*reading)
+            except concurrent.futures.TimeoutError:
+                pass  # the worker is busy with a long call; try again later
+            except Exception as e:
+                print(f'Error reading tracker clock: {e}')
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,91 @@
+"""Single thread that owns every pylink call.
+
+pylink is not thread safe, and some calls (doTrackerSetup, stopRecording,
+receiveDataFile) take a long time. Request handlers therefore never touch
+the tracker directly: they submit a callable to the TrackerWorker and wait
+on the returned Future. Work is taken from a priority queue so that
+time-critical messages overtake bulk drawing commands.
+
+Work submitted as urgent (submit_urgent) runs at control priority, or
+sooner if the worker is inside a blocking call such as doTrackerSetup whose
+tracker calls run_urgent() meanwhile, as the simulated tracker's
+idle_callback does. This is how a running calibration is left through
+exitCalibration() without touching pylink from another thread; pylink.EyeLink
+has no such callback (see _leave_setup_on_cancel in commands.py).
+"""
+
+import concurrent.futures
+import itertools
+import queue
+import threading
+
+# Lower value runs first. Items with equal priority run in submission order.
+PRIORITY_MESSAGE = 0  # sendMessage: event markers, timing critical
+PRIORITY_CONTROL = 1  # recording/mode changes and anything not listed
+PRIORITY_BULK = 2     # sendCommand: host drawing and configuration traffic
+
+
+class TrackerWorker(threading.Thread):
+    def __init__(self, name='tracker-worker'):
+        super().__init__(name=name, daemon=True)
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()  # tie breaker, keeps FIFO order
+        self._urgent = queue.SimpleQueue()
+
+    def submit(self, fn, *args, priority=PRIORITY_CONTROL):
+        """Queue fn(*args) to run on the worker thread and return a Future."""
+        future = concurrent.futures.Future()
+        self._queue.put((priority, next(self._counter), future, fn, args))
+        return future
+
+    def submit_urgent(self, fn, *args):
+        """Queue fn(*args) at control priority, to run early through run_urgent()."""
+        future = concurrent.futures.Future()
+        self._urgent.put((future, fn, args))
+        self.submit(self.run_urgent, priority=PRIORITY_CONTROL)
+        return future
+
+    def run_urgent(self):
+        """Run the urgent work queued so far. Only call this on the worker thread."""
+        while True:
+            try:
+                future, fn, args = self._urgent.get_nowait()
+            except queue.Empty:
+                return
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+    def call(self, fn, *args, priority=PRIORITY_CONTROL, timeout=None):
+        """Submit fn(*args) and block until it returns or timeout expires.
+
+        On timeout the call is cancelled if it has not started yet and
+        concurrent.futures.TimeoutError is raised.
+        """
+        future = self.submit(fn, *args, priority=priority)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        # sorts after every real item, so queued work is finished first
+        self._queue.put((float('inf'), next(self._counter), None, None, None))
+
+    def run(self):
+        while True:
+            _, _, future, fn, args = self._queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue  # the caller gave up waiting before we got to it
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:  # keep the worker alive whatever happens
+                future.set_exception(e)